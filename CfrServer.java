@@ -0,0 +1,50 @@
+import java.io.BufferedReader;
+import java.io.FileDescriptor;
+import java.io.FileOutputStream;
+import java.io.InputStreamReader;
+import java.io.PrintStream;
+import java.util.Arrays;
+import java.util.HashMap;
+import java.util.Map;
+
+import org.benf.cfr.reader.api.CfrDriver;
+
+/**
+ * Long-lived CFR process used by cfr_worker.py, so the JVM starts and warms up once per analysis.
+ *
+ * Started with `java -cp cfr-0.152.jar CfrServer.java` (Java 11+). Reads one job per line from stdin:
+ *
+ *     <output dir> TAB <jar filter regex, may be empty> TAB <jar> [TAB <jar> ...]
+ *
+ * and answers every job with one line on stdout: `OK` or `ERROR <TAB> <message>`.
+ */
+public class CfrServer {
+    public static void main(String[] args) throws Exception {
+        BufferedReader in = new BufferedReader(new InputStreamReader(System.in, "UTF-8"));
+        PrintStream out = new PrintStream(new FileOutputStream(FileDescriptor.out), true, "UTF-8");
+        // CFR reports progress on stdout; keep it off the protocol channel
+        System.setOut(System.err);
+        String line;
+        while ((line = in.readLine()) != null) {
+            if (line.isEmpty()) {
+                continue;
+            }
+            String[] parts = line.split("\t", -1);
+            try {
+                if (parts.length < 3) {
+                    throw new IllegalArgumentException("Expected <output dir> <jar filter> <jar>...");
+                }
+                Map<String, String> options = new HashMap<>();
+                options.put("outputdir", parts[0]);
+                if (!parts[1].isEmpty()) {
+                    options.put("jarfilter", parts[1]);
+                }
+                CfrDriver driver = new CfrDriver.Builder().withOptions(options).build();
+                driver.analyse(Arrays.asList(Arrays.copyOfRange(parts, 2, parts.length)));
+                out.println("OK");
+            } catch (Throwable e) {
+                out.println("ERROR\t" + String.valueOf(e).replace('\n', ' ').replace('\t', ' '));
+            }
+        }
+    }
+}
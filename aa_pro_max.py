@@ -1,93 +1,381 @@
 import os
+import re
 import sys
+import argparse
 import subprocess
-import yaml
 import xml.etree.ElementTree as ET
-import re
 from collections import defaultdict
-import networkx as nx
-import requests
-import glob
-from pyvis.network import Network
-from flask import Flask, render_template_string, send_from_directory
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 import json
+import logging
+import time
+import gzip
+import hashlib
+import threading
+from html import escape as html_escape
+import shutil
+import tarfile
+import zipfile
+from image_extractor import extract_jars, image_digest, LayerCache
+from class_scanner import annotated_classes, scan_jar
+from cfr_worker import CfrWorker
+from jar_archive import read_application_ymls
+from source_scanner import scan_source_tree
+from root_discovery import DEFAULT_PRUNE, discover_services
+from analysis_manifest import AnalysisManifest, file_sha256
+from topology import ServiceGraph, Topology
+from eureka_client import DEFAULT_EUREKA_URL, EurekaClient
+from pod_inventory import PodInventory
+from topology_refresher import GRAPHS, TopologyRefresher
+from topology_collector import TopologyCollector
+from metrics import metrics
+from service_artifact import ArtifactError, ServiceArtifact, load_artifact, save_artifact
+from policy_reconcile import (ApiServerBackend, KubectlBackend, format_diff, is_discovery_policy, policy_labels,
+                              reconcile)
 
 # Version: 1.0
 # Usage Example: python aa_pro_max.py ./main-api.tar ./cfr-0.152.jar output
 
 # Create graph objects
-graph = nx.DiGraph()
+graph = ServiceGraph()
 service_discovery = "containerized-discovery"
 # Dictory to store the service name as key and corresponding app label name
 service_to_app_label_dict = {}
 # Dictory to store the app label as key and corresponding application name
 app_label_to_service_dict = {}
+# Service name -> the images and JAR files it was found in and its gateway routes and Feign clients, see init()
+service_evidence = {}
+# Layer cache of the current process, see get_layer_cache()
+layer_cache = None
+# CFR worker of the current process, see get_cfr_worker()
+cfr_worker = None
+# Eureka client of the current process, see get_eureka_client()
+eureka_client = None
+# Pods of the discovered app labels, see get_pod_inventory()
+pod_inventory = None
+# Background builder of the dashboard graphs, see get_topology_refresher()
+topology_refresher = None
+# Concurrent fetcher of the Eureka registry and the pods, see get_topology_collector()
+topology_collector = None
 
-# Parse command line arguments
-if len(sys.argv) < 5:
-    print('Usage: python aa_pro_max.py <docker_image_tar_folder> <cfr_tool_path> <output_directory> <namespace> <root_dir>')
-    sys.exit(1)
-DOCKER_IMAGE_TAR_FOLDER = sys.argv[1]
-CFR_TOOL_PATH = sys.argv[2]
-OUTPUT_DIRECTORY = sys.argv[3]
-NAMESPACE = sys.argv[4]
-ROOT_DIR = sys.argv[5]
+# Settings of the current command, see configure()
+DOCKER_IMAGE_TAR_FOLDER = None
+CFR_TOOL_PATH = None
+OUTPUT_DIRECTORY = None
+NAMESPACE = None
+ROOT_DIR = None
+EXTRACT_MODE = 'stream'
+JOBS = 1
+DECOMPILE = False
+DECOMPILE_ALL = False
+PRUNE = []
+NO_DISCOVERY_CACHE = False
+LAYER_CACHE_DIR = None
+EUREKA_URL = DEFAULT_EUREKA_URL
+REFRESH_INTERVAL = 60
+REFRESH_ON_CHANGE = False
+WATCH_PODS = False
+COLLECT_CONCURRENCY = 8
+COLLECT_TIMEOUT = 30
+LAYOUT = 'server'
+POLICY_MODE = 'pod'
+APPLY_BACKEND = 'kubectl'
+API_SERVER = None
+APPLY_CONCURRENCY = 8
+ARTIFACT = None
+# How long a request waits for the first topology snapshot before answering 503
+SNAPSHOT_TIMEOUT = 30
+# Parsed command line of the current command, passed on to the worker processes of init()
+args = None
 
+COMMANDS = ('analyze', 'generate', 'apply', 'serve')
+# Positional arguments of every command, as in the versions without commands
+POSITIONALS = ('docker_image_tar_folder', 'cfr_tool_path', 'output_directory', 'namespace', 'root_dir')
+# Where analyze writes the service graph artifact, relative to <output_directory>
+ARTIFACT_FILENAME = 'service_graph.json.gz'
+LOG_FORMAT = '%(asctime)s %(levelname)-7s %(name)s: %(message)s'
+logger = logging.getLogger('aa_pro_max')
 
-def init():
-    # Loop through the root directory to find the application.yml and deployment.yml files
-    # We can get the service name from the application.yml file and the app label name from the deployment.yml file
-    for foldername, subfolders, filenames in os.walk(ROOT_DIR):
-        application_file = None
-        deployment_file = None
-        # Check if the application.yml and deployment.yml files exist
-        if 'k8s' in subfolders and 'deployment.yml' in os.listdir(os.path.join(foldername, 'k8s')):
-            deployment_file = os.path.join(foldername, 'k8s', 'deployment.yml')
-            with open(deployment_file, 'r') as f:
-                deployment_yaml = yaml.safe_load(f)
-        if 'src' in subfolders and 'main' in os.listdir(os.path.join(foldername, 'src')):
-            for subfoldername, _, subfilenames in os.walk(os.path.join(foldername, 'src', 'main')):
-                if 'resources' in subfoldername and 'application.yml' in subfilenames:
-                    application_file = os.path.join(subfoldername, 'application.yml')
-                    with open(application_file, 'r') as f:
-                        application_yaml = yaml.safe_load(f)
-        # If both files exist, add the application name and service name to the dictionary
-        if application_file is not None and deployment_file is not None:
-            service_to_app_label_dict[application_yaml.get('spring', {}).get('application', {}).get(
-                'name')] = deployment_yaml.get('metadata', {}).get('labels', {}).get('app')
-            app_label_to_service_dict[deployment_yaml.get('metadata', {}).get('labels', {}).get(
-                'app')] = application_yaml.get('spring', {}).get('application', {}).get('name')        
-            
-    # Create a list to store the service names
-    services = []
-    # Create a dictionary to store the service names and corresponding calls
-    names_calls = defaultdict(list)
 
-    for index, filename in enumerate(os.listdir(DOCKER_IMAGE_TAR_FOLDER)):
-        file_path = os.path.join(DOCKER_IMAGE_TAR_FOLDER, filename)
-        name = '/' + filename.split(".")[0]
-        # Check if the Docker image .tar file exists
-        if not os.path.exists(file_path):
-            print(
-                f'[!] The Docker image .tar file does not exist: {file_path}')
-            sys.exit(1)
-        # Check if the CFR tool exists
-        if not os.path.exists(CFR_TOOL_PATH):
-            print(f'[!] The CFR tool does not exist: {CFR_TOOL_PATH}')
-            sys.exit(1)
+def build_parser():
+    """Return the parser of the analyze, generate, apply and serve commands."""
+    # Options of every command: how the Docker images are analyzed
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--extract-mode', choices=['stream', 'tar'], default='stream',
+                        help='stream: read the image tars in-process and write out only the JAR files (default); '
+                             'tar: untar the whole image and every layer to disk')
+    common.add_argument('--layer-cache', metavar='DIR',
+                        help='directory of the layer cache shared by all images and runs in stream mode '
+                             '(default: <output_directory>/layer_cache)')
+    common.add_argument('--no-layer-cache', action='store_true',
+                        help='extract every image into its own extracted_layers directory instead of using the '
+                             'layer cache')
+    common.add_argument('--jobs', type=int, default=1, metavar='N',
+                        help='number of Docker images to analyze concurrently in worker processes (default: 1)')
+    common.add_argument('--decompile', action='store_true',
+                        help='decompile the JAR files with CFR and search the Java sources for the annotations '
+                             'instead of reading them from the class files')
+    common.add_argument('--decompile-all', action='store_true',
+                        help='with --decompile, decompile every class of the JAR files instead of only the classes '
+                             'that reference @FeignClient or @EnableEurekaServer')
+    common.add_argument('--prune', action='append', default=[], metavar='PATTERN',
+                        help='directory name pattern to skip while searching <root_dir> for services, in addition '
+                             f'to {", ".join(DEFAULT_PRUNE)} (can be repeated)')
+    common.add_argument('--no-discovery-cache', action='store_true',
+                        help='always walk <root_dir> instead of reusing the cached service/app label maps')
+    common.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], default='INFO',
+                        help='DEBUG also logs every layer, JAR file and annotation found (default: INFO)')
 
-        # Create the output directory
-        os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
+    # Arguments of the commands that read the topology of the cluster
+    cluster = argparse.ArgumentParser(add_help=False)
+    cluster.add_argument('--artifact', metavar='FILE',
+                         help='load the service graph from an artifact written by analyze instead of analyzing the '
+                              'Docker images')
+    cluster.add_argument('--eureka-url', default=DEFAULT_EUREKA_URL, metavar='URL',
+                         help=f'base URL of the Eureka REST API (default: {DEFAULT_EUREKA_URL})')
+    cluster.add_argument('--collect-concurrency', type=int, default=8, metavar='N',
+                         help='maximum number of concurrent Eureka and kubectl calls when collecting the topology '
+                              '(default: 8)')
+    cluster.add_argument('--collect-timeout', type=float, default=30, metavar='SECONDS',
+                         help='give up a single Eureka or kubectl call after this long and keep its previous result '
+                              '(default: 30)')
+    cluster.add_argument('--policy-mode', choices=['pod', 'service'], default='pod',
+                         help='pod: one NetworkPolicy per pod IP from the Eureka instances (default); '
+                              'service: one NetworkPolicy per service of the service graph, selecting pods by app '
+                              'label')
 
-        # Check if the Docker image has already been extracted
-        if os.path.exists(OUTPUT_DIRECTORY + name + '/docker_image'):
-            print(f"[!] The Docker image has already been extracted: {name}")
-        else:
-            # Create the output directory
-            os.makedirs(OUTPUT_DIRECTORY + name + '/docker_image', exist_ok=True)
-            # Extract the Docker image .tar file
-            subprocess.run(['tar', '-xf', file_path, '-C',
-                        OUTPUT_DIRECTORY + name + '/docker_image'])
+    # Arguments of the commands that change the network policies of the cluster
+    applying = argparse.ArgumentParser(add_help=False)
+    applying.add_argument('--apply-backend', choices=['kubectl', 'api'], default='kubectl',
+                          help='kubectl: apply all changed policies in one server-side apply (default); '
+                               'api: send them straight to the API server over a pooled HTTP session')
+    applying.add_argument('--api-server', metavar='URL',
+                          help='API server URL for --apply-backend api, e.g. the URL of kubectl proxy '
+                               '(default: the in-cluster API server)')
+    applying.add_argument('--apply-concurrency', type=int, default=8, metavar='N',
+                          help='maximum number of concurrent requests of --apply-backend api (default: 8)')
+
+    # Arguments of the dashboard
+    dashboard = argparse.ArgumentParser(add_help=False)
+    dashboard.add_argument('--watch-pods', action='store_true',
+                           help='keep the pod IPs current with a background kubectl watch instead of listing the '
+                                'pods on every request')
+    dashboard.add_argument('--refresh-interval', type=float, default=60, metavar='SECONDS',
+                           help='how often the dashboard graphs are rebuilt in the background (default: 60)')
+    dashboard.add_argument('--refresh-on-change', action='store_true',
+                           help='also rebuild the dashboard graphs as soon as a pod changes (implies --watch-pods)')
+    dashboard.add_argument('--layout', choices=['server', 'browser'], default='server',
+                           help='server: compute the node positions of the dashboard graphs once per snapshot and '
+                                'turn the browser physics off (default); browser: let every browser tab run the '
+                                'barnesHut physics')
+
+    parser = argparse.ArgumentParser(
+        prog='aa_pro_max.py',
+        description='Analyze the Docker images of a Spring Cloud application, generate and apply its network '
+                    'policies, or serve the dashboard. The command can be left out for serve.')
+    subparsers = parser.add_subparsers(dest='command', metavar='{analyze,generate,apply,serve}')
+    subparsers.required = True
+    analyze = subparsers.add_parser('analyze', parents=[common],
+                                    help='analyze the Docker images and write the service graph artifact')
+    for name in POSITIONALS:
+        analyze.add_argument(name)
+    analyze.add_argument('--artifact', metavar='FILE',
+                         help=f'where to write the service graph artifact (default: <output_directory>/'
+                              f'{ARTIFACT_FILENAME})')
+    for command, parents, help_text in (
+            ('generate', [common, cluster], 'also write the network policies to <output_directory>/network_policies'),
+            ('apply', [common, cluster, applying], 'also reconcile the cluster with the network policies'),
+            ('serve', [common, cluster, applying, dashboard],
+             'analyze the Docker images and serve the dashboard (default)')):
+        # With --artifact, the images, the CFR tool and the root directory are not needed
+        subparser = subparsers.add_parser(
+            command, parents=parents, help=help_text,
+            usage=f'%(prog)s [options] {" ".join(f"<{name}>" for name in POSITIONALS)}\n'
+                  f'       %(prog)s [options] --artifact FILE <output_directory> <namespace>')
+        subparser.add_argument('paths', nargs='+', metavar='PATH',
+                               help=f'{", ".join(f"<{name}>" for name in POSITIONALS)}, or only <output_directory> '
+                                    'and <namespace> with --artifact')
+    return parser
+
+
+def parse_args(argv=None):
+    """Parse a command line (sys.argv[1:] by default).
+
+    The five positional arguments of the versions without commands, without a command, run serve.
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv and argv[0] not in COMMANDS and argv[0] not in ('-h', '--help'):
+        argv.insert(0, 'serve')
+    parser = build_parser()
+    parsed_args = parser.parse_args(argv)
+    if parsed_args.command != 'analyze':
+        paths = parsed_args.paths
+        del parsed_args.paths
+        if len(paths) == 2 and parsed_args.artifact:
+            paths = [None, None, paths[0], paths[1], None]
+        elif len(paths) != len(POSITIONALS):
+            parser.error(f'{parsed_args.command} takes {", ".join(f"<{name}>" for name in POSITIONALS)}, or only '
+                         '<output_directory> and <namespace> with --artifact')
+        for name, value in zip(POSITIONALS, paths):
+            setattr(parsed_args, name, value)
+    return parsed_args
+
+
+def configure(parsed_args):
+    """Take the settings of this process from a parsed command line (see parse_args()).
+
+    Options that the command does not have keep their defaults.
+    """
+    global args, DOCKER_IMAGE_TAR_FOLDER, CFR_TOOL_PATH, OUTPUT_DIRECTORY, NAMESPACE, ROOT_DIR, EXTRACT_MODE, JOBS, \
+        DECOMPILE, DECOMPILE_ALL, PRUNE, NO_DISCOVERY_CACHE, LAYER_CACHE_DIR, EUREKA_URL, REFRESH_INTERVAL, \
+        REFRESH_ON_CHANGE, WATCH_PODS, COLLECT_CONCURRENCY, COLLECT_TIMEOUT, LAYOUT, POLICY_MODE, APPLY_BACKEND, \
+        API_SERVER, APPLY_CONCURRENCY, ARTIFACT
+    args = parsed_args
+    options = vars(parsed_args)
+    DOCKER_IMAGE_TAR_FOLDER = parsed_args.docker_image_tar_folder
+    CFR_TOOL_PATH = parsed_args.cfr_tool_path
+    OUTPUT_DIRECTORY = parsed_args.output_directory
+    NAMESPACE = parsed_args.namespace
+    ROOT_DIR = parsed_args.root_dir
+    EXTRACT_MODE = parsed_args.extract_mode
+    JOBS = parsed_args.jobs
+    DECOMPILE = parsed_args.decompile
+    DECOMPILE_ALL = parsed_args.decompile_all
+    PRUNE = parsed_args.prune
+    NO_DISCOVERY_CACHE = parsed_args.no_discovery_cache
+    LAYER_CACHE_DIR = None if parsed_args.no_layer_cache else (
+        parsed_args.layer_cache or os.path.join(OUTPUT_DIRECTORY, 'layer_cache'))
+    EUREKA_URL = options.get('eureka_url', EUREKA_URL)
+    COLLECT_CONCURRENCY = options.get('collect_concurrency', COLLECT_CONCURRENCY)
+    COLLECT_TIMEOUT = options.get('collect_timeout', COLLECT_TIMEOUT)
+    POLICY_MODE = options.get('policy_mode', POLICY_MODE)
+    APPLY_BACKEND = options.get('apply_backend', APPLY_BACKEND)
+    API_SERVER = options.get('api_server', API_SERVER)
+    APPLY_CONCURRENCY = options.get('apply_concurrency', APPLY_CONCURRENCY)
+    REFRESH_INTERVAL = options.get('refresh_interval', REFRESH_INTERVAL)
+    REFRESH_ON_CHANGE = options.get('refresh_on_change', REFRESH_ON_CHANGE)
+    WATCH_PODS = options.get('watch_pods', WATCH_PODS) or REFRESH_ON_CHANGE
+    LAYOUT = options.get('layout', LAYOUT)
+    ARTIFACT = options.get('artifact', ARTIFACT)
+
+
+def init_worker(parsed_args):
+    """Set up a worker process of init() like its parent (needed where workers are spawned rather than forked)."""
+    logging.basicConfig(level=parsed_args.log_level, format=LOG_FORMAT)
+    configure(parsed_args)
+
+
+def get_layer_cache():
+    """Return the layer cache of this process, creating it on first use."""
+    global layer_cache
+    if layer_cache is None:
+        layer_cache = LayerCache(LAYER_CACHE_DIR)
+    return layer_cache
+
+
+def get_eureka_client():
+    """Return the Eureka client of this process, creating it on first use."""
+    global eureka_client
+    if eureka_client is None:
+        eureka_client = EurekaClient(EUREKA_URL)
+    return eureka_client
+
+
+def get_pod_inventory():
+    """Return the pod inventory of the discovered app labels, (re)creating it when the labels change."""
+    global pod_inventory
+    if pod_inventory is None or pod_inventory.labels != sorted(app_label_to_service_dict):
+        if pod_inventory is not None:
+            pod_inventory.stop_watch()
+        pod_inventory = PodInventory(app_label_to_service_dict,
+                                     on_change=get_topology_refresher().trigger if REFRESH_ON_CHANGE else None)
+        if WATCH_PODS:
+            pod_inventory.start_watch()
+    return pod_inventory
+
+
+def get_topology_collector():
+    """Return the topology collector of this process, (re)creating it along with the pod inventory."""
+    global topology_collector
+    inventory = get_pod_inventory()
+    if topology_collector is None or topology_collector.pod_inventory is not inventory:
+        topology_collector = TopologyCollector(get_eureka_client(), inventory, COLLECT_CONCURRENCY, COLLECT_TIMEOUT)
+    return topology_collector
+
+
+def get_topology_refresher():
+    """Return the topology refresher of this process, creating it on first use (it is started by get_snapshot())."""
+    global topology_refresher
+    if topology_refresher is None:
+        topology_refresher = TopologyRefresher(build_topology_graphs, REFRESH_INTERVAL)
+    return topology_refresher
+
+
+def get_snapshot():
+    """Return the latest TopologySnapshot, or None if the first one could not be built in time."""
+    return get_topology_refresher().start().snapshot(timeout=SNAPSHOT_TIMEOUT)
+
+
+def get_policy_backend():
+    """Return the backend that reads and writes the network policies of the cluster."""
+    if APPLY_BACKEND == 'api':
+        return ApiServerBackend.from_environment(API_SERVER, APPLY_CONCURRENCY)
+    return KubectlBackend()
+
+
+def get_cfr_worker():
+    """Return the CFR worker of this process, creating it on first use."""
+    global cfr_worker
+    if cfr_worker is None:
+        cfr_worker = CfrWorker(CFR_TOOL_PATH)
+    return cfr_worker
+
+
+def analyze_image(filename, known_jars=None):
+    """Extract, unpack, decompile and scan one Docker image tar and return what was found in its JAR files.
+
+    This runs in a worker process when --jobs is greater than 1, so it only reads the settings and the
+    service/app label dictionaries and leaves the merge into the global graph state to init().
+    `known_jars` maps the hashes of already analyzed JAR files to their results, which are reused as is.
+    """
+    file_path = os.path.join(DOCKER_IMAGE_TAR_FOLDER, filename)
+    name = '/' + filename.split(".")[0]
+    known_jars = known_jars or {}
+    # What was found in each JAR file of the image
+    jar_results = []
+    # JAR hash -> result (None for JAR files without an application.yml), recorded in the analysis manifest
+    scanned = {}
+
+    metrics.increment('images_analyzed')
+    started = time.perf_counter()
+    jar_files = None
+    if EXTRACT_MODE == 'stream':
+        try:
+            if LAYER_CACHE_DIR is not None:
+                # Use the JAR files of the merged filesystem straight from the layer cache
+                logger.info('Resolving JAR files of the Docker image through the layer cache: %s', file_path)
+                jar_files = get_layer_cache().image_jars(file_path)
+            else:
+                # Stream the image and its layers in-process and write out only the JAR files
+                # (this replaces whatever an earlier version of the image left in extracted_layers)
+                logger.info('Streaming JAR files out of the Docker image: %s', file_path)
+                extract_jars(file_path, OUTPUT_DIRECTORY + name + '/extracted_layers')
+        except (tarfile.TarError, ValueError) as e:
+            # Not a `docker save` tar (e.g. a .DS_Store next to the images); the other images still count
+            logger.warning('Not a readable Docker image, skipping: %s (%s)', file_path, e)
+            metrics.observe('image_extract', time.perf_counter() - started)
+            return {'image': filename, 'jars': [], 'scanned': {}}
+    else:
+        # The image changed since it was last extracted (or never was); start from a clean directory
+        for directory in ('/docker_image', '/extracted_layers'):
+            if os.path.exists(OUTPUT_DIRECTORY + name + directory):
+                shutil.rmtree(OUTPUT_DIRECTORY + name + directory)
+        # Create the output directory
+        os.makedirs(OUTPUT_DIRECTORY + name + '/docker_image', exist_ok=True)
+        # Extract the Docker image .tar file
+        subprocess.run(['tar', '-xf', file_path, '-C',
+                    OUTPUT_DIRECTORY + name + '/docker_image'])
 
         # # Find all the .tar files for each layer
         layer_tar_files = []
@@ -98,133 +386,230 @@ def init():
 
         # Extract each layer
         if len(layer_tar_files) > 0:
-            print(
-                f"[*] {len(layer_tar_files)} layers found in the Docker image.")
-            print("[+] Extracting layers...")
-            # Check if the extracted layers directory exists
-            if os.path.exists(OUTPUT_DIRECTORY + name + '/extracted_layers'):
-                print(
-                    f"[!] The extracted layers directory already exists: {name}")
-            else:
-                # Create the output directory
-                os.makedirs(OUTPUT_DIRECTORY + name +
-                            '/extracted_layers', exist_ok=True)
-                for layer_tar_file in layer_tar_files:
-                    subprocess.run(['tar', '-xf', layer_tar_file, '-C',
-                                OUTPUT_DIRECTORY + name + '/extracted_layers'])
+            logger.debug('%d layers found in the Docker image, extracting them', len(layer_tar_files))
+            # Create the output directory
+            os.makedirs(OUTPUT_DIRECTORY + name +
+                        '/extracted_layers', exist_ok=True)
+            for layer_tar_file in layer_tar_files:
+                subprocess.run(['tar', '-xf', layer_tar_file, '-C',
+                            OUTPUT_DIRECTORY + name + '/extracted_layers'])
         else:
-            print('[!] No layers found in the Docker image.')
+            logger.warning('No layers found in the Docker image: %s', file_path)
 
-        # Find JAR files in the extracted layers
+    # Find JAR files in the extracted layers
+    if jar_files is None:
         jar_files = []
         for root, dirs, files in os.walk(OUTPUT_DIRECTORY + name + '/extracted_layers'):
             for file in files:
                 if file.endswith('.jar'):
                     jar_files.append(os.path.join(root, file))
+    metrics.observe('image_extract', time.perf_counter() - started)
+
+    # If JAR files were found, read their configuration and scan them
+    if len(jar_files) > 0:
+        logger.debug('%d JAR files found in the extracted layers', len(jar_files))
 
-        # # If JAR files were found, decompile them using CFR
-        if len(jar_files) > 0:
-            print(
-                f"[*] {len(jar_files)} JAR files found in the extracted layers.")
-            print("[+] Decompiling JAR files...\n")
-
-            # Check if the output directory exists
-            if not os.path.exists(OUTPUT_DIRECTORY + name + '/jars_decompiled'):           
-                # Create the output directory
-                os.makedirs(OUTPUT_DIRECTORY + name +
-                            '/jars_decompiled', exist_ok=True)
-
-            # Extract the JAR files and use CFR to decompile the JAR files
-            for jar_file in jar_files:
-                print(f'\n[+] Checking JAR file: {jar_file}')
-
-                os.makedirs(OUTPUT_DIRECTORY + name + '/jars_decompiled/' +
-                            jar_file.split('/')[-1], exist_ok=True)
-
-                # Check if the JAR file was already unpacked
-                if os.path.exists(OUTPUT_DIRECTORY + name + '/jars_decompiled/' + jar_file.split('/')[-1] + '/unpacked'):
-                    print('   [+] JAR file was already unpacked.')
-                else:
-                    os.makedirs(OUTPUT_DIRECTORY + name + '/jars_decompiled/' +
-                            jar_file.split('/')[-1] + '/unpacked', exist_ok=True)
-                    # Extract the JAR file
-                    subprocess.run(['unzip', jar_file, '-d', OUTPUT_DIRECTORY + name +
-                                '/jars_decompiled/' + jar_file.split('/')[-1] + '/unpacked'])
-
-                # Check if the directory contains an application.yml file
-                yml_file = None
-                for root, dirs, files in os.walk(OUTPUT_DIRECTORY + name + '/jars_decompiled/' + jar_file.split('/')[-1] + '/unpacked'):
-                    if 'application.yml' in files:
-                        print(
-                            f'   [+] Found application.yml file: {os.path.join(root, "application.yml")}')
-                        yml_file = os.path.join(root, 'application.yml')
-                        break
-
-                # If a yml file was found, parse it and extract the name
-                if yml_file is not None:
-                    # Check if the JAR file was already decompiled
-                    if os.path.exists(OUTPUT_DIRECTORY + name + '/jars_decompiled/' + jar_file.split('/')[-1] + '/decompiled'):
-                        print('   [+] JAR file was already decompiled.')
-                    else:
-                        # Use CFR to decompile the JAR file
-                        print(f'[+] Decompiling JAR file: {jar_file}')
-                        subprocess.run(['java', '-jar', CFR_TOOL_PATH, jar_file, '--outputdir', OUTPUT_DIRECTORY +
-                                    name + '/jars_decompiled/' + jar_file.split('/')[-1] + '/decompiled'])
-
-                    print(f'[+] Parsing application.yml file: {yml_file}')
-                    with open(yml_file, 'r') as f:
-                        data = yaml.safe_load(f)
-                        app_name = data.get('spring', {}).get(
-                            'application', {}).get('name')
-                        if app_name is not None:
-                            print(f'   [+] Found service name: {app_name}')
-                            # Store the folder path and corresponding name
-                            services.append(
-                                [app_name, jar_file.split('/')[-1]])
-                        if 'spring' in data and 'cloud' in data['spring'] and 'gateway' in data['spring']['cloud'] and 'routes' in data['spring']['cloud']['gateway']:
-                            routes = data['spring']['cloud']['gateway']['routes']
-                            route_ids = [route['id'].lower()
-                                         for route in routes]
-                            names_calls[app_name].extend(route_ids)
-                            for id in route_ids:
-                                graph.add_edge(service_to_app_label_dict[app_name], service_to_app_label_dict[id])
-
-                    # Check decompiled source code for @FeignClient annotation
-                    for root, dirs, files in os.walk(OUTPUT_DIRECTORY + name + '/jars_decompiled/' + jar_file.split('/')[-1] + '/decompiled'):
-                        for file_name in files:
-                            if file_name.endswith('.java'):
-                                print(
-                                    f'      [+] Searching for @FeignClient annotation in: {os.path.join(root, file_name)}')
-                                # Open the .java file and search for @FeignClient annotation
-                                with open(os.path.join(root, file_name), 'r') as f:
-                                    for line in f:
-                                        matched = re.search(
-                                            r'@FeignClient\(value="([^"]+)"\)', line)
-                                        if matched:
-                                            print(
-                                                f'         [+] Found @FeignClient annotation: {matched.group(1)}\n')
-                                            # Store the folder path and corresponding name
-                                            callto_name = matched.group(1)
-                                            names_calls[app_name].append(
-                                                callto_name)
-                                            graph.add_edge(
-                                                service_to_app_label_dict[app_name], service_to_app_label_dict[callto_name])
-                                            break
-                                        matched2 = re.search(
-                                            r'@EnableEurekaServer', line)
-                                        if matched2:
-                                            print(
-                                                f'         [+] Found @EnableEurekaServer annotation\n')
-                                            # Store the folder path and corresponding name
-                                            service_discovery = app_name
-                                            break
-                else:
-                    print(
-                        '   [!] No application.yml file found in the JAR file...Skipping.')
+        # Read the application.yml files straight out of the JAR files, nothing is unpacked to disk
+        yml_jars = []
+        for jar_file in jar_files:
+            logger.debug('Checking JAR file: %s', jar_file)
+            with metrics.timer('hash'):
+                jar_hash = file_sha256(jar_file)
+            if jar_hash in known_jars:
+                # The same JAR content was already analyzed, in this image or another one
+                logger.debug('JAR file was already analyzed: %s', jar_file)
+                metrics.increment('jars', result='known')
+                scanned[jar_hash] = known_jars[jar_hash]
+                if known_jars[jar_hash] is not None:
+                    jar_results.append(dict(known_jars[jar_hash], jar=jar_file.split('/')[-1]))
+                continue
+            try:
+                with metrics.timer('unzip'), zipfile.ZipFile(jar_file) as archive:
+                    yml_documents = read_application_ymls(archive, jar_file)
+            except zipfile.BadZipFile:
+                logger.warning('Not a valid JAR file, skipping: %s', jar_file)
+                metrics.increment('jars', result='invalid')
+                scanned[jar_hash] = None
+                continue
+            if yml_documents:
+                for location, _ in yml_documents:
+                    logger.debug('Found application.yml file: %s', location)
+                jar_result = {'jar': jar_file.split('/')[-1], 'sha256': jar_hash, 'service': None, 'routes': [],
+                              'feign_clients': [], 'eureka_server': False}
+                jar_results.append(jar_result)
+                scanned[jar_hash] = jar_result
+                yml_jars.append((jar_file, yml_documents, jar_result))
+                metrics.increment('jars', result='scanned')
+            else:
+                logger.debug('No application.yml file found in the JAR file, skipping: %s', jar_file)
+                metrics.increment('jars', result='no_application_yml')
+                scanned[jar_hash] = None
+
+        if DECOMPILE:
+            # Decompile all the JAR files of the image in one batch on the long-lived CFR worker
+            decompile_jobs = []
+            for jar_file, _, _ in yml_jars:
+                # Sources of an earlier version of the JAR file are stale
+                decompiled_dir = OUTPUT_DIRECTORY + name + '/jars_decompiled/' + jar_file.split('/')[-1] + '/decompiled'
+                if os.path.exists(decompiled_dir):
+                    shutil.rmtree(decompiled_dir)
+                # Only decompile the classes that reference the annotations unless asked for the whole JAR
+                with metrics.timer('scan'):
+                    class_names = None if DECOMPILE_ALL else annotated_classes(jar_file)
+                logger.debug('Decompiling JAR file: %s', jar_file)
+                decompile_jobs.append((jar_file, decompiled_dir, class_names))
+            if decompile_jobs:
+                with metrics.timer('decompile'):
+                    get_cfr_worker().decompile(decompile_jobs)
+
+        for jar_file, yml_documents, jar_result in yml_jars:
+            # Parse the yml files and extract the name
+            for location, data in yml_documents:
+                logger.debug('Parsing application.yml file: %s', location)
+                app_name = data.get('spring', {}).get(
+                    'application', {}).get('name')
+                # The plain application.yml comes first; profile files only fill in what it lacks
+                if jar_result['service'] is None and app_name is not None:
+                    logger.debug('Found service name: %s', app_name)
+                    jar_result['service'] = app_name
+                if 'spring' in data and 'cloud' in data['spring'] and 'gateway' in data['spring']['cloud'] and 'routes' in data['spring']['cloud']['gateway']:
+                    routes = data['spring']['cloud']['gateway']['routes']
+                    route_ids = [route['id'].lower()
+                                 for route in routes]
+                    jar_result['routes'].extend(route_id for route_id in route_ids
+                                                if route_id not in jar_result['routes'])
+
+            if DECOMPILE:
+                # Check decompiled source code for @FeignClient and @EnableEurekaServer annotations
+                decompiled_dir = OUTPUT_DIRECTORY + name + '/jars_decompiled/' + jar_file.split('/')[-1] + '/decompiled'
+                logger.debug('Searching for @FeignClient and @EnableEurekaServer annotations in: %s', decompiled_dir)
+                with metrics.timer('scan'):
+                    annotations = scan_source_tree(decompiled_dir)
+                for callto_name in annotations['feign_clients']:
+                    logger.debug('Found @FeignClient annotation: %s', callto_name)
+                if annotations['eureka_server']:
+                    logger.debug('Found @EnableEurekaServer annotation')
+                jar_result['feign_clients'].extend(annotations['feign_clients'])
+                jar_result['eureka_server'] = annotations['eureka_server']
+            else:
+                # Read the annotations straight from the class files of the JAR
+                logger.debug('Scanning class files of %s for @FeignClient and @EnableEurekaServer annotations',
+                             jar_file)
+                with metrics.timer('scan'):
+                    annotations = scan_jar(jar_file)
+                jar_result['feign_clients'].extend(annotations['feign_clients'])
+                jar_result['eureka_server'] = annotations['eureka_server']
+    else:
+        logger.warning('No JAR files found in the Docker image: %s', file_path)
+
+    return {'image': filename, 'jars': jar_results, 'scanned': scanned}
+
+
+def analyze_image_in_worker(filename, known_jars=None):
+    """analyze_image() in a worker process; returns its result and the metrics it recorded, for init() to merge."""
+    metrics.reset()
+    return analyze_image(filename, known_jars), metrics.export()
+
+
+def add_service_edge(from_service, to_service, kind):
+    """Add a call between two services to the service graph, skipping services without an app label.
+
+    Gateway routes and Feign clients may point outside the cluster (e.g. @FeignClient(name="github")
+    for an external HTTP API); those calls are not part of the graph.
+    """
+    for service in (from_service, to_service):
+        if service not in service_to_app_label_dict:
+            logger.warning('No app label found for service %s, skipping the %s %s -> %s', service, kind,
+                           from_service, to_service)
+            return
+    graph.add_edge(service_to_app_label_dict[from_service], service_to_app_label_dict[to_service])
+
+
+def init():
+    global service_discovery
+    started = time.perf_counter()
+    # Find the application.yml and deployment.yml files below the root directory
+    # We can get the service name from the application.yml file and the app label name from the deployment.yml file
+    # The output directory and the layer cache may sit below the root directory; never walk them
+    prune_paths = [OUTPUT_DIRECTORY] + ([LAYER_CACHE_DIR] if LAYER_CACHE_DIR is not None else [])
+    discovery_cache = None if NO_DISCOVERY_CACHE else os.path.join(OUTPUT_DIRECTORY, 'root_discovery_cache.json')
+    # Create the output directory
+    os.makedirs(OUTPUT_DIRECTORY, exist_ok=True)
+    for service, app_label in discover_services(ROOT_DIR, DEFAULT_PRUNE + tuple(PRUNE), prune_paths, discovery_cache):
+        service_to_app_label_dict[service] = app_label
+        app_label_to_service_dict[app_label] = service
+
+    # Create a list to store the service names
+    services = []
+    # Create a dictionary to store the service names and corresponding calls
+    names_calls = defaultdict(list)
+
+    # Check if the CFR tool exists
+    if DECOMPILE and not os.path.exists(CFR_TOOL_PATH):
+        logger.error('The CFR tool does not exist: %s', CFR_TOOL_PATH)
+        sys.exit(1)
+
+    # Sort the images so the graph is built in the same order on every run
+    filenames = sorted(filename for filename in os.listdir(DOCKER_IMAGE_TAR_FOLDER)
+                       if os.path.isfile(os.path.join(DOCKER_IMAGE_TAR_FOLDER, filename)))
+
+    # Only analyze the images whose content changed since the last run
+    manifest = AnalysisManifest(os.path.join(OUTPUT_DIRECTORY, 'analysis_manifest.json'),
+                                {'decompile': DECOMPILE, 'decompile_all': DECOMPILE_ALL})
+    results = {}
+    digests = {}
+    changed = []
+    for filename in filenames:
+        digests[filename] = image_digest(os.path.join(DOCKER_IMAGE_TAR_FOLDER, filename))
+        result = manifest.image_result(filename, digests[filename])
+        if result is not None:
+            logger.info('The Docker image did not change since the last run: %s', filename)
+            results[filename] = result
         else:
-            print('[!] No JAR files found in the extracted layers.')
+            changed.append(filename)
+
+    if JOBS > 1 and len(changed) > 1:
+        logger.info('Analyzing %d Docker images with %d worker processes', len(changed), JOBS)
+        with ProcessPoolExecutor(max_workers=JOBS, initializer=init_worker, initargs=(args,)) as executor:
+            # map() yields the results in input order, whatever order the workers finish in
+            changed_results = []
+            for result, worker_metrics in executor.map(partial(analyze_image_in_worker,
+                                                               known_jars=manifest.known_jars()), changed):
+                changed_results.append(result)
+                metrics.merge(worker_metrics)
+    else:
+        analyze = partial(analyze_image, known_jars=manifest.known_jars())
+        changed_results = [analyze(filename) for filename in changed]
+    for filename, result in zip(changed, changed_results):
+        results[filename] = result
+        manifest.record(filename, digests[filename], result)
+    manifest.save(filenames)
 
-    print(service_discovery)
+    # Merge the per-image results into the global graph state
+    for filename in filenames:
+        result = results[filename]
+        for jar in result['jars']:
+            app_name = jar['service']
+            if app_name is not None:
+                # Store the folder path and corresponding name
+                services.append([app_name, jar['jar']])
+                evidence = service_evidence.setdefault(app_name, {'images': [], 'jars': [], 'routes': [],
+                                                                  'feign_clients': [], 'eureka_server': False})
+                for key, value in (('images', filename), ('jars', jar['jar'])):
+                    if value not in evidence[key]:
+                        evidence[key].append(value)
+                for key in ('routes', 'feign_clients'):
+                    evidence[key].extend(value for value in jar[key] if value not in evidence[key])
+                evidence['eureka_server'] = evidence['eureka_server'] or jar['eureka_server']
+            for id in jar['routes']:
+                names_calls[app_name].append(id)
+                add_service_edge(app_name, id, 'gateway route')
+            for callto_name in jar['feign_clients']:
+                names_calls[app_name].append(callto_name)
+                add_service_edge(app_name, callto_name, '@FeignClient')
+            if jar['eureka_server']:
+                service_discovery = app_name
+    logger.info('Discovery server: %s', service_discovery)
     all_svcs = []
     for node in graph.nodes():
         all_svcs.append(node)
@@ -234,44 +619,87 @@ def init():
         graph.add_edge(node, "k8n-service-discovery")
     
     app_label_to_service_dict["k8n-service-discovery"] = "containerized-discovery"
-    print(f"[*] Init Complete! Successfully parsed {len(app_label_to_service_dict)} services.")
+    logger.info('Init complete, successfully parsed %d services', len(app_label_to_service_dict))
+    metrics.observe('init', time.perf_counter() - started)
 
 
-def generate_and_apply_network_policies():
+def export_service_graph(path):
+    """Write what init() found to a service graph artifact (see service_artifact.py)."""
+    save_artifact(path, ServiceArtifact(time.time(), list(graph.nodes()), list(graph.edges()),
+                                        service_to_app_label_dict, app_label_to_service_dict, service_discovery,
+                                        service_evidence))
+    logger.info('Service graph written to %s', path)
+
+
+def load_service_graph(path):
+    """Restore what init() finds from a service graph artifact, without analyzing the Docker images."""
+    global service_discovery
+    started = time.perf_counter()
+    artifact = load_artifact(path)
+    graph.clear()
+    graph.add_nodes_from(artifact.services)
+    graph.add_edges_from(artifact.calls)
+    service_to_app_label_dict.clear()
+    service_to_app_label_dict.update(artifact.service_to_app_label)
+    app_label_to_service_dict.clear()
+    app_label_to_service_dict.update(artifact.app_label_to_service)
+    service_evidence.clear()
+    service_evidence.update(artifact.evidence)
+    service_discovery = artifact.service_discovery
+    metrics.observe('artifact_load', time.perf_counter() - started)
+    logger.info('Loaded %d services and %d calls from %s, written %s', graph.number_of_nodes(),
+                graph.number_of_edges(), path, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(artifact.created)))
+
+
+def generate_network_policies():
+    """Write the network policies of the current mode to <output_directory>/network_policies and return the
+    (file name, policy) pairs."""
     # Create the network policy folder if it does not exist
     if not os.path.exists(OUTPUT_DIRECTORY + "/network_policies"):
         os.makedirs(OUTPUT_DIRECTORY + "/network_policies")
+    started = time.perf_counter()
+    generated = []
+    if POLICY_MODE == 'service':
+        generated = generate_service_network_policies()
     else:
-        # Remove all files in the network policy folder
-        for filename in os.listdir(OUTPUT_DIRECTORY + "/network_policies"):
-            os.remove(OUTPUT_DIRECTORY + "/network_policies/" + filename)
-    eureka_graph = get_app_instances()
-    for node in eureka_graph.nodes():
-        ips_to_the_node = []
-        ips_from_the_node = []
-        # Get nodes that are pointed to the current node
-        for node_from in eureka_graph.predecessors(node):
-            ips_to_the_node.append(node_from.split(" ")[0])
-        # Get nodes that point from the current node
-        for node_to in eureka_graph.successors(node):
-            ips_from_the_node.append(node_to.split(" ")[0])
-        # Generate a network policy for the current node
-        generate_network_policy(node, ips_from_the_node, ips_to_the_node)
-    # Apply the network policies to the cluster
-    # using kubectl apply -f <file>
-    for filename in os.listdir(OUTPUT_DIRECTORY + "/network_policies/"):
-        if filename.endswith(".yaml"):
-            # check if the policy is for containerized-discovery, ignore if it is
-            # file names are in the format <ip>-<port>-containerized-xxxx-network_policy.yaml
-            if filename.split("-")[3] == "discovery":
-                continue
-            filepath = os.path.join(OUTPUT_DIRECTORY + "/network_policies/", filename)
-            os.system(f"kubectl apply -f {filepath}")
+        topology = get_eureka_topology()
+        discovery_services = {service_discovery, app_label_to_service_dict.get("k8n-service-discovery")}
+        for pod in topology.connected_pods():
+            # Pods that point from the current pod, and pods that point to it
+            ips_from_the_node = [topology.pod_address(to_pod) for to_pod in topology.successor_pods(pod)]
+            ips_to_the_node = [topology.pod_address(from_pod) for from_pod in topology.predecessor_pods(pod)]
+            # Generate a network policy for the current pod
+            service = topology.pod_service_name(pod)
+            generated.append(generate_network_policy(topology.pod_key(pod), ips_from_the_node, ips_to_the_node,
+                                                     policy_labels(service, service in discovery_services)))
+    # Remove the files of policies that are no longer generated
+    filenames = {filename for filename, _ in generated}
+    for filename in os.listdir(OUTPUT_DIRECTORY + "/network_policies"):
+        if filename not in filenames:
+            os.remove(os.path.join(OUTPUT_DIRECTORY + "/network_policies", filename))
+    metrics.observe('policy_generate', time.perf_counter() - started)
+    metrics.increment('policies_generated', len(generated), mode=POLICY_MODE)
+    return generated
+
+
+def generate_and_apply_network_policies():
+    """Generate the network policies and reconcile the cluster with them; returns the PolicyDiff and the results."""
+    # The policies of the discovery server are written for review but never applied
+    desired = [policy for _, policy in generate_network_policies() if not is_discovery_policy(policy)]
+    # Create, update or delete only the policies that differ from the cluster
+    return reconcile(desired, NAMESPACE, get_policy_backend())
+
+
+def kubernetes_name(text):
+    """Lowercase text and keep only what a Kubernetes object name and a file name allow."""
+    return re.sub(r'[^a-z0-9.-]', '', text.lower()).strip('.-')
 
 
+def generate_network_policy(pod, ips_from_the_pod, ips_to_the_pod, labels=None):
+    import yaml
 
-def generate_network_policy(pod, ips_from_the_pod, ips_to_the_pod):
-    modified_string = pod.replace(" ", "").replace(":", "-")
+    # '<ip>-<port>-<service>' (Eureka reports 'N/A' for a disabled port, which becomes 'na')
+    modified_string = kubernetes_name(pod.replace(" ", "").replace(":", "-"))
     policy = {}
     policy['apiVersion'] = 'networking.k8s.io/v1'
     policy['kind'] = 'NetworkPolicy'
@@ -279,6 +707,8 @@ def generate_network_policy(pod, ips_from_the_pod, ips_to_the_pod):
     metadata = {}
     metadata['name'] = modified_string + '-policy'
     metadata['namespace'] = NAMESPACE
+    if labels:
+        metadata['labels'] = labels
     policy['metadata'] = metadata
 
     spec = {}
@@ -295,7 +725,11 @@ def generate_network_policy(pod, ips_from_the_pod, ips_to_the_pod):
     
     for allowed_ip in ips_from_the_pod:
         egress_selector = {'matchLabels': {'ip': allowed_ip.split(":")[0]}}
-        egress_rule = {'to': [{'podSelector': egress_selector}], 'ports': [{'port': int(allowed_ip.split(":")[1])}]}
+        egress_rule = {'to': [{'podSelector': egress_selector}]}
+        port = allowed_ip.split(":")[1]
+        # Eureka reports 'N/A' for a disabled port; allow any port of the pod then
+        if port.isdigit():
+            egress_rule['ports'] = [{'port': int(port)}]
         egress_rules.append(egress_rule)
 
     kube_dns_rule = {'to': [{'namespaceSelector': {'matchLabels': {'name': 'kube-system'}}, 'podSelector': {'matchLabels':{"k8s-app": 'kube-dns'}}}], 'ports': [{'port': 53, 'protocol': 'UDP'}]}
@@ -307,138 +741,187 @@ def generate_network_policy(pod, ips_from_the_pod, ips_to_the_pod):
 
     policy['spec'] = spec
 
-    # Check if the network policy already exists
-    if os.path.exists(OUTPUT_DIRECTORY + "/network_policies/" + modified_string + "-network_policy.yaml"):
-        # Delete the file
-        os.remove(OUTPUT_DIRECTORY + "/network_policies/" + modified_string + "-network_policy.yaml")
-    with open(os.path.join(OUTPUT_DIRECTORY + "/network_policies", modified_string+'-network_policy.yaml'), 'w') as f:
+    filename = modified_string + '-network_policy.yaml'
+    with open(os.path.join(OUTPUT_DIRECTORY + "/network_policies", filename), 'w') as f:
         yaml.safe_dump(policy, f)
+    return filename, policy
 
-def get_app_instances():
-    ip_graph = nx.DiGraph()
-    """Get the app instances from Eureka server and print out the instance IDs, IP addresses, and ports."""
-    # Dictionary to store the app name and list of IP addresses
-    app_to_ips = {}
-    ips_to_app = {}
-    ips_to_port = {}
-    
-    # Send GET request to Eureka server to get the app instances data in XML format
-    resp = requests.get('http://localhost:8761/eureka/apps')
-    if resp.status_code == 200:
-        # Parse the XML response
-        root = ET.fromstring(resp.content)
-
-        # Print out the instance IDs, IP addresses, and ports
-        print('Instance ID\t\tIP Address\tPort')
-        for app in root.findall('.//application'):
-            for instance in app.findall('instance'):
-                name = instance.find('app').text.strip().lower()
-                instance_id = instance.find('instanceId').text.strip()
-                ip_addr = instance.find('ipAddr').text.strip()
-                port_element = instance.find('port')
-                if port_element is None:
-                    print(
-                        f'[?] Warning: No port element found for instance {instance_id}')
-                else:
-                    port_enabled = port_element.attrib.get(
-                        'enabled', 'true') == 'true'
-                    port = port_element.text.strip() if port_enabled else 'N/A'
-                    print("for app "+name)
-                    print(f'{instance_id}\t{ip_addr}\t\t{port}')
-                    if name not in app_to_ips:
-                        app_to_ips[name] = [[ip_addr, port]]
-                    else:
-                        app_to_ips[name].append([ip_addr, port])
-                    ips_to_app[ip_addr] = name
-                    ips_to_port[ip_addr] = port
-    else:
-        print('[!] Failed to get Eureka data')
-
-    def get_pod_ips_and_ports(deployment_name):
-        cmd = f'kubectl get pods -l app={deployment_name} -o json'
-        result = subprocess.check_output(cmd, shell=True).decode('utf-8')
-        pods = json.loads(result)['items']
-        ips_and_ports = []
-        for pod in pods:
-            pod_ip = pod['status']['podIP']
-            container_port = pod['spec']['containers'][0]['ports'][0]['containerPort']
-            ips_and_ports.append((pod_ip, container_port))
-        return ips_and_ports
-    
-    # Get the Eureka server's own IP address and port
-    pod_ips_and_ports = get_pod_ips_and_ports('k8n-service-discovery')
-    for pod_ip, port in pod_ips_and_ports:
-        if service_discovery not in app_to_ips:
-            app_to_ips[service_discovery] = [[pod_ip, port]]
+def generate_service_network_policies():
+    """Write one NetworkPolicy per service of the service graph (see generate_service_network_policy) and
+    return the (file name, policy) pairs."""
+    # Container ports of the pods of each service, used to restrict the egress rules
+    topology = get_k8s_topology()
+    # The discovery server is reached by every service, it is left unrestricted like in pod mode
+    discovery_labels = {"k8n-service-discovery", service_to_app_label_dict.get(service_discovery)}
+    generated = []
+    for app_label in sorted(graph.nodes()):
+        if app_label in discovery_labels:
+            continue
+        services_to = [(to_label, topology.service_ports(app_label_to_service_dict.get(to_label)))
+                       for to_label in sorted(graph.successors(app_label))]
+        services_from = sorted(graph.predecessors(app_label))
+        generated.append(generate_service_network_policy(app_label, services_to, services_from,
+                                                         policy_labels(app_label_to_service_dict.get(app_label, app_label))))
+    return generated
+
+
+def generate_service_network_policy(app_label, services_to, services_from, labels=None):
+    """Generate the NetworkPolicy of a whole service, selecting its pods and peers by their app label.
+
+    `services_to` lists (app label, ports) of the services it calls, `services_from` the app labels of the
+    services calling it. Called services that listen on the same ports share one egress rule, so the
+    policy size only depends on the number of services and the policy stays valid when pods come and go.
+    """
+    import yaml
+
+    # The name and the file name only keep what Kubernetes allows, the selectors use the label as is
+    name = kubernetes_name(app_label)
+    policy = {}
+    policy['apiVersion'] = 'networking.k8s.io/v1'
+    policy['kind'] = 'NetworkPolicy'
+
+    metadata = {}
+    metadata['name'] = name + '-policy'
+    metadata['namespace'] = NAMESPACE
+    if labels:
+        metadata['labels'] = labels
+    policy['metadata'] = metadata
+
+    spec = {}
+    spec['podSelector'] = {'matchLabels': {'app': app_label}}
+    spec['policyTypes'] = ['Ingress', 'Egress']
+
+    egress_rules = []
+    ingress_rules = []
+
+    if services_from:
+        ingress_rules.append({'from': [{'podSelector': {'matchLabels': {'app': from_label}}}
+                                       for from_label in services_from]})
+
+    # Merge the called services by port list; no known port allows any port
+    labels_by_ports = {}
+    for to_label, ports in services_to:
+        labels_by_ports.setdefault(tuple(ports), []).append(to_label)
+    for ports, to_labels in labels_by_ports.items():
+        egress_rule = {'to': [{'podSelector': {'matchLabels': {'app': to_label}}} for to_label in to_labels]}
+        if ports:
+            egress_rule['ports'] = [{'port': port} for port in ports]
+        egress_rules.append(egress_rule)
+
+    kube_dns_rule = {'to': [{'namespaceSelector': {'matchLabels': {'name': 'kube-system'}}, 'podSelector': {'matchLabels':{"k8s-app": 'kube-dns'}}}], 'ports': [{'port': 53, 'protocol': 'UDP'}]}
+    to_services = {'to': [{'ipBlock': {'cidr': '10.152.183.0/24'}}]}
+    egress_rules.append(kube_dns_rule)
+    egress_rules.append(to_services)
+    spec['egress'] = egress_rules
+    spec['ingress'] = ingress_rules
+
+    policy['spec'] = spec
+
+    filename = name + '-service-network_policy.yaml'
+    with open(os.path.join(OUTPUT_DIRECTORY + "/network_policies", filename), 'w') as f:
+        yaml.safe_dump(policy, f)
+    return filename, policy
+
+
+def add_service_calls(topology):
+    """Add the calls of the service graph (app labels) to a topology (service names)."""
+    for s1, s2 in graph.out_edges():
+        if s1 in app_label_to_service_dict and s2 in app_label_to_service_dict:
+            topology.add_call(app_label_to_service_dict[s1], app_label_to_service_dict[s2])
         else:
-            app_to_ips[service_discovery].append([pod_ip, port])
-        ips_to_app[pod_ip] = service_discovery
-        ips_to_port[pod_ip] = port
-
-    # Compelete the IP graph
-    for edge in graph.out_edges:
-        s1, s2 = edge
-        if app_label_to_service_dict[s1] in app_to_ips and app_label_to_service_dict[s2] in app_to_ips:
-            ips1 = app_to_ips[app_label_to_service_dict[s1]]
-            ips2 = app_to_ips[app_label_to_service_dict[s2]]
-            for ip1 in ips1:
-                for ip2 in ips2:
-                    ip_graph.add_node(f"{ip1[0]}:{ips_to_port[ip1[0]]} - {ips_to_app[ip1[0]]}", group=ips_to_app[ip1[0]], size=20, ip=ip1[0], port=ips_to_port[ip1[0]])
-                    ip_graph.add_edge(f"{ip1[0]}:{ips_to_port[ip1[0]]} - {ips_to_app[ip1[0]]}", f"{ip2[0]}:{ips_to_port[ip2[0]]} - {ips_to_app[ip2[0]]}")
-    return ip_graph
+            logger.warning('Could not find %s or %s in the discovered services', s1, s2)
 
 
-def get_app_instances_k8s():
-    ip_graph = nx.DiGraph()
-    """Get the app instances from k8s using kubectl and print out the instance IDs, IP addresses, and ports."""
-    # Dictionary to store the app name and list of IP addresses
-    app_to_ips = {}
-    ips_to_app = {}
-    ips_to_port = {}
-    app_to_number_of_instances = {}
-
-    def get_pod_ips_and_ports(deployment_name):
-        cmd = f'kubectl get pods -l app={deployment_name} -o json'
-        result = subprocess.check_output(cmd, shell=True).decode('utf-8')
-        pods = json.loads(result)['items']
-        ips_and_ports = []
-        for pod in pods:
-            pod_ip = pod['status']['podIP']
-            container_port = pod['spec']['containers'][0]['ports'][0]['containerPort']
-            ips_and_ports.append((pod_ip, container_port))
-        return ips_and_ports
-    
-    def add_ip_to_dict(deployment_name):
-        pod_ips_ports = get_pod_ips_and_ports(deployment_name)
-        app_to_number_of_instances[deployment_name] = len(pod_ips_ports)
-        for pod_ip, port in pod_ips_ports:
-            if app_label_to_service_dict[deployment_name] not in app_to_ips:
-                app_to_ips[app_label_to_service_dict[deployment_name]] = [[pod_ip, port]]
-            else:
-                app_to_ips[app_label_to_service_dict[deployment_name]].append([pod_ip, port])
-            ips_to_app[pod_ip] = app_label_to_service_dict[deployment_name]
-            ips_to_port[pod_ip] = port
-    
-    # Get ips and ports for each service
-    for app_deployment in app_label_to_service_dict:
-        add_ip_to_dict(app_deployment)
-    
-    # Compelete the IP graph
-    for edge in graph.out_edges():
-        s1, s2 = edge
-        print(f"Adding edge {s1} to {s2}")
-        if app_label_to_service_dict[s1] in app_to_ips and app_label_to_service_dict[s2] in app_to_ips:
-            ips1 = app_to_ips[app_label_to_service_dict[s1]]
-            ips2 = app_to_ips[app_label_to_service_dict[s2]]
-            for ip1 in ips1:
-                for ip2 in ips2:
-                    ip_graph.add_node(f"{ip1[0]}:{ips_to_port[ip1[0]]} - {ips_to_app[ip1[0]]}", group=ips_to_app[ip1[0]], size=20, ip=ip1[0], port=ips_to_port[ip1[0]], instances=app_to_number_of_instances[s1])
-                    ip_graph.add_edge(f"{ip1[0]}:{ips_to_port[ip1[0]]} - {ips_to_app[ip1[0]]}", f"{ip2[0]}:{ips_to_port[ip2[0]]} - {ips_to_app[ip2[0]]}")
+def get_eureka_topology(pods_by_label=None, instances=None):
+    """Get the app instances from Eureka server and return them as a Topology.
+
+    `pods_by_label` is the pod inventory listing to read the discovery server pods from and `instances`
+    the Eureka instances; when neither is given, both are fetched concurrently by the topology collector.
+    """
+    import requests
+
+    topology = Topology()
+
+    if pods_by_label is None and instances is None:
+        instances, pods_by_label, _ = get_topology_collector().collect()
+    if instances is None:
+        # The client only fetches the changes since the previous call
+        try:
+            instances = get_eureka_client().instances()
+        except (requests.RequestException, ET.ParseError) as e:
+            logger.warning('Failed to get Eureka data: %s', e)
+            instances = []
+    if pods_by_label is None:
+        pods_by_label = get_pod_inventory().pods_by_label()
+    # Namespace of the instances that run in a discovered pod
+    namespaces = {pod_ip: namespace for pods in pods_by_label.values() for pod_ip, _, namespace in pods if namespace}
+    for instance in instances:
+        if not instance.app or not instance.ip:
+            # Registered without an app name or IP address: no service or pod to put it under
+            continue
+        if instance.ip in namespaces:
+            topology.add_pod(instance.app, instance.ip, instance.port, namespace=namespaces[instance.ip])
         else:
-            print(f"Could not find {s1} or {s2} in app_to_ips")
-    return ip_graph
+            topology.add_pod(instance.app, instance.ip, instance.port)
+    logger.info('%d instances registered in Eureka', len(instances))
+
+    # Get the Eureka server's own IP address and port, under the service name the graph edges to it resolve to
+    discovery_service = app_label_to_service_dict.get("k8n-service-discovery", service_discovery)
+    for pod_ip, port, namespace in pods_by_label.get('k8n-service-discovery', []):
+        topology.add_pod(discovery_service, pod_ip, port, namespace=namespace)
+
+    add_service_calls(topology)
+    return topology
+
+
+def get_k8s_topology(pods_by_label=None):
+    """Get the app instances from k8s using kubectl and return them as a Topology."""
+    topology = Topology()
+    # Get ips and ports for each service, all from one list call
+    if pods_by_label is None:
+        pods_by_label = get_pod_inventory().pods_by_label()
+    for app_deployment, service in app_label_to_service_dict.items():
+        pod_ips_ports = pods_by_label.get(app_deployment, [])
+        topology.set_instances(service, len(pod_ips_ports))
+        for pod_ip, port, namespace in pod_ips_ports:
+            topology.add_pod(service, pod_ip, port, namespace=namespace)
+
+    add_service_calls(topology)
+    return topology
+
+
+def get_app_instances():
+    """Pod level graph of the Eureka instances, each pod pointing to every pod of the services it calls."""
+    return get_eureka_topology().to_networkx()
+
+
+def get_app_instances_k8s():
+    """Pod level graph of the k8s pods, with the number of instances of each service."""
+    return get_k8s_topology().to_networkx(with_instances=True)
+
+
+def get_app_services_k8s():
+    """Service level graph of the k8s pods: one node per service with its replica count, edges with the callee ports."""
+    return get_k8s_topology().to_service_networkx()
+
+
+def build_topology_graphs():
+    """Build the graphs of the dashboard for the topology refresher, from one concurrent collection."""
+    instances, pods_by_label, _ = get_topology_collector().collect()
+    with metrics.timer('graph_build'):
+        services = graph.to_networkx()
+        # Service name and namespace of each app label, for the filters of the graph API
+        for app_label in services.nodes():
+            services.nodes[app_label]['service'] = app_label_to_service_dict.get(app_label, app_label)
+            namespaces = sorted({namespace for _, _, namespace in pods_by_label.get(app_label, []) if namespace})
+            if namespaces:
+                services.nodes[app_label]['namespace'] = namespaces[0]
+        k8s_topology = get_k8s_topology(pods_by_label)
+        return {'eureka': get_eureka_topology(pods_by_label, instances).to_networkx(),
+                'k8s': k8s_topology.to_networkx(with_instances=True),
+                'services': services,
+                'k8s_services': k8s_topology.to_service_networkx()}
 
-app = Flask(__name__)
 
 graphoptions = """const options = {
                         "edges": {
@@ -472,13 +955,14 @@ graphoptions = """const options = {
                         }
                         }
                         """
+# The same options with the browser physics turned off, for graphs laid out on the server
+static_graphoptions = "const options = " + json.dumps(
+    dict(json.loads(graphoptions[graphoptions.index('{'):]), physics={'enabled': False}))
 
-@app.route('/apply')
 def apply():
-    command = ["kubectl", "delete", "networkpolicies", "--all", "-n", NAMESPACE]
-    subprocess.run(command, check=True)
-    generate_and_apply_network_policies()
-    html = """
+    diff, results = generate_and_apply_network_policies()
+    failed = [f"{action} {name}: {error}" for action, name, error in results if error is not None]
+    html = f"""
             <!DOCTYPE html>
             <html>
             <head>
@@ -486,13 +970,13 @@ def apply():
                 <title>AutoArmor Pro Max</title>
             </head>
             <body>
-                <h1>Network policies applied successfully!</h1>
+                <h1>{"Network policies applied successfully!" if not failed else "Some network policies could not be applied"}</h1>
+                <pre>{html_escape(chr(10).join(format_diff(diff) + failed))}</pre>
             </body>
             </html>
                 """
     return html
 
-@app.route('/delete')
 def delete():
     command = ["kubectl", "delete", "networkpolicies", "--all", "-n", NAMESPACE]
     subprocess.run(command, check=True)
@@ -511,224 +995,64 @@ def delete():
     return html
 
 
-@app.route('/')
-def index():
-    net = Network(notebook=False, cdn_resources="remote", select_menu=True, filter_menu=True)
-    net.from_nx(get_app_instances())
-    net.set_options(graphoptions)
-    # net.show_buttons()
-    
-    # write the graph to a standalone HTML file
-    net.write_html('graph.html')
-    with open("graph.html", "r") as f:
-        html = f.read()
-    
-    # Modify the HTML code to include a title and a title bar
-    html = f"""
+NOT_READY_HTML = """
             <!DOCTYPE html>
             <html>
             <head>
                 <meta charset="utf-8">
                 <title>AutoArmor Pro Max</title>
-                <style>
-                    #title-bar {{
-                        background-color: #4E2A84;
-                        color: white;
-                        height: 80px;
-                        line-height: 80px;
-                        padding-left: 10px;
-                        padding-right: 10px;
-                        display: flex;
-                        align-items: center;
-                    }}
-                    #logo {{
-                        background-image: url('https://common.northwestern.edu/v8/css/images/northwestern.svg');
-                        background-repeat: no-repeat;
-                        background-position: left center;
-                        background-size: contain;
-                        width: 120px;
-                        height: 60px;
-                        margin-right: 10px;
-                    }}
-                    #time {{
-                        font-size: 12px;
-                        margin-right: 10px;
-                    }}
-                    #countdown {{
-                        font-size: 12px;
-                    }}
-                    #center-container {{
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        flex-direction: row;
-                    }}
-                    #time,
-                    #countdown {{
-                        margin: 10px;
-                    }}
-                </style>
-                <link href="https://common.northwestern.edu/favicon.ico" rel="shortcut icon" type="image/x-icon"/>
-                <link href="https://common.northwestern.edu/v8/icons/favicon-16.png" rel="icon" sizes="16x16" type="image/png"/>
-                <link href="https://common.northwestern.edu/v8/icons/favicon-32.png" rel="icon" sizes="32x32" type="image/png"/>
-                <link href="https://common.northwestern.edu/v8/icons/favicon-180.png" rel="apple-touch-icon" sizes="180x180"/>
+                <meta http-equiv="refresh" content="5">
             </head>
             <body>
-                <div id="title-bar">
-                    <div id="logo"></div>
-                    <div>AutoArmor Pro Max</div>
-                </div>
-                {html}
-                <div id="center-container">
-                    <div id="time"></div>
-                    <div id="countdown"></div>
-                </div>
-                <script>
-                    function updateTime() {{
-                        var d = new Date();
-                        var chicagoTime = d.toLocaleString("en-US", {{timeZone: "America/Chicago"}});
-                        document.getElementById("time").innerHTML = "Current Time: " + chicagoTime;
-                    }}
-
-                    function updateCountdown() {{
-                        var countdownElement = document.getElementById("countdown");
-                        var countdown = 600;
-                        countdownElement.innerHTML = "Auto Reresh In: " + countdown + "s";
-                        setInterval(function() {{
-                            countdown--;
-                            countdownElement.innerHTML = "Auto Reresh In: " + countdown + "s";
-                            if (countdown == 0) {{
-                                location.reload();
-                            }}
-                        }}, 1000);
-                    }}
-
-                    updateTime();
-                    setInterval(updateTime, 1000);
-                    updateCountdown();
-                </script>
+                <h1>The topology is still being collected, this page reloads in a few seconds.</h1>
             </body>
             </html>
+                """
 
-    """
-    return render_template_string(html)
 
-@app.route('/k8s')
-def k8s():
-    net = Network(notebook=False, cdn_resources="remote", select_menu=True, filter_menu=True)
-    net.from_nx(get_app_instances_k8s())
-    net.set_options(graphoptions)
-    
-    
-    # write the graph to a standalone HTML file
-    net.write_html('k8s_graph.html')
-    with open("k8s_graph.html", "r") as f:
-        html = f.read()
-    
-    # Modify the HTML code to include a title and a title bar
-    html = f"""
+def refresh():
+    get_topology_refresher().start().trigger()
+    html = """
             <!DOCTYPE html>
             <html>
             <head>
                 <meta charset="utf-8">
                 <title>AutoArmor Pro Max</title>
-                <style>
-                    #title-bar {{
-                        background-color: #4E2A84;
-                        color: white;
-                        height: 80px;
-                        line-height: 80px;
-                        padding-left: 10px;
-                        padding-right: 10px;
-                        display: flex;
-                        align-items: center;
-                    }}
-                    #logo {{
-                        background-image: url('https://common.northwestern.edu/v8/css/images/northwestern.svg');
-                        background-repeat: no-repeat;
-                        background-position: left center;
-                        background-size: contain;
-                        width: 120px;
-                        height: 60px;
-                        margin-right: 10px;
-                    }}
-                    #time {{
-                        font-size: 12px;
-                        margin-right: 10px;
-                    }}
-                    #countdown {{
-                        font-size: 12px;
-                    }}
-                    #center-container {{
-                        display: flex;
-                        justify-content: center;
-                        align-items: center;
-                        flex-direction: row;
-                    }}
-                    #time,
-                    #countdown {{
-                        margin: 10px;
-                    }}
-                </style>
-                <link href="https://common.northwestern.edu/favicon.ico" rel="shortcut icon" type="image/x-icon"/>
-                <link href="https://common.northwestern.edu/v8/icons/favicon-16.png" rel="icon" sizes="16x16" type="image/png"/>
-                <link href="https://common.northwestern.edu/v8/icons/favicon-32.png" rel="icon" sizes="32x32" type="image/png"/>
-                <link href="https://common.northwestern.edu/v8/icons/favicon-180.png" rel="apple-touch-icon" sizes="180x180"/>
             </head>
             <body>
-                <div id="title-bar">
-                    <div id="logo"></div>
-                    <div>AutoArmor Pro Max</div>
-                </div>
-                {html}
-                <div id="center-container">
-                    <div id="time"></div>
-                    <div id="countdown"></div>
-                </div>
-                <script>
-                    function updateTime() {{
-                        var d = new Date();
-                        var chicagoTime = d.toLocaleString("en-US", {{timeZone: "America/Chicago"}});
-                        document.getElementById("time").innerHTML = "Current Time: " + chicagoTime;
-                    }}
+                <h1>The topology will be refreshed shortly.</h1>
+            </body>
+            </html>
+                """
+    return html
+
 
-                    function updateCountdown() {{
+def render_page(graph_html, auto_refresh=True):
+    """Wrap the HTML of a pyvis graph in the AutoArmor Pro Max page (title bar, clock and auto refresh countdown).
+
+    The page is built with plain string formatting; the generated graph is never parsed as a template.
+    """
+    countdown_style = """
+                    #countdown {
+                        font-size: 12px;
+                    }""" if auto_refresh else ""
+    countdown_div = """
+                    <div id="countdown"></div>""" if auto_refresh else ""
+    countdown_script = """
+                    function updateCountdown() {
                         var countdownElement = document.getElementById("countdown");
                         var countdown = 600;
                         countdownElement.innerHTML = "Auto Reresh In: " + countdown + "s";
-                        setInterval(function() {{
+                        setInterval(function() {
                             countdown--;
                             countdownElement.innerHTML = "Auto Reresh In: " + countdown + "s";
-                            if (countdown == 0) {{
+                            if (countdown == 0) {
                                 location.reload();
-                            }}
-                        }}, 1000);
-                    }}
-
-                    updateTime();
-                    setInterval(updateTime, 1000);
-                    updateCountdown();
-                </script>
-            </body>
-            </html>
-
-    """
-
-    return render_template_string(html)
-
-@app.route('/servicegraph')
-def servicegraph():
-    net = Network(notebook=False, cdn_resources="remote", select_menu=True, filter_menu=True)
-    net.from_nx(graph)
-    net.set_options(graphoptions)
-    
-    # write the graph to a standalone HTML file
-    net.write_html('servicegraph.html')
-    with open("servicegraph.html", "r") as f:
-        html = f.read()
-    
-    # Modify the HTML code to include a title and a title bar
-    html = f"""
+                            }
+                        }, 1000);
+                    }
+                    updateCountdown();""" if auto_refresh else ""
+    return f"""
             <!DOCTYPE html>
             <html>
             <head>
@@ -757,14 +1081,17 @@ def servicegraph():
                     #time {{
                         font-size: 12px;
                         margin-right: 10px;
-                        margin: 10px;
-                    }}
+                    }}{countdown_style}
                     #center-container {{
                         display: flex;
                         justify-content: center;
                         align-items: center;
                         flex-direction: row;
                     }}
+                    #time,
+                    #countdown {{
+                        margin: 10px;
+                    }}
                 </style>
                 <link href="https://common.northwestern.edu/favicon.ico" rel="shortcut icon" type="image/x-icon"/>
                 <link href="https://common.northwestern.edu/v8/icons/favicon-16.png" rel="icon" sizes="16x16" type="image/png"/>
@@ -776,9 +1103,9 @@ def servicegraph():
                     <div id="logo"></div>
                     <div>AutoArmor Pro Max</div>
                 </div>
-                {html}
+                {graph_html}
                 <div id="center-container">
-                    <div id="time"></div>
+                    <div id="time"></div>{countdown_div}
                 </div>
                 <script>
                     function updateTime() {{
@@ -786,23 +1113,350 @@ def servicegraph():
                         var chicagoTime = d.toLocaleString("en-US", {{timeZone: "America/Chicago"}});
                         document.getElementById("time").innerHTML = "Current Time: " + chicagoTime;
                     }}
+
                     updateTime();
-                    setInterval(updateTime, 1000);
+                    setInterval(updateTime, 1000);{countdown_script}
                 </script>
             </body>
             </html>
 
     """
 
-    return render_template_string(html)
 
-# Serve the utils.js file
-@app.route('/lib/bindings/utils.js')
+def render_graph(nx_graph, layout=None):
+    """Render a networkx graph with pyvis, in memory.
+
+    With a GraphLayout, the nodes get fixed server side positions and the browser physics is turned off.
+    """
+    from pyvis.network import Network
+
+    net = Network(notebook=False, cdn_resources="remote", select_menu=True, filter_menu=True)
+    # from_nx adds attributes to the graph it reads, so render a copy of the shared snapshot
+    nx_graph = nx_graph.copy()
+    if layout is not None:
+        for node, (x, y) in layout.layout(nx_graph).items():
+            nx_graph.nodes[node]['x'] = x
+            nx_graph.nodes[node]['y'] = y
+    net.from_nx(nx_graph)
+    net.set_options(graphoptions if layout is None else static_graphoptions)
+    return net.generate_html()
+
+
+def page_layout(name):
+    """Return the GraphLayout of a page (kept across snapshots so positions stay stable), or None with --layout browser."""
+    if LAYOUT != 'server':
+        return None
+    from graph_layout import GraphLayout
+
+    if name not in graph_layouts:
+        graph_layouts[name] = GraphLayout()
+    return graph_layouts[name]
+
+
+class RenderedPage:
+    """A page rendered for one snapshot version, kept as is and gzip compressed, with its ETag."""
+
+    def __init__(self, version, html):
+        self.version = version
+        self.body = html.encode('utf-8')
+        self.gzip_body = gzip.compress(self.body, compresslevel=6)
+        # Versions start over when the server restarts, so the ETag is derived from the content
+        self.etag = hashlib.sha1(self.body).hexdigest()
+
+
+# Route name -> RenderedPage of the latest snapshot version rendered
+rendered_pages = {}
+# Route name -> GraphLayout, only used while rendering a page (under rendered_pages_lock)
+graph_layouts = {}
+rendered_pages_lock = threading.Lock()
+
+
+def snapshot_page(name, build_html):
+    """Serve the page `name` of the current snapshot, rendering it with build_html(snapshot) once per version.
+
+    Requests whose If-None-Match matches get a 304, and clients that accept gzip get the compressed body.
+    """
+    from flask import Response, request
+
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return NOT_READY_HTML, 503
+    page = rendered_pages.get(name)
+    if page is None or page.version != snapshot.version:
+        # One request renders a new version, the others wait for it instead of rendering it too
+        with rendered_pages_lock:
+            page = rendered_pages.get(name)
+            if page is None or page.version != snapshot.version:
+                with metrics.timer('render'):
+                    page = RenderedPage(snapshot.version, build_html(snapshot))
+                rendered_pages[name] = page
+    if request.if_none_match.contains(page.etag):
+        response = Response(status=304)
+    elif 'gzip' in request.accept_encodings:
+        response = Response(page.gzip_body, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(page.body, mimetype='text/html')
+    response.set_etag(page.etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+def index():
+    return snapshot_page('index', lambda snapshot: render_page(render_graph(snapshot.eureka, page_layout('index'))))
+
+
+def k8s():
+    return snapshot_page('k8s', lambda snapshot: render_page(render_graph(snapshot.k8s, page_layout('k8s'))))
+
+
+# Double clicking a service of the aggregated graph replaces it by its pods, fetched from the graph API;
+# double clicking one of those pods collapses them back into the service. Edges are derived from the
+# service edges, as every pod of a caller may call every pod of the callee.
+EXPAND_SCRIPT = """
+<script type="text/javascript">
+    var serviceNodes = nodes.get({returnType: "Object"});
+    var serviceEdges = edges.get();
+    // Service -> IDs of its pods, for the expanded services
+    var expanded = {};
+
+    function redrawEdges() {
+        edges.clear();
+        edges.add(serviceEdges.flatMap(function (edge) {
+            var sources = expanded[edge.from] || [edge.from];
+            var targets = expanded[edge.to] || [edge.to];
+            return sources.flatMap(function (source) {
+                return targets.map(function (target) {
+                    return {from: source, to: target, title: edge.title};
+                });
+            });
+        }));
+        allNodes = nodes.get({returnType: "Object"});
+    }
+
+    function expandService(service) {
+        var center = network.getPositions([service])[service];
+        fetch("/api/graph/k8s?depth=0&limit=10000&service=" + encodeURIComponent(service))
+            .then(function (response) { return response.json(); })
+            .then(function (page) {
+                if (expanded[service] || !page.nodes) {
+                    return;
+                }
+                expanded[service] = page.nodes.map(function (pod) { return pod.id; });
+                nodes.remove(service);
+                nodes.add(page.nodes.map(function (pod, i) {
+                    var angle = 2 * Math.PI * i / page.nodes.length;
+                    var radius = 15 * Math.sqrt(page.nodes.length);
+                    return {id: pod.id, label: pod.id, group: service, service: service, size: 15,
+                            title: pod.ip + ":" + pod.port, x: center.x + radius * Math.cos(angle),
+                            y: center.y + radius * Math.sin(angle)};
+                }));
+                redrawEdges();
+            });
+    }
+
+    function collapseService(service) {
+        var position = network.getPositions([expanded[service][0]])[expanded[service][0]];
+        nodes.remove(expanded[service]);
+        delete expanded[service];
+        nodes.add(Object.assign({}, serviceNodes[service], position));
+        redrawEdges();
+    }
+
+    network.on("doubleClick", function (params) {
+        if (params.nodes.length === 0) {
+            return;
+        }
+        var node = nodes.get(params.nodes[0]);
+        if (node.service && expanded[node.service]) {
+            collapseService(node.service);
+        } else if (serviceNodes[node.id]) {
+            expandService(node.id);
+        }
+    });
+</script>
+"""
+
+
+def render_aggregated_graph(nx_graph, layout=None):
+    """Render a service level graph whose services expand to their pods when double clicked."""
+    graph_html = render_graph(nx_graph, layout)
+    return graph_html.replace('</body>', EXPAND_SCRIPT + '</body>', 1)
+
+
+def k8s_services():
+    return snapshot_page('k8s_services',
+                         lambda snapshot: render_page(render_aggregated_graph(snapshot.k8s_services,
+                                                                              page_layout('k8s_services')),
+                                                      auto_refresh=False))
+
+
+def servicegraph():
+    return snapshot_page('servicegraph',
+                         lambda snapshot: render_page(render_graph(snapshot.services, page_layout('servicegraph')),
+                                                      auto_refresh=False))
+
+# Snapshot field of each graph of the graph API
+API_GRAPHS = {'service': 'services', 'eureka': 'eureka', 'k8s': 'k8s', 'k8s-services': 'k8s_services'}
+# Graph API selections of the latest snapshot, see get_graph_selections()
+graph_selections = None
+
+
+def get_graph_selections():
+    """Return the graph_api.SelectionCache of this process, creating it on first use."""
+    global graph_selections
+    if graph_selections is None:
+        from graph_api import SelectionCache
+
+        graph_selections = SelectionCache()
+    return graph_selections
+
+
+def api_graph(name):
+    """One page of the service, Eureka or k8s graph as JSON, see graph_api.graph_page() for the parameters."""
+    from flask import jsonify, request
+    from graph_api import GraphQueryError, graph_page, parse_graph_query
+
+    if name not in API_GRAPHS:
+        return jsonify({'error': f'unknown graph {name}, expected one of {", ".join(API_GRAPHS)}'}), 404
+    try:
+        query = parse_graph_query(request.args)
+    except GraphQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    snapshot = get_snapshot()
+    if snapshot is None:
+        return jsonify({'error': 'the topology is still being collected'}), 503
+    graph = getattr(snapshot, API_GRAPHS[name])
+    # Sorted once per snapshot version and filters, every cursor is a slice of the same selection
+    selection = get_graph_selections().select(snapshot.version, name, graph, query['services'], query['namespace'],
+                                              query['depth'])
+    page = graph_page(graph, selection, query['limit'], query['offset'])
+    page.update(graph=name, version=snapshot.version, created=snapshot.created)
+    response = jsonify(page)
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
+def current_snapshot():
+    """Return the latest snapshot without waiting for it or starting the refresher; None before the first one."""
+    return topology_refresher.snapshot(timeout=0) if topology_refresher is not None else None
+
+
+def snapshot_gauge(value):
+    """A gauge callback reporting value(snapshot) of the latest snapshot, left out before the first one."""
+    def callback():
+        snapshot = current_snapshot()
+        return None if snapshot is None else value(snapshot)
+    return callback
+
+
+metrics.gauge('snapshot_version', snapshot_gauge(lambda snapshot: snapshot.version),
+              'Version of the latest topology snapshot.')
+metrics.gauge('snapshot_age_seconds', snapshot_gauge(lambda snapshot: time.time() - snapshot.created),
+              'Seconds since the latest topology snapshot was built with changes.')
+metrics.gauge('snapshot_refresh_age_seconds',
+              snapshot_gauge(lambda snapshot: time.time() - (topology_refresher.refreshed or snapshot.created)),
+              'Seconds since the topology was last refreshed successfully, changed or not.')
+metrics.gauge('snapshot_nodes',
+              snapshot_gauge(lambda snapshot: {(('graph', name),): getattr(snapshot, name).number_of_nodes()
+                                               for name in GRAPHS}),
+              'Nodes of each graph of the latest topology snapshot.')
+metrics.gauge('snapshot_edges',
+              snapshot_gauge(lambda snapshot: {(('graph', name),): getattr(snapshot, name).number_of_edges()
+                                               for name in GRAPHS}),
+              'Edges of each graph of the latest topology snapshot.')
+metrics.gauge('rendered_page_bytes',
+              lambda: {(('page', name),): len(page.body) for name, page in rendered_pages.items()} or None,
+              'Size of the rendered dashboard pages, before compression.')
+
+
+def prometheus_metrics():
+    """The timers, counters and snapshot gauges of this process in the Prometheus text format."""
+    from flask import Response
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
 def serve_utils_js():
-    return send_from_directory(os.path.join(app.root_path, 'lib/bindings'), 'utils.js')
+    """Serve the utils.js file of pyvis."""
+    from flask import current_app, send_from_directory
 
-if __name__ == '__main__':
+    return send_from_directory(os.path.join(current_app.root_path, 'lib/bindings'), 'utils.js')
+
+
+
+def create_app():
+    """Create the Flask app of the dashboard.
+
+    Flask and pyvis are only imported here and by the routes, so the batch commands never load them.
+    """
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.add_url_rule('/', view_func=index)
+    app.add_url_rule('/k8s', view_func=k8s)
+    app.add_url_rule('/k8s/services', view_func=k8s_services)
+    app.add_url_rule('/servicegraph', view_func=servicegraph)
+    app.add_url_rule('/apply', view_func=apply)
+    app.add_url_rule('/delete', view_func=delete)
+    app.add_url_rule('/refresh', view_func=refresh)
+    app.add_url_rule('/api/graph/<name>', view_func=api_graph)
+    app.add_url_rule('/metrics', view_func=prometheus_metrics)
+    app.add_url_rule('/lib/bindings/utils.js', view_func=serve_utils_js)
+    return app
+
+
+def load_or_init():
+    """Load the service graph from --artifact if given, otherwise analyze the Docker images with init()."""
+    if ARTIFACT is None:
+        init()
+        return
+    try:
+        load_service_graph(ARTIFACT)
+    except ArtifactError as e:
+        logger.error('%s', e)
+        sys.exit(1)
+
+
+def run_analyze():
+    """analyze: build the service graph from the Docker images and write it to the artifact."""
     init()
+    export_service_graph(ARTIFACT or os.path.join(OUTPUT_DIRECTORY, ARTIFACT_FILENAME))
+
+
+def run_generate():
+    """generate: write the network policies without touching the cluster."""
+    load_or_init()
+    generated = generate_network_policies()
+    logger.info('%d network policies written to %s', len(generated), OUTPUT_DIRECTORY + "/network_policies")
+
+
+def run_apply():
+    """apply: write the network policies and reconcile the cluster with them; fails if a policy could not be applied."""
+    load_or_init()
+    # reconcile() logs the diff and every policy that failed
+    _, results = generate_and_apply_network_policies()
+    return 1 if any(error is not None for _, _, error in results) else 0
+
+
+def run_serve():
+    """serve: run the dashboard."""
+    load_or_init()
+    app = create_app()
+    # Build the first snapshot while the server starts
+    get_topology_refresher().start()
     app.run()
 
 
+def main(argv=None):
+    parsed_args = parse_args(argv)
+    logging.basicConfig(level=parsed_args.log_level, format=LOG_FORMAT)
+    configure(parsed_args)
+    commands = {'analyze': run_analyze, 'generate': run_generate, 'apply': run_apply, 'serve': run_serve}
+    return commands[parsed_args.command]() or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
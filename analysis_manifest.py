@@ -0,0 +1,70 @@
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(path):
+    """Return the sha256 of a file as 'sha256:<hex>'."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return 'sha256:' + digest.hexdigest()
+
+
+class AnalysisManifest:
+    """Persisted record of what init() found in each Docker image, keyed by content hashes.
+
+    The manifest maps each image file name to its image digest and the facts extracted from its
+    JAR files (service name, gateway routes, Feign targets, Eureka server flag), and every JAR
+    hash to its facts. An image whose digest did not change is not analyzed again, and a JAR
+    whose hash was already seen in any image is not scanned again. The file is only rewritten
+    once a run completes, so an interrupted run never records half-finished results.
+    """
+
+    def __init__(self, path, settings):
+        self.path = path
+        # The analysis settings that change the extracted facts; a different set invalidates the manifest
+        self.settings = settings
+        self.images = {}
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data.get('version') == MANIFEST_VERSION and data.get('settings') == settings:
+            self.images = data.get('images', {})
+        elif data:
+            logger.warning('The analysis manifest was written by a different version or with different settings, '
+                           'analyzing every image again')
+
+    def image_result(self, filename, digest):
+        """Return the stored result of an image if its digest is unchanged, otherwise None."""
+        entry = self.images.get(filename)
+        if entry is not None and entry.get('digest') == digest:
+            return entry['result']
+        return None
+
+    def known_jars(self):
+        """Return JAR hash -> facts (None for JAR files without an application.yml) for every recorded image."""
+        jars = {}
+        for entry in self.images.values():
+            jars.update(entry['result'].get('scanned', {}))
+        return jars
+
+    def record(self, filename, digest, result):
+        self.images[filename] = {'digest': digest, 'result': result}
+
+    def save(self, filenames):
+        """Write the manifest for the given images, dropping the images that are gone."""
+        images = {filename: self.images[filename] for filename in sorted(filenames) if filename in self.images}
+        data = {'version': MANIFEST_VERSION, 'settings': self.settings, 'images': images}
+        partial_path = f'{self.path}.partial-{os.getpid()}'
+        with open(partial_path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        os.replace(partial_path, self.path)
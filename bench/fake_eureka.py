@@ -0,0 +1,84 @@
+"""A local stand-in for the Eureka REST API, serving a fixed registry at /eureka/apps and /eureka/apps/delta.
+
+Run it on its own with `python3 bench/fake_eureka.py <pods.json> [port]`.
+"""
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+# App labels whose pods are not registered in Eureka (the Eureka server itself)
+UNREGISTERED_LABELS = ('k8n-service-discovery', 'discovery-app')
+
+
+def registry_xml(pods, delta=False):
+    """Return the <applications> document of the pods registered in Eureka ({name, app, ip, port} dicts).
+
+    The registry never changes, so a delta has no instances but the same hashcode.
+    """
+    apps = {}
+    for pod in pods:
+        if pod['app'] not in UNREGISTERED_LABELS:
+            apps.setdefault(pod['app'][:-len('-app')].upper(), []).append(pod)
+    count = sum(len(instances) for instances in apps.values())
+    parts = ['<applications><versions__delta>1</versions__delta>',
+             f'<apps__hashcode>{"UP_%d_" % count if count else ""}</apps__hashcode>']
+    if not delta:
+        for app in sorted(apps):
+            parts.append(f'<application><name>{escape(app)}</name>')
+            for pod in apps[app]:
+                parts.append(f'<instance><instanceId>{escape(pod["name"])}</instanceId><app>{escape(app)}</app>'
+                             f'<ipAddr>{pod["ip"]}</ipAddr><status>UP</status>'
+                             f'<port enabled="true">{pod["port"]}</port><actionType>ADDED</actionType></instance>')
+            parts.append('</application>')
+    parts.append('</applications>')
+    return ''.join(parts).encode('utf-8')
+
+
+class FakeEureka:
+    """Serves the registry of a list of pods from a daemon thread on 127.0.0.1 (a free port by default)."""
+
+    def __init__(self, pods, port=0):
+        full = registry_xml(pods)
+        delta = registry_xml(pods, delta=True)
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip('/').endswith('/apps/delta'):
+                    body = delta
+                elif self.path.rstrip('/').endswith('/apps'):
+                    body = full
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/xml')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server.server_address[1]}/eureka'
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name='fake-eureka', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == '__main__':
+    with open(sys.argv[1]) as f:
+        eureka = FakeEureka(json.load(f), int(sys.argv[2]) if len(sys.argv) > 2 else 8761)
+    print(f'[*] Serving {sys.argv[1]} at {eureka.url}')
+    eureka.server.serve_forever()
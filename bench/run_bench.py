@@ -0,0 +1,194 @@
+"""Time the stages of aa_pro_max.py on synthetic fleets, without Docker, a JVM, Eureka or a cluster.
+
+Every scenario (number of services x replicas per service) runs in its own process against a
+generated fleet (bench/synthetic.py), a local fake Eureka (bench/fake_eureka.py) and the kubectl stub
+(bench/kubectl), and the timings of all scenarios are written as one JSON document:
+
+    python3 bench/run_bench.py --services 10 100 1000 --replicas 1 3 --output bench.json
+
+Compare two documents (e.g. of two commits) with `python3 bench/run_bench.py --compare old.json new.json`.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+# Version of the result document; bump it when the meaning of a field changes
+RESULT_VERSION = 1
+
+
+@contextmanager
+def stage(timings, name):
+    started = time.perf_counter()
+    yield
+    timings[name] = round(time.perf_counter() - started, 4)
+
+
+def run_scenario(services, replicas, workdir, jobs):
+    """Run every stage for one fleet in this process and return the timings and sizes."""
+    sys.path.insert(0, BENCH_DIR)
+    from synthetic import write_fleet
+    from fake_eureka import FakeEureka
+
+    timings = {}
+    with stage(timings, 'generate_fleet'):
+        fleet = write_fleet(workdir, services, replicas)
+    pods_file = os.path.join(workdir, 'pods.json')
+    with open(pods_file, 'w') as f:
+        json.dump(fleet.pods, f)
+    eureka = FakeEureka(fleet.pods).start()
+    os.environ['BENCH_PODS'] = pods_file
+    os.environ['BENCH_POLICY_DIR'] = os.path.join(workdir, 'cluster_policies')
+    os.environ['PATH'] = BENCH_DIR + os.pathsep + os.environ.get('PATH', '')
+
+    sys.path.insert(0, REPO_DIR)
+    with stage(timings, 'import'):
+        import aa_pro_max
+    from graph_layout import GraphLayout
+    logging.basicConfig(level=logging.WARNING)
+    aa_pro_max.configure(aa_pro_max.parse_args([
+        'serve', fleet.images, os.path.join(REPO_DIR, 'cfr-0.152.jar'), os.path.join(workdir, 'out'), 'bench', fleet.root,
+        '--eureka-url', eureka.url, '--jobs', str(jobs)]))
+
+    with stage(timings, 'init'):
+        aa_pro_max.init()
+    # Nothing changed, so the analysis manifest and the discovery cache answer
+    with stage(timings, 'init_unchanged'):
+        aa_pro_max.init()
+    artifact = os.path.join(workdir, 'out', 'service_graph.json.gz')
+    with stage(timings, 'export_service_graph'):
+        aa_pro_max.export_service_graph(artifact)
+    with stage(timings, 'load_service_graph'):
+        aa_pro_max.load_service_graph(artifact)
+    with stage(timings, 'collect'):
+        aa_pro_max.get_topology_collector().collect()
+    with stage(timings, 'get_app_instances'):
+        eureka_graph = aa_pro_max.get_app_instances()
+    with stage(timings, 'get_app_instances_k8s'):
+        k8s_graph = aa_pro_max.get_app_instances_k8s()
+    with stage(timings, 'build_topology_graphs'):
+        graphs = aa_pro_max.build_topology_graphs()
+    with stage(timings, 'render_k8s'):
+        aa_pro_max.render_graph(graphs['k8s'], GraphLayout())
+    with stage(timings, 'render_k8s_services'):
+        aa_pro_max.render_aggregated_graph(graphs['k8s_services'], GraphLayout())
+    with stage(timings, 'policies_pod'):
+        diff, _ = aa_pro_max.generate_and_apply_network_policies()
+    pod_policies = len(diff.create)
+    # The cluster already has every policy now
+    with stage(timings, 'policies_pod_unchanged'):
+        aa_pro_max.generate_and_apply_network_policies()
+    aa_pro_max.POLICY_MODE = 'service'
+    with stage(timings, 'policies_service'):
+        diff, _ = aa_pro_max.generate_and_apply_network_policies()
+    eureka.stop()
+
+    return {
+        'services': services,
+        'replicas': replicas,
+        'pods': len(fleet.pods),
+        'service_calls': fleet.calls,
+        'eureka_graph': {'nodes': eureka_graph.number_of_nodes(), 'edges': eureka_graph.number_of_edges()},
+        'k8s_graph': {'nodes': k8s_graph.number_of_nodes(), 'edges': k8s_graph.number_of_edges()},
+        'pod_policies': pod_policies,
+        'service_policies': len(diff.create) + len(diff.update) + len(diff.unchanged),
+        'artifact_bytes': os.path.getsize(artifact),
+        'timings': timings,
+        # Stage -> [runs, total seconds, seconds of the last run], as recorded by the metrics of aa_pro_max.py
+        'stages': aa_pro_max.metrics.export()['stages'],
+        # Peak resident set size of the scenario process (kilobytes on Linux)
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_all(service_counts, replica_counts, jobs, verbose=False):
+    scenarios = []
+    for services in service_counts:
+        for replicas in replica_counts:
+            print(f'[*] {services} services x {replicas} replicas', file=sys.stderr)
+            with tempfile.TemporaryDirectory(prefix='aa-bench-') as workdir:
+                result_file = os.path.join(workdir, 'result.json')
+                # A fresh process per scenario, as aa_pro_max.py keeps its graph in module globals
+                subprocess.run([sys.executable, os.path.abspath(__file__), '--scenario', str(services), str(replicas),
+                                '--workdir', os.path.join(workdir, 'fleet'), '--jobs', str(jobs),
+                                '--output', result_file],
+                               check=True, stdout=None if verbose else subprocess.DEVNULL)
+                with open(result_file) as f:
+                    scenarios.append(json.load(f))
+    return {
+        'version': RESULT_VERSION,
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'jobs': jobs,
+        'scenarios': scenarios,
+    }
+
+
+def compare(old, new):
+    """Print the timings of two result documents side by side, for the scenarios they have in common."""
+    old_scenarios = {(s['services'], s['replicas']): s for s in old['scenarios']}
+    print(f"{'scenario':<16}{'stage':<26}{old.get('revision') or 'old':>12}{new.get('revision') or 'new':>12}"
+          f"{'change':>10}")
+    for scenario in new['scenarios']:
+        key = (scenario['services'], scenario['replicas'])
+        if key not in old_scenarios:
+            continue
+        for name, seconds in scenario['timings'].items():
+            before = old_scenarios[key]['timings'].get(name)
+            if before is None:
+                continue
+            change = f'{(seconds - before) / before:+.0%}' if before else ''
+            print(f'{f"{key[0]}x{key[1]}":<16}{name:<26}{before:>12.4f}{seconds:>12.4f}{change:>10}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark aa_pro_max.py on synthetic fleets.')
+    parser.add_argument('--services', type=int, nargs='+', default=[10, 100, 1000], metavar='N',
+                        help='numbers of services to benchmark (default: 10 100 1000)')
+    parser.add_argument('--replicas', type=int, nargs='+', default=[1, 3], metavar='N',
+                        help='numbers of pods per service to benchmark (default: 1 3)')
+    parser.add_argument('--jobs', type=int, default=1, metavar='N', help='--jobs of aa_pro_max.py (default: 1)')
+    parser.add_argument('--output', metavar='FILE', help='write the results to FILE instead of stdout')
+    parser.add_argument('--verbose', action='store_true', help='show the output of aa_pro_max.py')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files and exit')
+    parser.add_argument('--scenario', type=int, nargs=2, metavar=('SERVICES', 'REPLICAS'), help=argparse.SUPPRESS)
+    parser.add_argument('--workdir', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old, open(args.compare[1]) as new:
+            compare(json.load(old), json.load(new))
+        return
+    if args.scenario:
+        result = run_scenario(*args.scenario, args.workdir, args.jobs)
+    else:
+        result = run_all(args.services, args.replicas, args.jobs, args.verbose)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
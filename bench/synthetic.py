@@ -0,0 +1,169 @@
+"""Synthetic fixtures for the benchmarks: Spring Boot style images, the source tree and the pods of a fleet.
+
+Nothing here needs Docker, a JVM or a cluster: class files, JAR files and `docker save` tars are
+written byte by byte, in the formats the analysis reads.
+"""
+import hashlib
+import io
+import json
+import os
+import random
+import struct
+import tarfile
+import zipfile
+from collections import namedtuple
+
+FEIGN_CLIENT = 'Lorg/springframework/cloud/openfeign/FeignClient;'
+ENABLE_EUREKA_SERVER = 'Lorg/springframework/cloud/netflix/eureka/server/EnableEurekaServer;'
+DISCOVERY_SERVICE = 'discovery'
+# App label of the pods of the Eureka server, as the analysis expects it
+DISCOVERY_POD_LABEL = 'k8n-service-discovery'
+SERVICE_PORT = 8080
+EUREKA_PORT = 8761
+
+# A generated fleet: the folders to pass to aa_pro_max.py, the pods to serve from the kubectl stub
+# ({name, app, ip, port} dicts) and the number of service calls
+Fleet = namedtuple('Fleet', ['images', 'root', 'pods', 'calls'])
+
+
+def service_name(index):
+    return f'svc-{index:04d}'
+
+
+def class_file(name, annotations):
+    """Return a minimal class file `name` (internal form) carrying runtime visible `annotations`.
+
+    `annotations` is a list of (type descriptor, {element: string or list of strings}).
+    """
+    pool = []
+    utf8_index = {}
+
+    def utf8(text):
+        if text not in utf8_index:
+            data = text.encode('utf-8')
+            pool.append(b'\x01' + struct.pack('>H', len(data)) + data)
+            utf8_index[text] = len(pool)
+        return utf8_index[text]
+
+    def class_ref(class_name):
+        pool.append(b'\x07' + struct.pack('>H', utf8(class_name)))
+        return len(pool)
+
+    this_class = class_ref(name)
+    super_class = class_ref('java/lang/Object')
+    body = struct.pack('>H', len(annotations))
+    for annotation_type, elements in annotations:
+        body += struct.pack('>HH', utf8(annotation_type), len(elements))
+        for element, value in elements.items():
+            body += struct.pack('>H', utf8(element))
+            if isinstance(value, list):
+                body += b'[' + struct.pack('>H', len(value))
+                body += b''.join(b's' + struct.pack('>H', utf8(item)) for item in value)
+            else:
+                body += b's' + struct.pack('>H', utf8(value))
+    attribute_name = utf8('RuntimeVisibleAnnotations')
+    data = struct.pack('>IHHH', 0xCAFEBABE, 0, 52, len(pool) + 1) + b''.join(pool)
+    # Access flags, this and super class, no interfaces, fields or methods
+    data += struct.pack('>HHHHHH', 0x0601, this_class, super_class, 0, 0, 0)
+    data += struct.pack('>HHI', 1, attribute_name, len(body)) + body
+    return data
+
+
+def application_yml(name, routes=()):
+    text = f'spring:\n  application:\n    name: {name}\n'
+    if routes:
+        text += '  cloud:\n    gateway:\n      routes:\n'
+        text += ''.join(f'        - id: {route}\n          uri: lb://{route}\n' for route in routes)
+    return text
+
+
+def spring_boot_jar(name, routes=(), feign_clients=(), eureka_server=False):
+    """Return a Spring Boot fat JAR with an application.yml, one @FeignClient interface per called service
+    and, for a Eureka server, an @EnableEurekaServer main class."""
+    package = 'com/example/' + name.replace('-', '')
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('BOOT-INF/classes/application.yml', application_yml(name, routes))
+        for i, callee in enumerate(feign_clients):
+            archive.writestr(f'BOOT-INF/classes/{package}/Client{i}.class',
+                             class_file(f'{package}/Client{i}', [(FEIGN_CLIENT, {'name': callee})]))
+        main_annotations = [(ENABLE_EUREKA_SERVER, {})] if eureka_server else []
+        archive.writestr(f'BOOT-INF/classes/{package}/Application.class',
+                         class_file(f'{package}/Application', main_annotations))
+        archive.writestr('BOOT-INF/lib/spring-web.jar', b'not a real library')
+    return buffer.getvalue()
+
+
+def layer_tar(files):
+    """Return an uncompressed layer tar of (path, content) pairs."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as layer:
+        for path, data in files:
+            info = tarfile.TarInfo(path)
+            info.size = len(data)
+            layer.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+def write_image(path, layers):
+    """Write a `docker save` style image tar (manifest.json, config, one folder per layer) of layer tars."""
+    with tarfile.open(path, 'w') as image:
+        def add(name, data):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            image.addfile(info, io.BytesIO(data))
+
+        layer_names = []
+        diff_ids = []
+        for layer in layers:
+            digest = hashlib.sha256(layer).hexdigest()
+            layer_names.append(f'{digest}/layer.tar')
+            diff_ids.append('sha256:' + digest)
+            add(layer_names[-1], layer)
+        config = json.dumps({'rootfs': {'type': 'layers', 'diff_ids': diff_ids}}).encode('utf-8')
+        config_name = hashlib.sha256(config).hexdigest() + '.json'
+        add(config_name, config)
+        add('manifest.json', json.dumps([{'Config': config_name, 'RepoTags': [f'{os.path.basename(path)}:latest'],
+                                          'Layers': layer_names}]).encode('utf-8'))
+
+
+def write_fleet(directory, services, replicas=1, calls_per_service=3, seed=0):
+    """Write the images and source tree of a fleet of `services` services (plus the Eureka server) below `directory`.
+
+    Service 0 is a gateway routing to up to 5 services; every service calls `calls_per_service` other
+    services through Feign clients, chosen with a seeded random generator so a fleet is the same on
+    every run. Each service runs `replicas` pods.
+    """
+    generator = random.Random(seed)
+    names = [service_name(i) for i in range(services)]
+    images = os.path.join(directory, 'images')
+    root = os.path.join(directory, 'root')
+    os.makedirs(images, exist_ok=True)
+    # Every image shares the same base layer, as images built from one base image do
+    base_layer = layer_tar([('usr/lib/jvm/lib/modules', b'\0' * 4096), ('etc/os-release', b'ID=bench\n')])
+    calls = 0
+    pods = []
+    for index, name in enumerate(names + [DISCOVERY_SERVICE]):
+        if name == DISCOVERY_SERVICE:
+            routes, feign_clients = [], []
+            app_label = 'discovery-app'
+        else:
+            routes = names[1:6] if index == 0 else []
+            others = names[:index] + names[index + 1:]
+            feign_clients = generator.sample(others, min(calls_per_service, len(others)))
+            app_label = f'{name}-app'
+            calls += len(set(routes) | set(feign_clients))
+            for replica in range(replicas):
+                pod_index = len(pods) + 1
+                pods.append({'name': f'{name}-{replica}', 'app': app_label, 'port': SERVICE_PORT,
+                             'ip': f'10.{pod_index >> 16 & 255}.{pod_index >> 8 & 255}.{pod_index & 255}'})
+        jar = spring_boot_jar(name, routes, feign_clients, eureka_server=name == DISCOVERY_SERVICE)
+        write_image(os.path.join(images, f'{name}.tar'), [base_layer, layer_tar([('app/app.jar', jar)])])
+        os.makedirs(os.path.join(root, name, 'k8s'), exist_ok=True)
+        os.makedirs(os.path.join(root, name, 'src', 'main', 'resources'), exist_ok=True)
+        with open(os.path.join(root, name, 'k8s', 'deployment.yml'), 'w') as f:
+            f.write(f'apiVersion: apps/v1\nkind: Deployment\nmetadata:\n  name: {name}\n  labels:\n    app: {app_label}\n')
+        with open(os.path.join(root, name, 'src', 'main', 'resources', 'application.yml'), 'w') as f:
+            f.write(application_yml(name))
+    pods.append({'name': 'discovery-0', 'app': DISCOVERY_POD_LABEL, 'ip': '10.255.255.254', 'port': EUREKA_PORT})
+    return Fleet(images, root, pods, calls)
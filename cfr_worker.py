@@ -0,0 +1,111 @@
+import atexit
+import logging
+import os
+import re
+import subprocess
+
+logger = logging.getLogger(__name__)
+
+# Java source of the long-lived CFR driver, run with the Java 11+ single-file source launcher
+SERVER_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'CfrServer.java')
+# Jobs sent to the server before reading their replies, so neither side blocks on a full pipe
+BATCH_SIZE = 256
+
+
+def class_filter(class_names):
+    """Return a CFR --jarfilter regex matching only the given fully qualified class names.
+
+    The names may be reported with or without the Spring Boot `BOOT-INF.classes.` prefix, so the
+    pattern anchors on the end of the name.
+    """
+    alternatives = '|'.join(re.escape(class_name) for class_name in sorted(set(class_names)))
+    return f'(^|\\.)({alternatives})$'
+
+
+class CfrWorker:
+    """Decompiles JAR files with one long-lived CFR JVM instead of a `java -jar` per JAR.
+
+    Jobs are (jar path, output directory, class names) tuples; with class names only those
+    classes are decompiled, with None the whole JAR is. If the server cannot be started
+    (no Java 11 source launcher, broken CFR jar...), every job falls back to its own
+    `java -jar <cfr> <jar> --outputdir <dir>` process.
+    """
+
+    def __init__(self, cfr_path, java='java'):
+        self.cfr_path = cfr_path
+        self.java = java
+        self.process = None
+        self.failed = False
+        atexit.register(self.close)
+
+    def _start(self):
+        if self.process is None and not self.failed:
+            try:
+                self.process = subprocess.Popen([self.java, '-cp', self.cfr_path, SERVER_SOURCE],
+                                                stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                                universal_newlines=True, encoding='utf-8')
+                logger.info('Started CFR server (pid %d)', self.process.pid)
+            except OSError as e:
+                logger.warning('Could not start the CFR server, decompiling one JAR per JVM: %s', e)
+                self.failed = True
+        return self.process
+
+    def close(self):
+        if self.process is not None:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=30)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+            self.process = None
+
+    @staticmethod
+    def _job_args(job):
+        jar_file, output_dir, class_names = job
+        return jar_file, output_dir, '' if class_names is None else class_filter(class_names)
+
+    def _decompile_once(self, job):
+        jar_file, output_dir, jar_filter = self._job_args(job)
+        command = [self.java, '-jar', self.cfr_path, jar_file, '--outputdir', output_dir]
+        if jar_filter:
+            command += ['--jarfilter', jar_filter]
+        return subprocess.run(command).returncode == 0
+
+    def _send(self, jobs):
+        # Send a batch of jobs to the server and return one result per job
+        for job in jobs:
+            jar_file, output_dir, jar_filter = self._job_args(job)
+            self.process.stdin.write(f'{output_dir}\t{jar_filter}\t{jar_file}\n')
+        self.process.stdin.flush()
+        results = []
+        for job in jobs:
+            reply = self.process.stdout.readline()
+            if not reply:
+                raise OSError('CFR server closed its output')
+            status, _, message = reply.rstrip('\n').partition('\t')
+            if status != 'OK':
+                logger.warning('CFR failed on %s: %s', job[0], message)
+            results.append(status == 'OK')
+        return results
+
+    def decompile(self, jobs):
+        """Decompile a batch of (jar path, output directory, class names) jobs; returns a success flag per job."""
+        # A filter without any class means there is nothing worth decompiling in the JAR
+        jobs = list(jobs)
+        results = [True] * len(jobs)
+        pending = [index for index, job in enumerate(jobs) if job[2] is None or job[2]]
+        done = 0
+        if pending and self._start() is not None:
+            try:
+                while done < len(pending):
+                    batch = pending[done:done + BATCH_SIZE]
+                    for index, ok in zip(batch, self._send([jobs[index] for index in batch])):
+                        results[index] = ok
+                    done += len(batch)
+            except OSError as e:
+                logger.warning('CFR server failed, decompiling one JAR per JVM: %s', e)
+                self.close()
+                self.failed = True
+        for index in pending[done:]:
+            results[index] = self._decompile_once(jobs[index])
+        return results
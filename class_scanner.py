@@ -0,0 +1,235 @@
+import logging
+import struct
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+# Simple names of the annotations the analysis looks for; the package differs between Spring Cloud versions
+# (org.springframework.cloud.openfeign.FeignClient, org.springframework.cloud.netflix.feign.FeignClient, ...)
+FEIGN_CLIENT = 'FeignClient'
+ENABLE_EUREKA_SERVER = 'EnableEurekaServer'
+# Byte patterns of the annotation type descriptors, used to skip class files without a full parse
+_PREFILTER = (b'/' + FEIGN_CLIENT.encode() + b';', b'/' + ENABLE_EUREKA_SERVER.encode() + b';')
+
+# Constant pool tags and the size of their payload in bytes (Utf8 has a variable size)
+_CONSTANT_UTF8 = 1
+_CONSTANT_SIZES = {3: 4, 4: 4, 5: 8, 6: 8, 7: 2, 8: 2, 9: 4, 10: 4, 11: 4, 12: 4, 15: 3, 16: 2, 17: 4, 18: 4,
+                   19: 2, 20: 2}
+
+
+class ClassFormatError(ValueError):
+    pass
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def u1(self):
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def u2(self):
+        value, = struct.unpack_from('>H', self.data, self.pos)
+        self.pos += 2
+        return value
+
+    def u4(self):
+        value, = struct.unpack_from('>I', self.data, self.pos)
+        self.pos += 4
+        return value
+
+    def skip(self, size):
+        self.pos += size
+
+
+def _read_constant_pool(reader):
+    # Index -> (tag, raw payload); Utf8 payloads are decoded, everything else is kept as bytes
+    pool = {}
+    count = reader.u2()
+    index = 1
+    while index < count:
+        tag = reader.u1()
+        if tag == _CONSTANT_UTF8:
+            length = reader.u2()
+            raw = reader.data[reader.pos:reader.pos + length]
+            reader.skip(length)
+            # Modified UTF-8 only differs from UTF-8 for NUL and supplementary characters
+            pool[index] = (tag, raw.decode('utf-8', errors='replace'))
+        elif tag in _CONSTANT_SIZES:
+            size = _CONSTANT_SIZES[tag]
+            pool[index] = (tag, reader.data[reader.pos:reader.pos + size])
+            reader.skip(size)
+            if tag in (5, 6):
+                # Long and Double constants take up two entries
+                index += 1
+        else:
+            raise ClassFormatError(f'Unknown constant pool tag {tag}')
+        index += 1
+    return pool
+
+
+def _utf8(pool, index):
+    tag, value = pool.get(index, (None, None))
+    if tag != _CONSTANT_UTF8:
+        raise ClassFormatError(f'Constant #{index} is not a Utf8 entry')
+    return value
+
+
+def _constant(pool, tag, index):
+    entry_tag, raw = pool.get(index, (None, None))
+    if entry_tag == _CONSTANT_UTF8:
+        return raw
+    if entry_tag == 3:
+        value, = struct.unpack('>i', raw)
+        return bool(value) if tag == 'Z' else chr(value) if tag == 'C' else value
+    if entry_tag == 4:
+        return struct.unpack('>f', raw)[0]
+    if entry_tag == 5:
+        return struct.unpack('>q', raw)[0]
+    if entry_tag == 6:
+        return struct.unpack('>d', raw)[0]
+    raise ClassFormatError(f'Constant #{index} cannot be an annotation value')
+
+
+def _read_element_value(reader, pool):
+    tag = chr(reader.u1())
+    if tag in 'BCDFIJSZs':
+        return _constant(pool, tag, reader.u2())
+    if tag == 'e':
+        type_name = _utf8(pool, reader.u2())
+        return type_name, _utf8(pool, reader.u2())
+    if tag == 'c':
+        return _utf8(pool, reader.u2())
+    if tag == '@':
+        return _read_annotation(reader, pool)
+    if tag == '[':
+        return [_read_element_value(reader, pool) for _ in range(reader.u2())]
+    raise ClassFormatError(f'Unknown element value tag {tag!r}')
+
+
+def _read_annotation(reader, pool):
+    annotation_type = _utf8(pool, reader.u2())
+    elements = {}
+    for _ in range(reader.u2()):
+        element_name = _utf8(pool, reader.u2())
+        elements[element_name] = _read_element_value(reader, pool)
+    return annotation_type, elements
+
+
+def _skip_members(reader):
+    # Fields and methods: access flags, name, descriptor and attributes
+    for _ in range(reader.u2()):
+        reader.skip(6)
+        for _ in range(reader.u2()):
+            reader.skip(2)
+            reader.skip(reader.u4())
+
+
+def read_class_annotations(data):
+    """Parse a .class file and return (class name, [(annotation type descriptor, {element: value}), ...]).
+
+    Only the RuntimeVisibleAnnotations attribute of the class itself is read; fields and methods are skipped.
+    """
+    reader = _Reader(data)
+    try:
+        if reader.u4() != 0xCAFEBABE:
+            raise ClassFormatError('Not a class file')
+        reader.skip(4)
+        pool = _read_constant_pool(reader)
+        reader.skip(2)
+        this_class = reader.u2()
+        reader.skip(2)
+        reader.skip(2 * reader.u2())
+        _skip_members(reader)
+        _skip_members(reader)
+        annotations = []
+        for _ in range(reader.u2()):
+            attribute_name = _utf8(pool, reader.u2())
+            length = reader.u4()
+            end = reader.pos + length
+            if attribute_name == 'RuntimeVisibleAnnotations':
+                for _ in range(reader.u2()):
+                    annotations.append(_read_annotation(reader, pool))
+            reader.pos = end
+    except (IndexError, struct.error) as e:
+        raise ClassFormatError(f'Truncated class file: {e}')
+    tag, name_index = pool.get(this_class, (None, None))
+    class_name = _utf8(pool, struct.unpack('>H', name_index)[0]) if tag == 7 else None
+    return (class_name.replace('/', '.') if class_name else None), annotations
+
+
+def _simple_name(descriptor):
+    # 'Lorg/springframework/cloud/openfeign/FeignClient;' -> 'FeignClient'
+    return descriptor.rstrip(';').rsplit('/', 1)[-1]
+
+
+def feign_client_target(elements):
+    """Return the service name of a @FeignClient annotation; `name` and `value` are aliases."""
+    for element in ('value', 'name'):
+        target = elements.get(element)
+        if isinstance(target, str) and target:
+            return target
+    return None
+
+
+def annotated_classes(jar):
+    """Return the names of the classes of a JAR whose bytes reference @FeignClient or @EnableEurekaServer.
+
+    This only runs the byte prefilter, so it also finds classes that read_class_annotations() cannot parse;
+    it is used to restrict CFR decompilation to the classes that matter.
+    """
+    class_names = []
+    with zipfile.ZipFile(jar) as archive:
+        for entry in sorted(archive.namelist()):
+            if entry.endswith('.class') and any(pattern in archive.read(entry) for pattern in _PREFILTER):
+                class_name = entry[:-len('.class')]
+                if class_name.startswith('BOOT-INF/classes/'):
+                    class_name = class_name[len('BOOT-INF/classes/'):]
+                class_names.append(class_name.replace('/', '.'))
+    return class_names
+
+
+def scan_jar(jar):
+    """Scan the class files of a JAR (path or open ZipFile) for @FeignClient and @EnableEurekaServer.
+
+    Returns a dict with the Feign target service names, whether the JAR contains an
+    @EnableEurekaServer class and the names of the classes carrying either annotation.
+    Nested JARs (BOOT-INF/lib) are not scanned, like with the decompiled sources.
+    """
+    result = {'feign_clients': [], 'eureka_server': False, 'classes': []}
+    close = not isinstance(jar, zipfile.ZipFile)
+    archive = zipfile.ZipFile(jar) if close else jar
+    try:
+        for entry in sorted(archive.namelist()):
+            if not entry.endswith('.class'):
+                continue
+            data = archive.read(entry)
+            if not any(pattern in data for pattern in _PREFILTER):
+                continue
+            try:
+                class_name, annotations = read_class_annotations(data)
+            except ClassFormatError as e:
+                logger.warning('Could not parse class file %s: %s', entry, e)
+                continue
+            found = False
+            for annotation_type, elements in annotations:
+                simple_name = _simple_name(annotation_type)
+                if simple_name == FEIGN_CLIENT:
+                    target = feign_client_target(elements)
+                    if target is not None:
+                        logger.debug('Found @FeignClient annotation: %s (%s)', target, class_name)
+                        result['feign_clients'].append(target)
+                        found = True
+                elif simple_name == ENABLE_EUREKA_SERVER:
+                    logger.debug('Found @EnableEurekaServer annotation (%s)', class_name)
+                    result['eureka_server'] = True
+                    found = True
+            if found:
+                result['classes'].append(class_name)
+    finally:
+        if close:
+            archive.close()
+    return result
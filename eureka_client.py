@@ -0,0 +1,134 @@
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from collections import Counter, namedtuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EUREKA_URL = 'http://localhost:8761/eureka'
+
+# One registered instance; port is the port number as text, or 'N/A' when the port is disabled
+Instance = namedtuple('Instance', ['app', 'instance_id', 'ip', 'port', 'status'])
+
+
+def _text(element, tag):
+    child = element.find(tag)
+    return child.text.strip() if child is not None and child.text else None
+
+
+def parse_instance(element):
+    """Return (Instance, action type) for an <instance> element.
+
+    Every instance is kept, because the apps hashcode sent by the server counts all of them: an instance
+    without a port gets port 'N/A' and one without an app name the app '' (see get_eureka_topology()).
+    """
+    instance_id = _text(element, 'instanceId') or _text(element, 'hostName') or ''
+    port_element = element.find('port')
+    if port_element is None:
+        logger.warning('No port element found for instance %s', instance_id)
+        port = 'N/A'
+    elif port_element.attrib.get('enabled', 'true') == 'true':
+        port = (port_element.text or '').strip() or 'N/A'
+    else:
+        port = 'N/A'
+    app = _text(element, 'app')
+    if app is None:
+        logger.warning('No app element found for instance %s', instance_id)
+    instance = Instance((app or '').lower(), instance_id, _text(element, 'ipAddr'), port,
+                        _text(element, 'status') or 'UNKNOWN')
+    return instance, _text(element, 'actionType')
+
+
+def parse_applications(source):
+    """Parse an <applications> document from a file object, element by element.
+
+    Returns the (Instance, action type) pairs and the apps hashcode. Each <instance> is dropped
+    from the tree as soon as it is parsed, so a large registry is never held as a whole tree.
+    """
+    instances = []
+    hashcode = None
+    for _, element in ET.iterparse(source, events=('end',)):
+        if element.tag == 'instance':
+            instances.append(parse_instance(element))
+            element.clear()
+        elif element.tag == 'apps__hashcode':
+            hashcode = (element.text or '').strip()
+    return instances, hashcode
+
+
+def reconcile_hashcode(instances):
+    """Compute the Eureka apps hashcode of instances: '<STATUS>_<count>_' for every status, sorted by status."""
+    counts = Counter(instance.status for instance in instances)
+    return ''.join(f'{status}_{counts[status]}_' for status in sorted(counts))
+
+
+class EurekaClient:
+    """Client of the Eureka REST API keeping a local copy of the registry.
+
+    The first call fetches the full registry from `/apps`; later calls only fetch `/apps/delta`
+    and apply the added, modified and deleted instances to the local copy. When the hashcode of the
+    local copy does not match the one sent by the server (e.g. a delta was missed), the full registry
+    is fetched again. All requests share one pooled session.
+    """
+
+    def __init__(self, url=DEFAULT_EUREKA_URL, timeout=10):
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        # requests is only needed once the registry is read, not by every importer of this module
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.headers['Accept'] = 'application/xml'
+        # (app, instance ID) -> Instance, None until the first full fetch
+        self.registry = None
+        self._lock = threading.Lock()
+
+    def _get(self, path):
+        metrics.increment('eureka_requests', path=path)
+        with metrics.timer('eureka_fetch'):
+            response = self.session.get(self.url + path, timeout=self.timeout, stream=True)
+            try:
+                response.raise_for_status()
+                response.raw.decode_content = True
+                return parse_applications(response.raw)
+            finally:
+                response.close()
+
+    def _fetch_full(self):
+        instances, _ = self._get('/apps')
+        self.registry = {(instance.app, instance.instance_id): instance for instance, _ in instances}
+
+    def _fetch_delta(self):
+        """Apply /apps/delta to the registry; returns False when the result does not match the server."""
+        import requests
+
+        try:
+            changes, hashcode = self._get('/apps/delta')
+        except (requests.RequestException, ET.ParseError):
+            return False
+        registry = dict(self.registry)
+        for instance, action in changes:
+            key = (instance.app, instance.instance_id)
+            if action == 'DELETED':
+                registry.pop(key, None)
+            else:
+                registry[key] = instance
+        if hashcode is not None and hashcode != reconcile_hashcode(registry.values()):
+            return False
+        self.registry = registry
+        return True
+
+    def instances(self):
+        """Return the registered instances, sorted by app and instance ID.
+
+        Raises requests.RequestException when the registry cannot be fetched.
+        """
+        with self._lock:
+            if self.registry is None or not self._fetch_delta():
+                self._fetch_full()
+            return sorted(self.registry.values())
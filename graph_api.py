@@ -0,0 +1,139 @@
+import threading
+from collections import OrderedDict, deque, namedtuple
+
+DEFAULT_EDGE_LIMIT = 1000
+MAX_EDGE_LIMIT = 10000
+# Node attributes that only matter to the pyvis rendering
+RENDER_ATTRIBUTES = ('size', 'x', 'y', 'physics')
+
+# What the filters of a request select from a graph, sorted once so every page is a slice: the edges in
+# page order, the selected nodes without any selected edge, node -> position in the node order of a page
+# and the number of selected nodes
+GraphSelection = namedtuple('GraphSelection', ['edges', 'isolated_nodes', 'node_rank', 'total_nodes'])
+
+
+class GraphQueryError(ValueError):
+    """A graph API request with invalid parameters."""
+
+
+def parse_graph_query(args):
+    """Read the filters of a graph API request from its query arguments (a werkzeug MultiDict).
+
+    `service` may be repeated or comma separated; `depth` defaults to 1 when services are given.
+    """
+    services = [service for value in args.getlist('service') for service in value.split(',') if service]
+    try:
+        depth = int(args.get('depth', 1))
+        limit = int(args.get('limit', DEFAULT_EDGE_LIMIT))
+        offset = int(args.get('cursor', 0))
+    except ValueError:
+        raise GraphQueryError('depth, limit and cursor must be integers')
+    if depth < 0 or offset < 0 or not 1 <= limit <= MAX_EDGE_LIMIT:
+        raise GraphQueryError(f'depth and cursor must not be negative and limit must be between 1 and {MAX_EDGE_LIMIT}')
+    return {'services': services, 'namespace': args.get('namespace') or None, 'depth': depth,
+            'limit': limit, 'offset': offset}
+
+
+def node_matches(node, attributes, services):
+    return node in services or attributes.get('group') in services or attributes.get('service') in services
+
+
+def select_nodes(graph, services=(), namespace=None, depth=1):
+    """Return the nodes of a graph selected by the filters.
+
+    With `services`, the nodes of those services (by node name, service group or service name) and
+    every node at most `depth` edges away from them, in either direction. With `namespace`, only the
+    nodes in that namespace.
+    """
+    if services:
+        services = set(services)
+        selected = {node for node, attributes in graph.nodes(data=True) if node_matches(node, attributes, services)}
+        # Breadth first search over the edges in both directions
+        queue = deque((node, 0) for node in selected)
+        while queue:
+            node, distance = queue.popleft()
+            if distance == depth:
+                continue
+            for neighbor in list(graph.successors(node)) + list(graph.predecessors(node)):
+                if neighbor not in selected:
+                    selected.add(neighbor)
+                    queue.append((neighbor, distance + 1))
+    else:
+        selected = set(graph.nodes())
+    if namespace is not None:
+        selected = {node for node in selected if graph.nodes[node].get('namespace') == namespace}
+    return selected
+
+
+def _node_json(graph, node):
+    attributes = {key: value for key, value in graph.nodes[node].items() if key not in RENDER_ATTRIBUTES}
+    attributes['id'] = node
+    return attributes
+
+
+def select_graph(graph, services=(), namespace=None, depth=1):
+    """Select the part of a graph matching the filters (see select_nodes()) and sort it into a GraphSelection."""
+    selected = select_nodes(graph, services, namespace, depth)
+    edges = [(source, target) for _, _, source, target in
+             sorted((str(source), str(target), source, target) for source, target in graph.edges()
+                    if source in selected and target in selected)]
+    nodes = sorted(selected, key=str)
+    isolated_nodes = [node for node in nodes
+                      if not any(neighbor in selected for neighbor in graph.successors(node))
+                      and not any(neighbor in selected for neighbor in graph.predecessors(node))]
+    return GraphSelection(edges, isolated_nodes, {node: rank for rank, node in enumerate(nodes)}, len(selected))
+
+
+class SelectionCache:
+    """The GraphSelections of the latest snapshot version, so paging through a graph only sorts it once.
+
+    Keeps at most `max_entries` graph and filter combinations, dropping the least recently used; a newer
+    snapshot version drops them all. Selections of an older version are computed but not kept.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self.version = None
+        self._selections = OrderedDict()
+        self._lock = threading.Lock()
+
+    def select(self, version, name, graph, services=(), namespace=None, depth=1):
+        """Return the GraphSelection of the graph `name` of snapshot `version`, selecting it on first use."""
+        key = (name, tuple(sorted(set(services))), namespace, depth if services else None)
+        with self._lock:
+            if self.version is None or version > self.version:
+                self.version = version
+                self._selections.clear()
+            selection = self._selections.get(key) if version == self.version else None
+            if selection is not None:
+                self._selections.move_to_end(key)
+                return selection
+        # Selected outside the lock; two requests for a new key may both select it, keeping the same result
+        selection = select_graph(graph, services, namespace, depth)
+        with self._lock:
+            if version == self.version:
+                self._selections[key] = selection
+                while len(self._selections) > self.max_entries:
+                    self._selections.popitem(last=False)
+        return selection
+
+
+def graph_page(graph, selection, limit=DEFAULT_EDGE_LIMIT, offset=0):
+    """Return one page of a GraphSelection of a graph as a JSON-ready dict.
+
+    Edges are [source, target] pairs in a stable order, `limit` per page starting at `offset`, and
+    `next_cursor` is the offset of the next page (None on the last page). Each page lists the nodes
+    its edges refer to; the first page also lists the selected nodes without any edge.
+    """
+    page_edges = selection.edges[offset:offset + limit]
+    nodes = {node for edge in page_edges for node in edge}
+    if offset == 0:
+        nodes.update(selection.isolated_nodes)
+    total_edges = len(selection.edges)
+    return {
+        'nodes': [_node_json(graph, node) for node in sorted(nodes, key=selection.node_rank.__getitem__)],
+        'edges': [[source, target] for source, target in page_edges],
+        'total_nodes': selection.total_nodes,
+        'total_edges': total_edges,
+        'next_cursor': offset + limit if offset + limit < total_edges else None,
+    }
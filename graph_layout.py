@@ -0,0 +1,211 @@
+import math
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    # The force layout falls back to pure Python, which is fast enough for the service level graph
+    np = None
+
+# Distance between neighbouring pods of a service, in pixels
+POD_SPACING = 40
+# Free space between the pod clusters of two services, in pixels
+SERVICE_MARGIN = 120
+GOLDEN_ANGLE = math.pi * (3 - math.sqrt(5))
+# Share of the ideal distance below which two services count as overlapping
+OVERLAP_FACTOR = 0.8
+
+
+def _unit(name):
+    """A number in [0, 1) derived from a name, the same in every run."""
+    return zlib.crc32(str(name).encode('utf-8')) / 2 ** 32
+
+
+def slot_offset(slot):
+    """Offset of the `slot`-th pod from the center of its service, on a sunflower spiral."""
+    radius = POD_SPACING / math.sqrt(math.pi) * math.sqrt(slot)
+    angle = slot * GOLDEN_ANGLE
+    return radius * math.cos(angle), radius * math.sin(angle)
+
+
+def cluster_radius(pod_count):
+    return POD_SPACING / math.sqrt(math.pi) * math.sqrt(max(pod_count, 1))
+
+
+def _distances_numpy(x, y):
+    # Much faster than np.hypot, which guards against overflows that cannot happen here
+    dx = x[:, None] - x[None, :]
+    dy = y[:, None] - y[None, :]
+    dist = np.sqrt(dx * dx + dy * dy)
+    return np.maximum(dist, 0.01, out=dist)
+
+
+def _force_layout_numpy(positions, weights, distances, iterations, temperature):
+    x = np.array([point[0] for point in positions], dtype=float)
+    y = np.array([point[1] for point in positions], dtype=float)
+    ideal = np.array(distances, dtype=float)
+    repulsion = ideal ** 2
+    attraction = np.array(weights, dtype=float) / ideal
+    for iteration in range(iterations):
+        dist = _distances_numpy(x, y)
+        # Every pair repels with ideal²/d, connected pairs attract with d²/ideal; both balance at d = ideal
+        magnitude = repulsion / dist ** 2 - attraction * dist
+        np.fill_diagonal(magnitude, 0)
+        # sum_j magnitude_ij * (x_i - x_j), as a matrix product
+        displacement_x = x * magnitude.sum(axis=1) - magnitude @ x
+        displacement_y = y * magnitude.sum(axis=1) - magnitude @ y
+        length = np.maximum(np.hypot(displacement_x, displacement_y), 0.01)
+        scale = np.minimum(length, temperature * (1 - iteration / iterations)) / length
+        x += displacement_x * scale
+        y += displacement_y * scale
+    # Push apart the clusters that still overlap by a pixel or more
+    for _ in range(50):
+        dist = _distances_numpy(x, y)
+        overlap = np.maximum(ideal * OVERLAP_FACTOR - dist, 0)
+        np.fill_diagonal(overlap, 0)
+        if overlap.max() < 1:
+            break
+        push = overlap / 2 / dist
+        x += x * push.sum(axis=1) - push @ x
+        y += y * push.sum(axis=1) - push @ y
+    return list(zip(x.tolist(), y.tolist()))
+
+
+def _force_layout_python(positions, weights, distances, iterations, temperature):
+    pos = [list(point) for point in positions]
+    count = len(pos)
+    for iteration in range(iterations):
+        displacement = [[0.0, 0.0] for _ in range(count)]
+        for i in range(count):
+            for j in range(count):
+                if i == j:
+                    continue
+                dx = pos[i][0] - pos[j][0]
+                dy = pos[i][1] - pos[j][1]
+                dist = max(math.hypot(dx, dy), 0.01)
+                magnitude = distances[i][j] ** 2 / dist ** 2 - weights[i][j] * dist / distances[i][j]
+                displacement[i][0] += magnitude * dx
+                displacement[i][1] += magnitude * dy
+        step = temperature * (1 - iteration / iterations)
+        for i in range(count):
+            length = max(math.hypot(*displacement[i]), 0.01)
+            pos[i][0] += displacement[i][0] / length * min(length, step)
+            pos[i][1] += displacement[i][1] / length * min(length, step)
+    # Push apart the clusters that still overlap by a pixel or more
+    for _ in range(50):
+        moved = False
+        for i in range(count):
+            for j in range(i + 1, count):
+                dx = pos[i][0] - pos[j][0]
+                dy = pos[i][1] - pos[j][1]
+                dist = max(math.hypot(dx, dy), 0.01)
+                overlap = distances[i][j] * OVERLAP_FACTOR - dist
+                if overlap >= 1:
+                    moved = True
+                    pos[i][0] += overlap / 2 * dx / dist
+                    pos[i][1] += overlap / 2 * dy / dist
+                    pos[j][0] -= overlap / 2 * dx / dist
+                    pos[j][1] -= overlap / 2 * dy / dist
+        if not moved:
+            break
+    return [tuple(point) for point in pos]
+
+
+def force_layout(positions, weights, distances, iterations, temperature):
+    """Run a Fruchterman-Reingold style force layout from the given start positions.
+
+    `weights` is the symmetric matrix of edge weights (0 for no edge) and `distances` the matrix of
+    ideal distances between every pair. Clusters still overlapping at the end are pushed apart, even
+    with no iterations. Uses NumPy when available.
+    """
+    if len(positions) < 2:
+        return [tuple(point) for point in positions]
+    if np is not None:
+        return _force_layout_numpy(positions, weights, distances, iterations, temperature)
+    return _force_layout_python(positions, weights, distances, iterations, temperature)
+
+
+class GraphLayout:
+    """Server side layout of a graph whose nodes belong to services (the `group` node attribute).
+
+    The services are laid out with a force layout on the service level graph, and the pods of each
+    service are placed on a spiral around the service's position, so the cost depends on the number
+    of services rather than on the number of pod edges. The layout remembers the positions of the
+    previous graph: known services start from where they were and only get a few refining
+    iterations, and known pods keep their place in their service, so the view stays stable from one
+    snapshot to the next.
+    """
+
+    def __init__(self, iterations=100, refine_iterations=15):
+        self.iterations = iterations
+        self.refine_iterations = refine_iterations
+        # Service -> center position of the previous layout
+        self.centers = {}
+        # Node -> (service, spiral slot) of the previous layout
+        self.slots = {}
+        # Services and service edges of the previous layout
+        self.structure = None
+
+    def layout(self, graph):
+        """Return node -> (x, y) for every node of a networkx graph."""
+        members = {}
+        for node, attributes in graph.nodes(data=True):
+            members.setdefault(attributes.get('group', node), []).append(node)
+        services = sorted(members, key=str)
+        if not services:
+            return {}
+        index = {service: i for i, service in enumerate(services)}
+        count = len(services)
+        weights = [[0.0] * count for _ in range(count)]
+        for source, target in graph.edges():
+            i = index[graph.nodes[source].get('group', source)]
+            j = index[graph.nodes[target].get('group', target)]
+            if i != j:
+                weights[i][j] = weights[j][i] = 1.0
+        radii = [cluster_radius(len(members[service])) for service in services]
+        distances = [[radii[i] + radii[j] + SERVICE_MARGIN for j in range(count)] for i in range(count)]
+
+        structure = (services, weights)
+        new_services = [service for service in services if service not in self.centers]
+        spread = sum(radii) + SERVICE_MARGIN * count
+        start = []
+        for service in services:
+            if service in self.centers:
+                start.append(self.centers[service])
+            else:
+                # New services start on a circle, at an angle derived from their name
+                angle = 2 * math.pi * _unit(service)
+                start.append((spread / 2 * math.cos(angle), spread / 2 * math.sin(angle)))
+        if new_services:
+            centers = force_layout(start, weights, distances, self.iterations, spread / 4)
+        elif structure != self.structure:
+            centers = force_layout(start, weights, distances, self.refine_iterations, SERVICE_MARGIN / 4)
+        else:
+            # Only pods changed within their services; the services stay where they are unless
+            # a grown cluster now overlaps another one
+            centers = force_layout(start, weights, distances, 0, 0)
+
+        positions = {}
+        slots = {}
+        for service, (center_x, center_y) in zip(services, centers):
+            # Pods keep their slot in their service, new pods take the free slots
+            used = set()
+            placed = []
+            for node in sorted(members[service], key=str):
+                previous = self.slots.get(node)
+                if previous is not None and previous[0] == service and previous[1] not in used:
+                    used.add(previous[1])
+                    placed.append((node, previous[1]))
+                else:
+                    placed.append((node, None))
+            free = (slot for slot in range(len(members[service]) + len(used)) if slot not in used)
+            for node, slot in placed:
+                if slot is None:
+                    slot = next(free)
+                offset_x, offset_y = slot_offset(slot)
+                positions[node] = (round(center_x + offset_x, 1), round(center_y + offset_y, 1))
+                slots[node] = (service, slot)
+        self.centers = dict(zip(services, centers))
+        self.structure = structure
+        self.slots = slots
+        return positions
@@ -0,0 +1,331 @@
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import shutil
+import tarfile
+
+logger = logging.getLogger(__name__)
+
+# Whiteout markers used by Docker/OCI layers to delete files from lower layers
+WHITEOUT_PREFIX = '.wh.'
+OPAQUE_WHITEOUT = '.wh..wh..opq'
+
+# Layer events, in the order they appear in the layer tar:
+#   jar     a regular .jar file, or a hardlink to a .jar file of the same layer, was written at path
+#   wh      a whiteout deletes path (and everything below it) from the lower layers
+#   opq     an opaque whiteout deletes everything below the path directory from the lower layers
+#   hide    a non-JAR file or link replaces path (and everything below it) from the lower layers
+#   dir     a directory replaces a JAR that a lower layer stored at exactly this path
+JAR, WHITEOUT, OPAQUE, HIDE, DIR = 'jar', 'wh', 'opq', 'hide', 'dir'
+
+LAYER_CACHE_VERSION = 2
+
+
+def normalize_member_path(name):
+    """Return a relative, normalized path for a tar member, or None if it escapes the root."""
+    path = posixpath.normpath(name.lstrip('/'))
+    if path in ('.', '') or path == '..' or path.startswith('../'):
+        return None
+    return path
+
+
+def read_image_manifest(image_tar):
+    """Read manifest.json from an opened `docker save` tar and return the entry of the first image."""
+    try:
+        manifest_file = image_tar.extractfile('manifest.json')
+    except KeyError:
+        manifest_file = None
+    if manifest_file is None:
+        raise ValueError('manifest.json not found in the Docker image')
+    manifest = json.load(manifest_file)
+    if not manifest:
+        raise ValueError('manifest.json does not describe any image')
+    # Only the first image of a multi-image tar is analyzed, like the tar based extraction
+    return manifest[0]
+
+
+def read_layer_paths(image_tar):
+    """Return the layer tar paths of the first image in an opened `docker save` tar, in order."""
+    return read_image_manifest(image_tar).get('Layers', [])
+
+
+def layer_events(layer_tar):
+    """Yield (event, path, member) for the entries of a layer tar that matter for the JAR view.
+
+    A hardlink named like a JAR whose target is a JAR written earlier in the same layer is a JAR
+    event too; write_jar() copies it from its target.
+    """
+    # JAR paths of this layer so far, the targets a hardlinked JAR can refer to
+    layer_jars = set()
+    for member in layer_tar:
+        path = normalize_member_path(member.name)
+        if path is None:
+            continue
+        directory, base = posixpath.split(path)
+        if base == OPAQUE_WHITEOUT:
+            yield OPAQUE, directory, member
+        elif base.startswith(WHITEOUT_PREFIX):
+            yield WHITEOUT, posixpath.join(directory, base[len(WHITEOUT_PREFIX):]), member
+        elif member.isdir():
+            # Only a directory named like a JAR can replace one
+            if base.endswith('.jar'):
+                yield DIR, path, member
+        elif member.isfile() and base.endswith('.jar'):
+            layer_jars.add(path)
+            yield JAR, path, member
+        elif member.islnk() and base.endswith('.jar') and normalize_member_path(member.linkname) in layer_jars:
+            layer_jars.add(path)
+            yield JAR, path, member
+        else:
+            yield HIDE, path, member
+
+
+def write_jar(layer_tar, member, jars_dir):
+    """Write the JAR of a JAR event below jars_dir and return its path.
+
+    A stream-read tar cannot go back to the target of a hardlink, so a hardlinked JAR is copied from
+    the file its target was written to earlier in the same layer.
+    """
+    target = os.path.join(jars_dir, normalize_member_path(member.name))
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if member.islnk():
+        shutil.copyfile(os.path.join(jars_dir, normalize_member_path(member.linkname)), target)
+    else:
+        with open(target, 'wb') as f:
+            shutil.copyfileobj(layer_tar.extractfile(member), f)
+    return target
+
+
+def _is_under(path, directory):
+    return directory == '' or path.startswith(directory + '/')
+
+
+class MergedJars:
+    """The JAR files of a union filesystem, built by applying layer events from the bottom layer up."""
+
+    def __init__(self, on_remove=None):
+        # Path of each JAR in the merged filesystem -> (index of the layer that wrote it, source)
+        self.jars = {}
+        self.on_remove = on_remove
+
+    def _hide_lower(self, path, layer_index, include_path=True):
+        for jar_path in list(self.jars):
+            jar_layer, source = self.jars[jar_path]
+            if jar_layer >= layer_index:
+                continue
+            if (include_path and jar_path == path) or _is_under(jar_path, path):
+                del self.jars[jar_path]
+                if self.on_remove is not None:
+                    self.on_remove(jar_path, source)
+
+    def _hides_any(self, path):
+        # Most hidden paths are OS files that shadow no JAR; this check (one pass over the JAR paths,
+        # without the copy and layer lookups of _hide_lower) lets them skip _hide_lower
+        if path in self.jars:
+            return True
+        prefix = path + '/'
+        return any(jar_path.startswith(prefix) for jar_path in self.jars)
+
+    def apply(self, event, path, layer_index, source=None):
+        if event == OPAQUE:
+            self._hide_lower(path, layer_index, include_path=False)
+        elif event == JAR:
+            self._hide_lower(path, layer_index)
+            self.jars[path] = (layer_index, source)
+        elif event == DIR:
+            if path in self.jars:
+                self._hide_lower(path, layer_index)
+        elif self._hides_any(path):
+            self._hide_lower(path, layer_index)
+
+
+def extract_jars(image_path, output_dir):
+    """Stream a `docker save` tar and write out only the JAR files of the merged filesystem.
+
+    Layers are read in manifest order as nested streams, whiteout and opaque whiteout entries
+    remove files from lower layers, and nothing but the `.jar` files is written to
+    `output_dir`. Returns the sorted list of extracted JAR paths.
+    """
+    # Extract into a temporary directory so an interrupted run never looks complete
+    partial_dir = output_dir + '.partial'
+    if os.path.exists(partial_dir):
+        shutil.rmtree(partial_dir)
+    os.makedirs(partial_dir)
+
+    merged = MergedJars(on_remove=lambda jar_path, source: os.remove(source))
+    with tarfile.open(image_path) as image_tar:
+        for layer_index, layer_path in enumerate(read_layer_paths(image_tar)):
+            layer_file = image_tar.extractfile(layer_path)
+            if layer_file is None:
+                raise ValueError(f'Layer {layer_path} not found in the Docker image')
+            # Layers may be plain or compressed tars; read them as a forward-only stream
+            with tarfile.open(fileobj=layer_file, mode='r|*') as layer_tar:
+                for event, path, member in layer_events(layer_tar):
+                    if event != JAR:
+                        merged.apply(event, path, layer_index)
+                        continue
+                    # Drop the lower layer copy first, then write this layer's JAR in its place
+                    merged.apply(event, path, layer_index, os.path.join(partial_dir, path))
+                    write_jar(layer_tar, member, partial_dir)
+
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    os.replace(partial_dir, output_dir)
+    return sorted(os.path.join(output_dir, jar_path) for jar_path in merged.jars)
+
+
+class LayerCache:
+    """Content-addressed cache of the JAR inventory of image layers, shared across images and runs.
+
+    Every layer is stored once under `<cache_dir>/<algorithm>-<digest>/` as an `inventory.json`
+    listing its layer events plus a `jars/` directory with the JAR files it contains. A layer
+    that is already in the cache is never read from the image tar again.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        # Inventories already loaded during this run, by layer digest
+        self._inventories = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, digest):
+        return os.path.join(self.cache_dir, digest.replace(':', '-'))
+
+    def inventory(self, digest):
+        """Return the cached event list of a layer, or None if the layer was never scanned."""
+        if digest in self._inventories:
+            return self._inventories[digest]
+        try:
+            with open(os.path.join(self._entry_dir(digest), 'inventory.json'), 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get('version') != LAYER_CACHE_VERSION:
+            return None
+        self._inventories[digest] = data['events']
+        return data['events']
+
+    def add(self, digest, layer_file):
+        """Scan a layer stream into the cache and return its event list."""
+        entry_dir = self._entry_dir(digest)
+        # Scan into a per-process directory; a concurrent run may be caching the same layer
+        partial_dir = f'{entry_dir}.partial-{os.getpid()}'
+        if os.path.exists(partial_dir):
+            shutil.rmtree(partial_dir)
+        os.makedirs(partial_dir)
+        events = []
+        with tarfile.open(fileobj=layer_file, mode='r|*') as layer_tar:
+            for event, path, member in layer_events(layer_tar):
+                events.append([event, path])
+                if event == JAR:
+                    write_jar(layer_tar, member, os.path.join(partial_dir, 'jars'))
+        with open(os.path.join(partial_dir, 'inventory.json'), 'w') as f:
+            json.dump({'version': LAYER_CACHE_VERSION, 'digest': digest, 'events': events}, f)
+        try:
+            os.replace(partial_dir, entry_dir)
+        except OSError:
+            if self.inventory(digest) is not None:
+                # Another process finished the same layer first; its copy is identical
+                shutil.rmtree(partial_dir)
+            else:
+                # A broken entry or one of another LAYER_CACHE_VERSION; replace it with this scan
+                logger.debug('Replacing the invalid layer cache entry %s', entry_dir)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                try:
+                    os.replace(partial_dir, entry_dir)
+                except OSError:
+                    # Another process replaced it at the same time
+                    shutil.rmtree(partial_dir)
+                    if self.inventory(digest) is None:
+                        raise
+        self._inventories[digest] = events
+        return events
+
+    def image_jars(self, image_path):
+        """Return the cached paths of the JAR files in the merged filesystem of a `docker save` tar.
+
+        Only layers missing from the cache are streamed out of the image tar.
+        """
+        merged = MergedJars()
+        with tarfile.open(image_path) as image_tar:
+            manifest = read_image_manifest(image_tar)
+            layer_paths = manifest.get('Layers', [])
+            digests = layer_digests(image_tar, manifest)
+            for layer_index, layer_path in enumerate(layer_paths):
+                digest = digests[layer_index]
+                if digest is None:
+                    # No content address in the image metadata; hash the layer blob itself
+                    digest = _hash_member(image_tar, layer_path)
+                events = self.inventory(digest)
+                if events is None:
+                    logger.debug('Scanning layer %s into the layer cache', digest)
+                    layer_file = image_tar.extractfile(layer_path)
+                    if layer_file is None:
+                        raise ValueError(f'Layer {layer_path} not found in the Docker image')
+                    events = self.add(digest, layer_file)
+                else:
+                    logger.debug('Layer %s found in the layer cache', digest)
+                jars_dir = os.path.join(self._entry_dir(digest), 'jars')
+                for event, path in events:
+                    source = os.path.join(jars_dir, path) if event == JAR else None
+                    merged.apply(event, path, layer_index, source)
+        return sorted(source for _, source in merged.jars.values())
+
+
+def layer_digests(image_tar, manifest):
+    """Return the content digest of every layer of an image, or None where it cannot be determined.
+
+    The digests come from `rootfs.diff_ids` of the image config, which are the sha256 of the
+    uncompressed layer tars. OCI layout paths (`blobs/sha256/<hex>`) are used as a fallback.
+    """
+    layer_paths = manifest.get('Layers', [])
+    diff_ids = []
+    config_path = manifest.get('Config')
+    if config_path:
+        try:
+            config_file = image_tar.extractfile(config_path)
+            if config_file is not None:
+                diff_ids = json.load(config_file).get('rootfs', {}).get('diff_ids', [])
+        except (KeyError, ValueError):
+            diff_ids = []
+    if len(diff_ids) == len(layer_paths):
+        return list(diff_ids)
+    digests = []
+    for layer_path in layer_paths:
+        parts = layer_path.split('/')
+        if len(parts) == 3 and parts[0] == 'blobs':
+            digests.append(f'{parts[1]}:{parts[2]}')
+        else:
+            digests.append(None)
+    return digests
+
+
+def image_digest(image_path):
+    """Return the image ID of a `docker save` tar: the sha256 of its config, which covers every layer digest.
+
+    Only the tar headers and the small config file are read. Tars without a manifest.json
+    fall back to the sha256 of the whole file.
+    """
+    try:
+        with tarfile.open(image_path) as image_tar:
+            config_path = read_image_manifest(image_tar).get('Config')
+            config_file = image_tar.extractfile(config_path) if config_path else None
+            if config_file is not None:
+                return 'sha256:' + hashlib.sha256(config_file.read()).hexdigest()
+    except (tarfile.TarError, ValueError, KeyError):
+        pass
+    digest = hashlib.sha256()
+    with open(image_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return 'sha256:' + digest.hexdigest()
+
+
+def _hash_member(image_tar, member_name):
+    digest = hashlib.sha256()
+    member_file = image_tar.extractfile(member_name)
+    for chunk in iter(lambda: member_file.read(1024 * 1024), b''):
+        digest.update(chunk)
+    return 'sha256:' + digest.hexdigest()
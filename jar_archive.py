@@ -0,0 +1,65 @@
+import fnmatch
+import io
+import posixpath
+import zipfile
+
+
+# Where Spring Boot looks for the configuration inside a fat JAR, and inside a plain JAR
+CONFIG_DIRECTORIES = ('BOOT-INF/classes/', '')
+NESTED_JAR_DIRECTORY = 'BOOT-INF/lib/'
+
+
+def open_nested_jar(archive, entry):
+    """Open a JAR stored inside another JAR without writing it to disk.
+
+    Spring Boot stores nested JARs uncompressed, so those are read in place through a seekable
+    entry stream; compressed ones are inflated into memory.
+    """
+    info = archive.getinfo(entry)
+    if info.compress_type == zipfile.ZIP_STORED:
+        return zipfile.ZipFile(archive.open(info))
+    return zipfile.ZipFile(io.BytesIO(archive.read(info)))
+
+
+def application_yml_entries(archive):
+    """Return the application.yml and application-*.yml entries of a JAR, looked up in its central directory.
+
+    The plain application.yml comes first, followed by the profile specific files in name order.
+    """
+    names = set(archive.namelist())
+    for directory in CONFIG_DIRECTORIES:
+        base = directory + 'application.yml'
+        profiles = sorted(name for name in names
+                          if posixpath.dirname(name) == directory.rstrip('/')
+                          and fnmatch.fnmatchcase(posixpath.basename(name), 'application-*.yml'))
+        entries = ([base] if base in names else []) + profiles
+        if entries:
+            return entries
+    return []
+
+
+def read_application_ymls(archive, location='', recurse=True):
+    """Return [(location, yaml document), ...] for the application*.yml files of a JAR.
+
+    `archive` is an open ZipFile. If the JAR itself has no configuration, its nested
+    BOOT-INF/lib/*.jar entries are searched too (one level deep), without temp files.
+    """
+    import yaml
+
+    documents = []
+    for entry in application_yml_entries(archive):
+        for document in yaml.safe_load_all(archive.read(entry)):
+            if isinstance(document, dict):
+                documents.append((f'{location}!/{entry}', document))
+    if documents or not recurse:
+        return documents
+    for entry in sorted(archive.namelist()):
+        if entry.startswith(NESTED_JAR_DIRECTORY) and entry.endswith('.jar'):
+            try:
+                with open_nested_jar(archive, entry) as nested:
+                    documents = read_application_ymls(nested, f'{location}!/{entry}', recurse=False)
+            except zipfile.BadZipFile:
+                continue
+            if documents:
+                return documents
+    return []
@@ -0,0 +1,134 @@
+import threading
+import time
+from contextlib import contextmanager
+
+PREFIX = 'aa_pro_max'
+# Help text of each counter
+COUNTERS = {
+    'images_analyzed': 'Docker images analyzed (not found in the analysis manifest).',
+    'jars': 'JAR files found in the analyzed images, by what was done with them.',
+    'eureka_requests': 'Requests sent to the Eureka REST API.',
+    'kubectl_calls': 'kubectl processes started, by kubectl command.',
+    'api_server_requests': 'Requests sent to the Kubernetes API server.',
+    'collection_errors': 'Eureka and kubectl calls of a topology collection that failed or timed out.',
+    'refresh_failures': 'Topology refreshes that failed.',
+    'policies_generated': 'Network policies generated.',
+    'policy_operations': 'Network policies created, updated or deleted, by result.',
+}
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metrics:
+    """Per-stage timers, counters and gauges of this process, rendered in the Prometheus text format.
+
+    Timers are kept per stage as a count, a sum and the duration of the last run; counters are
+    named and labelled; gauges are callbacks evaluated when the metrics are rendered. Everything is
+    in memory and thread safe, so recording a metric costs about as much as a dict update.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Stage -> [count, total seconds, seconds of the last run]
+        self._stages = {}
+        # Counter name -> {sorted label items: value}
+        self._counters = {}
+        # Gauge name -> (help text, callback returning a number or {label items: number})
+        self._gauges = {}
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            entry = self._stages.setdefault(stage, [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = seconds
+
+    @contextmanager
+    def timer(self, stage):
+        """Time the body of a with statement as one run of `stage`, also when it raises."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - started)
+
+    def increment(self, name, amount=1, **labels):
+        """Add `amount` to counter `name` of COUNTERS (reported as <name>_total) with the given labels."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            values = self._counters.setdefault(name, {})
+            values[key] = values.get(key, 0) + amount
+
+    def gauge(self, name, callback, help):
+        """Register a gauge whose value(s) `callback` returns when rendered; None leaves it out."""
+        with self._lock:
+            self._gauges[name] = (help, callback)
+
+    def reset(self):
+        with self._lock:
+            self._stages.clear()
+            self._counters.clear()
+
+    def export(self):
+        """Return the timers and counters as plain data, e.g. to send them from a worker process to merge()."""
+        with self._lock:
+            return {'stages': {stage: list(entry) for stage, entry in self._stages.items()},
+                    'counters': {name: dict(values) for name, values in self._counters.items()}}
+
+    def merge(self, exported):
+        """Add the timers and counters of export() (of another process) to these."""
+        with self._lock:
+            for stage, (count, total, last) in exported['stages'].items():
+                entry = self._stages.setdefault(stage, [0, 0.0, 0.0])
+                entry[0] += count
+                entry[1] += total
+                entry[2] = last
+            for name, values in exported['counters'].items():
+                counter = self._counters.setdefault(name, {})
+                for key, value in values.items():
+                    counter[key] = counter.get(key, 0) + value
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            stages = sorted(self._stages.items())
+            counters = sorted((name, sorted(values.items())) for name, values in self._counters.items())
+            gauges = sorted(self._gauges.items())
+        lines.append(f'# HELP {PREFIX}_stage_duration_seconds Time spent in each stage.')
+        lines.append(f'# TYPE {PREFIX}_stage_duration_seconds summary')
+        for stage, (count, total, _) in stages:
+            lines.append(f'{PREFIX}_stage_duration_seconds_count{_label_text([("stage", stage)])} {count}')
+            lines.append(f'{PREFIX}_stage_duration_seconds_sum{_label_text([("stage", stage)])} {total!r}')
+        lines.append(f'# HELP {PREFIX}_stage_last_duration_seconds Duration of the last run of each stage.')
+        lines.append(f'# TYPE {PREFIX}_stage_last_duration_seconds gauge')
+        for stage, (_, _, last) in stages:
+            lines.append(f'{PREFIX}_stage_last_duration_seconds{_label_text([("stage", stage)])} {last!r}')
+        for name, values in counters:
+            lines.append(f'# HELP {PREFIX}_{name}_total {COUNTERS.get(name, name)}')
+            lines.append(f'# TYPE {PREFIX}_{name}_total counter')
+            for key, value in values:
+                lines.append(f'{PREFIX}_{name}_total{_label_text(key)} {_number(value)}')
+        for name, (help_text, callback) in gauges:
+            value = callback()
+            if value is None:
+                continue
+            lines.append(f'# HELP {PREFIX}_{name} {help_text}')
+            lines.append(f'# TYPE {PREFIX}_{name} gauge')
+            values = value.items() if isinstance(value, dict) else [((), value)]
+            for key, number in values:
+                lines.append(f'{PREFIX}_{name}{_label_text(tuple(key))} {_number(number)}')
+        return '\n'.join(lines) + '\n'
+
+
+# The metrics of this process
+metrics = Metrics()
@@ -0,0 +1,239 @@
+import asyncio
+import atexit
+import codecs
+import json
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of app labels in the selector of one list call made by list_async()
+LABEL_CHUNK_SIZE = 50
+# kubectl writes the pods of a new watch in one burst; this many seconds without output end the burst
+WATCH_SYNC_IDLE = 1.0
+
+
+def pod_entry(pod):
+    """Return (app label, pod IP, first container port or None, namespace) of a pod, or None while it has no IP."""
+    ip = (pod.get('status') or {}).get('podIP')
+    if not ip:
+        return None
+    port = None
+    for container in (pod.get('spec') or {}).get('containers') or []:
+        if container.get('ports'):
+            port = container['ports'][0].get('containerPort')
+            break
+    metadata = pod['metadata']
+    return ((metadata.get('labels') or {}).get('app'), ip, port, metadata.get('namespace'))
+
+
+def iter_json_stream(stream, idle_timeout=None):
+    """Yield the JSON documents of a binary stream of concatenated documents (the output of `kubectl get -w -o json`).
+
+    With `idle_timeout`, None is yielded whenever no output arrived for that many seconds.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    fd = stream.fileno()
+    while True:
+        # Read the pipe itself, so no output can sit unseen in a buffer while it looks idle
+        if idle_timeout is not None and not select.select([fd], [], [], idle_timeout)[0]:
+            yield None
+            continue
+        chunk = os.read(fd, 65536)
+        if not chunk:
+            break
+        buffer += text.decode(chunk)
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                break
+            try:
+                document, end = decoder.raw_decode(buffer)
+            except ValueError:
+                # The document is not complete yet
+                break
+            buffer = buffer[end:]
+            yield document
+
+
+class PodInventory:
+    """The pods of a set of app labels, indexed by label.
+
+    All pods are listed with a single `kubectl get pods -l 'app in (...)'` call instead of one call
+    per deployment. With start_watch(), a background `kubectl get pods --watch` keeps the index
+    current and, once the watch has reported the pods it started from, pods_by_label() no longer
+    calls kubectl at all; `on_change` is then called after every pod change the watch reports.
+    """
+
+    def __init__(self, labels, namespace=None, kubectl='kubectl', retry_interval=5, on_change=None):
+        self.labels = sorted(set(labels))
+        self.namespace = namespace
+        self.kubectl = kubectl
+        self.retry_interval = retry_interval
+        self.on_change = on_change
+        # Pod name -> (app label, pod IP, container port, namespace)
+        self._pods = {}
+        self._lock = threading.Lock()
+        self._synced = threading.Event()
+        self._stop = threading.Event()
+        self._watch_thread = None
+        self._watch_process = None
+
+    def _command(self, *options, labels=None):
+        labels = self.labels if labels is None else labels
+        command = [self.kubectl, 'get', 'pods', '-l', f"app in ({','.join(labels)})", '-o', 'json']
+        if self.namespace:
+            command += ['-n', self.namespace]
+        return command + list(options)
+
+    @staticmethod
+    def _parse_list(output):
+        pods = {}
+        for pod in json.loads(output)['items']:
+            entry = pod_entry(pod)
+            if entry is not None:
+                pods[pod['metadata']['name']] = entry
+        return pods
+
+    def list(self):
+        """Replace the index with the result of one list call."""
+        pods = {}
+        if self.labels:
+            metrics.increment('kubectl_calls', command='get')
+            with metrics.timer('kubectl'):
+                output = subprocess.check_output(self._command())
+            pods = self._parse_list(output.decode('utf-8'))
+        with self._lock:
+            self._pods = pods
+
+    async def _list_labels(self, labels, semaphore, timeout):
+        async with semaphore:
+            command = self._command(labels=labels)
+            metrics.increment('kubectl_calls', command='get')
+            with metrics.timer('kubectl'):
+                process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE)
+                try:
+                    output, _ = await asyncio.wait_for(process.communicate(), timeout)
+                except asyncio.TimeoutError:
+                    process.kill()
+                    await process.wait()
+                    raise
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, command)
+        return self._parse_list(output.decode('utf-8'))
+
+    async def list_async(self, semaphore=None, timeout=None):
+        """Refresh the index with concurrent list calls of at most LABEL_CHUNK_SIZE labels each.
+
+        `semaphore` bounds the number of concurrent calls, and a call is killed after `timeout` seconds. The
+        pods of the labels whose call failed keep their previous entries, so a slow or failing call
+        only leaves part of the index stale. Returns the errors of the failed calls; a running
+        watch already keeps the index current, so no call is made then.
+        """
+        if self.watching or not self.labels:
+            return []
+        semaphore = semaphore or asyncio.Semaphore(len(self.labels))
+        chunks = [self.labels[i:i + LABEL_CHUNK_SIZE] for i in range(0, len(self.labels), LABEL_CHUNK_SIZE)]
+        results = await asyncio.gather(*(self._list_labels(chunk, semaphore, timeout) for chunk in chunks),
+                                       return_exceptions=True)
+        errors = []
+        pods = {}
+        with self._lock:
+            for chunk, result in zip(chunks, results):
+                if isinstance(result, Exception):
+                    # A timeout has no message of its own
+                    error = str(result) or type(result).__name__
+                    errors.append(f"listing the pods of {', '.join(chunk)} failed: {error}")
+                    chunk = set(chunk)
+                    result = {name: entry for name, entry in self._pods.items() if entry[0] in chunk}
+                pods.update(result)
+            self._pods = pods
+        return errors
+
+    @property
+    def watching(self):
+        return self._watch_thread is not None and self._watch_thread.is_alive() and self._synced.is_set()
+
+    def pods_by_label(self):
+        """Return app label -> [(pod IP, container port, namespace), ...] in pod name order, for every label.
+
+        Without a running watch, the pods are listed first.
+        """
+        if not self.watching:
+            self.list()
+        return self.indexed_pods_by_label()
+
+    def indexed_pods_by_label(self):
+        """Return the same as pods_by_label() from the index as it is, without listing the pods."""
+        by_label = {label: [] for label in self.labels}
+        with self._lock:
+            for name in sorted(self._pods):
+                label, ip, port, namespace = self._pods[name]
+                if label in by_label:
+                    by_label[label].append((ip, port, namespace))
+        return by_label
+
+    def pods(self, label):
+        return self.pods_by_label().get(label, [])
+
+    def start_watch(self):
+        """Keep the index current from a `kubectl get pods --watch` stream in a daemon thread."""
+        if self._watch_thread is not None or not self.labels:
+            return
+        self._watch_thread = threading.Thread(target=self._watch, name='pod-inventory-watch', daemon=True)
+        self._watch_thread.start()
+        # Do not leave the kubectl watch running after this process exits
+        atexit.register(self.stop_watch)
+
+    def stop_watch(self):
+        self._stop.set()
+        if self._watch_process is not None:
+            self._watch_process.terminate()
+
+    def _watch(self):
+        while not self._stop.is_set():
+            try:
+                # kubectl reports the current pods as ADDED events and then follows the changes from that same
+                # list, so nothing that changes in between is missed. The index is rebuilt from those first
+                # events and replaced once they stop coming; until then pods_by_label() keeps listing.
+                self._watch_process = subprocess.Popen(self._command('--watch', '--output-watch-events'),
+                                                       stdout=subprocess.PIPE)
+                initial = {}
+                for event in iter_json_stream(self._watch_process.stdout, WATCH_SYNC_IDLE):
+                    if event is None:
+                        if initial is not None:
+                            with self._lock:
+                                self._pods = initial
+                            initial = None
+                            self._synced.set()
+                            if self.on_change is not None:
+                                self.on_change()
+                        continue
+                    pod = event.get('object') or {}
+                    name = (pod.get('metadata') or {}).get('name')
+                    if name is None:
+                        continue
+                    entry = pod_entry(pod) if event.get('type') in ('ADDED', 'MODIFIED') else None
+                    with self._lock:
+                        pods = self._pods if initial is None else initial
+                        if entry is None:
+                            pods.pop(name, None)
+                        else:
+                            pods[name] = entry
+                    if initial is None and self.on_change is not None:
+                        self.on_change()
+                self._watch_process.wait()
+            except (OSError, ValueError, subprocess.CalledProcessError) as e:
+                logger.warning('Pod watch failed: %s', e)
+            # The watch ended (e.g. the API server closed it); changes may have been missed
+            self._synced.clear()
+            if not self._stop.is_set():
+                time.sleep(self.retry_interval)
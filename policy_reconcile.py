@@ -0,0 +1,313 @@
+import argparse
+import copy
+import json
+import logging
+import os
+import subprocess
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Field manager of the server-side applies, which owns the fields of the policies it writes
+FIELD_MANAGER = 'aa-pro-max'
+# Labels of the generated policies
+MANAGED_BY_LABEL = 'app.kubernetes.io/managed-by'
+SERVICE_LABEL = 'aa-pro-max/service'
+ROLE_LABEL = 'aa-pro-max/role'
+SERVICE_ACCOUNT_DIR = '/var/run/secrets/kubernetes.io/serviceaccount'
+
+# The result of comparing the policies in the cluster with the desired ones:
+#   create     desired policies that do not exist yet
+#   update     (current policy, desired policy, changed fields) of the policies that differ
+#   delete     names of the policies that exist but are not desired
+#   unchanged  names of the policies that already match
+PolicyDiff = namedtuple('PolicyDiff', ['create', 'update', 'delete', 'unchanged'])
+
+
+def policy_labels(service, discovery=False):
+    """Return the metadata labels of a generated policy protecting the pods of `service`."""
+    labels = {MANAGED_BY_LABEL: FIELD_MANAGER, SERVICE_LABEL: service}
+    if discovery:
+        labels[ROLE_LABEL] = 'discovery'
+    return labels
+
+
+def is_discovery_policy(policy):
+    """Whether a generated policy protects the discovery server, which is left unrestricted."""
+    return ((policy.get('metadata') or {}).get('labels') or {}).get(ROLE_LABEL) == 'discovery'
+
+
+def run_kubectl(args, input=None):
+    """Run kubectl with the given arguments and return its standard output."""
+    metrics.increment('kubectl_calls', command=args[0])
+    with metrics.timer('kubectl'):
+        result = subprocess.run(['kubectl'] + args, input=input, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                universal_newlines=True)
+    if result.returncode != 0:
+        raise subprocess.CalledProcessError(result.returncode, ['kubectl'] + args, result.stdout, result.stderr)
+    return result.stdout
+
+
+def parse_policy_list(text):
+    """Return name -> policy for the output of `kubectl get networkpolicies -o json`."""
+    data = json.loads(text)
+    items = data.get('items', []) if data.get('kind', 'List').endswith('List') else [data]
+    return {item['metadata']['name']: item for item in items}
+
+
+def normalize_policy(policy):
+    """Return the labels and spec of a NetworkPolicy the way the API server stores them.
+
+    Server side fields (uid, resourceVersion, managedFields, annotations, status) are left out, ports get
+    the default TCP protocol, empty peer and port lists are dropped and missing rule lists become empty,
+    so a policy read back from the cluster compares equal to the one it was created from.
+    """
+    spec = copy.deepcopy(policy.get('spec') or {})
+    spec['podSelector'] = spec.get('podSelector') or {}
+    for direction, peers in (('ingress', 'from'), ('egress', 'to')):
+        rules = spec.get(direction) or []
+        for rule in rules:
+            for key in (peers, 'ports'):
+                if not rule.get(key):
+                    rule.pop(key, None)
+            for port in rule.get('ports', []):
+                port.setdefault('protocol', 'TCP')
+        spec[direction] = rules
+    if not spec.get('policyTypes'):
+        spec['policyTypes'] = ['Ingress', 'Egress'] if spec['egress'] else ['Ingress']
+    return {'labels': (policy.get('metadata') or {}).get('labels') or {}, 'spec': spec}
+
+
+def changed_fields(current, desired):
+    """Return the sorted 'labels' / 'spec.<field>' paths in which two normalized policies differ."""
+    fields = []
+    if current['labels'] != desired['labels']:
+        fields.append('labels')
+    for key in sorted(set(current['spec']) | set(desired['spec'])):
+        if current['spec'].get(key) != desired['spec'].get(key):
+            fields.append('spec.' + key)
+    return fields
+
+
+def diff_policies(current, desired):
+    """Compare the policies in the cluster (name -> policy) with the desired policies (a list).
+
+    Every existing policy that is not desired is deleted, like the `kubectl delete networkpolicies --all`
+    this replaces.
+    """
+    diff = PolicyDiff([], [], [], [])
+    desired_names = set()
+    for policy in sorted(desired, key=lambda policy: policy['metadata']['name']):
+        name = policy['metadata']['name']
+        desired_names.add(name)
+        if name not in current:
+            diff.create.append(policy)
+            continue
+        fields = changed_fields(normalize_policy(current[name]), normalize_policy(policy))
+        if fields:
+            diff.update.append((current[name], policy, fields))
+        else:
+            diff.unchanged.append(name)
+    diff.delete.extend(sorted(name for name in current if name not in desired_names))
+    return diff
+
+
+def format_diff(diff):
+    """Return the diff as report lines: '+ name', '~ name (fields)' and '- name'."""
+    lines = [f"+ {policy['metadata']['name']}" for policy in diff.create]
+    lines.extend(f"~ {desired['metadata']['name']} ({', '.join(fields)})" for _, desired, fields in diff.update)
+    lines.extend(f"- {name}" for name in diff.delete)
+    lines.append(f"{len(diff.create)} to create, {len(diff.update)} to update, {len(diff.delete)} to delete, "
+                 f"{len(diff.unchanged)} unchanged")
+    return lines
+
+
+def _error_text(error):
+    return (getattr(error, 'stderr', None) or str(error)).strip()
+
+
+class KubectlBackend:
+    """Reads and writes NetworkPolicies with kubectl, one process per kind of change.
+
+    Every created or changed policy is sent in a single multi-document server-side apply, and every
+    deleted policy in a single delete, whatever the number of objects.
+    """
+
+    def __init__(self, run=run_kubectl):
+        self.run = run
+
+    def list_policies(self, namespace):
+        return parse_policy_list(self.run(['get', 'networkpolicies', '-n', namespace, '-o', 'json']))
+
+    def apply_diff(self, diff, namespace):
+        """Apply a diff and return the (action, name, error) results; error is None for the objects that succeeded."""
+        results = []
+        changes = [('create', policy) for policy in diff.create] + [('update', desired) for _, desired, _ in diff.update]
+        if changes:
+            documents = '\n'.join('---\n' + json.dumps(policy) for _, policy in changes)
+            try:
+                output, errors = self.run(['apply', '--server-side', '--field-manager', FIELD_MANAGER,
+                                           '--force-conflicts', '-n', namespace, '-f', '-'], input=documents), ''
+            except subprocess.CalledProcessError as e:
+                # kubectl goes on with the other objects when one fails; its output still lists the applied ones
+                output, errors = e.stdout or '', _error_text(e)
+            applied = {line.split()[0].rsplit('/', 1)[-1] for line in output.splitlines() if line.strip()}
+            for action, policy in changes:
+                name = policy['metadata']['name']
+                results.append((action, name, None if name in applied else _object_error(errors, name)))
+        if diff.delete:
+            try:
+                self.run(['delete', 'networkpolicy', '-n', namespace, '--ignore-not-found'] + diff.delete)
+                results.extend(('delete', name, None) for name in diff.delete)
+            except subprocess.CalledProcessError as e:
+                results.extend(('delete', name, _error_text(e)) for name in diff.delete)
+        return results
+
+
+def _object_error(errors, name):
+    """Return the kubectl error lines that mention an object, or all of them."""
+    lines = [line for line in errors.splitlines() if f'"{name}"' in line or f'/{name} ' in line]
+    return '\n'.join(lines) or errors or 'not applied'
+
+
+class ApiServerBackend:
+    """Reads and writes NetworkPolicies over HTTP(S) straight to the Kubernetes API server.
+
+    One requests.Session keeps a pool of `concurrency` connections open, so the TLS handshake is
+    paid once per connection instead of once per object, and at most `concurrency` objects are
+    server-side applied or deleted at a time. `server` can also be a `kubectl proxy` URL.
+    """
+
+    def __init__(self, server, token=None, ca_cert=None, concurrency=8, timeout=30):
+        self.server = server.rstrip('/')
+        self.concurrency = max(1, concurrency)
+        self.timeout = timeout
+        # requests is only loaded by the runs that use this backend
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if token:
+            self.session.headers['Authorization'] = f'Bearer {token}'
+        if ca_cert:
+            self.session.verify = ca_cert
+
+    @classmethod
+    def from_environment(cls, server=None, concurrency=8):
+        """Create a backend for `server`, or for the in-cluster API server with the pod's service account."""
+        token = ca_cert = None
+        if os.path.exists(os.path.join(SERVICE_ACCOUNT_DIR, 'token')):
+            with open(os.path.join(SERVICE_ACCOUNT_DIR, 'token'), 'r') as f:
+                token = f.read().strip()
+            ca_cert = os.path.join(SERVICE_ACCOUNT_DIR, 'ca.crt')
+        if server is None:
+            host = os.environ.get('KUBERNETES_SERVICE_HOST')
+            if not host:
+                raise ValueError('No API server given and not running in a Kubernetes pod')
+            server = f"https://{host}:{os.environ.get('KUBERNETES_SERVICE_PORT', '443')}"
+        elif not server.startswith('https://'):
+            # e.g. kubectl proxy, which adds the credentials itself
+            token = ca_cert = None
+        return cls(server, token, ca_cert, concurrency)
+
+    def _url(self, namespace, name=None):
+        url = f'{self.server}/apis/networking.k8s.io/v1/namespaces/{namespace}/networkpolicies'
+        return url if name is None else f'{url}/{name}'
+
+    def list_policies(self, namespace):
+        metrics.increment('api_server_requests', method='GET')
+        response = self.session.get(self._url(namespace), timeout=self.timeout)
+        response.raise_for_status()
+        return parse_policy_list(response.text)
+
+    def _send(self, operation):
+        import requests
+
+        action, namespace, name, policy = operation
+        metrics.increment('api_server_requests', method='DELETE' if action == 'delete' else 'PATCH')
+        try:
+            if action == 'delete':
+                response = self.session.delete(self._url(namespace, name), timeout=self.timeout)
+                if response.status_code == 404:
+                    return action, name, None
+            else:
+                # Server-side apply creates the object or updates the fields this manager owns
+                response = self.session.patch(self._url(namespace, name), data=json.dumps(policy),
+                                              params={'fieldManager': FIELD_MANAGER, 'force': 'true'},
+                                              headers={'Content-Type': 'application/apply-patch+yaml'},
+                                              timeout=self.timeout)
+            if response.status_code >= 400:
+                return action, name, f'{response.status_code} {response.text.strip()}'
+            return action, name, None
+        except requests.RequestException as e:
+            return action, name, str(e)
+
+    def apply_diff(self, diff, namespace):
+        """Apply a diff and return the (action, name, error) results; error is None for the objects that succeeded."""
+        operations = [('create', namespace, policy['metadata']['name'], policy) for policy in diff.create]
+        operations.extend(('update', namespace, desired['metadata']['name'], desired) for _, desired, _ in diff.update)
+        operations.extend(('delete', namespace, name, None) for name in diff.delete)
+        if not operations:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(operations))) as executor:
+            return list(executor.map(self._send, operations))
+
+
+def reconcile(desired, namespace, backend=None, dry_run=False):
+    """Bring the NetworkPolicies of a namespace to the desired set, touching only what changed.
+
+    The current policies are fetched once, diffed against `desired`, and only the differences are
+    applied through `backend` (kubectl by default), so policies that did not change stay enforced
+    the whole time. Returns the diff and the per-object results (empty with `dry_run`).
+    """
+    if backend is None:
+        backend = KubectlBackend()
+    with metrics.timer('policy_apply'):
+        diff = diff_policies(backend.list_policies(namespace), desired)
+        for line in format_diff(diff):
+            logger.info('%s', line)
+        if dry_run:
+            return diff, []
+        results = backend.apply_diff(diff, namespace)
+    for action, name, error in results:
+        metrics.increment('policy_operations', action=action, result='ok' if error is None else 'error')
+        if error is not None:
+            logger.error('Failed to %s %s: %s', action, name, error)
+    return diff, results
+
+
+def load_policy_files(paths):
+    """Read the NetworkPolicies from YAML files, or from every .yaml file of a directory."""
+    import yaml
+
+    policies = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.yaml')]
+        else:
+            files = [path]
+        for file_path in files:
+            with open(file_path, 'r') as f:
+                policies.extend(document for document in yaml.safe_load_all(f) if document)
+    return policies
+
+
+if __name__ == '__main__':
+    # Dry run against recorded `kubectl get networkpolicies -o json` output
+    parser = argparse.ArgumentParser(description='Show the changes that would bring the recorded policies to the '
+                                                 'desired ones')
+    parser.add_argument('current', help='output of kubectl get networkpolicies -o json')
+    parser.add_argument('desired', nargs='+', help='NetworkPolicy YAML files or directories')
+    args = parser.parse_args()
+    with open(args.current, 'r') as f:
+        current_policies = parse_policy_list(f.read())
+    policy_diff = diff_policies(current_policies, load_policy_files(args.desired))
+    print('\n'.join(format_diff(policy_diff)))
+    sys.exit(1 if policy_diff.create or policy_diff.update or policy_diff.delete else 0)
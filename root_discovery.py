@@ -0,0 +1,138 @@
+import fnmatch
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+DISCOVERY_CACHE_VERSION = 1
+# Directory names that never contain service sources; extra patterns come from --prune
+DEFAULT_PRUNE = ('.git', '.hg', '.svn', '.idea', '.vscode', '.gradle', '.mvn', '.venv', 'venv', '__pycache__',
+                 'node_modules', 'target', 'build')
+
+
+def _load_yaml(path):
+    # Only loaded when a file changed since the cached discovery
+    import yaml
+
+    with open(path, 'r') as f:
+        return yaml.safe_load(f) or {}
+
+
+class _Walker:
+    def __init__(self, root_dir, prune, prune_paths):
+        self.root_dir = root_dir
+        self.prune = tuple(prune)
+        self.prune_paths = {os.path.realpath(path) for path in prune_paths}
+        # Every directory and file the result depends on -> mtime, used to validate the cache
+        self.dirs = {}
+        self.files = {}
+
+    def _pruned(self, entry):
+        if any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in self.prune):
+            return True
+        return bool(self.prune_paths) and os.path.realpath(entry.path) in self.prune_paths
+
+    def scan(self, path):
+        """Return the sorted (name, DirEntry) pairs of the sub directories of path and record its mtime."""
+        self.dirs[path] = os.stat(path).st_mtime_ns
+        subdirs = []
+        with os.scandir(path) as entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir() and not self._pruned(entry):
+                        subdirs.append((entry.name, entry))
+                except OSError:
+                    continue
+        subdirs.sort()
+        return subdirs
+
+    def file(self, path):
+        """Return path if it is a file, recording its mtime."""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        self.files[path] = stat.st_mtime_ns
+        return path
+
+    def application_file(self, main_dir):
+        # The last application.yml found below a 'resources' directory of src/main, like the os.walk version
+        application_file = None
+        stack = [main_dir]
+        while stack:
+            path = stack.pop()
+            subdirs = self.scan(path)
+            if 'resources' in os.path.relpath(path, main_dir):
+                candidate = self.file(os.path.join(path, 'application.yml'))
+                if candidate is not None:
+                    application_file = candidate
+            stack.extend(entry.path for _, entry in reversed(subdirs))
+        return application_file
+
+    def walk(self):
+        pairs = []
+        stack = [self.root_dir]
+        while stack:
+            folder = stack.pop()
+            subdirs = self.scan(folder)
+            names = {name for name, _ in subdirs}
+            deployment_file = None
+            application_file = None
+            # k8s and src are walked as sub directories too, which records their mtimes
+            if 'k8s' in names:
+                deployment_file = self.file(os.path.join(folder, 'k8s', 'deployment.yml'))
+            if 'src' in names and os.path.isdir(os.path.join(folder, 'src', 'main')):
+                application_file = self.application_file(os.path.join(folder, 'src', 'main'))
+            # If both files exist, map the application name and the app label to each other
+            if application_file is not None and deployment_file is not None:
+                service = (_load_yaml(application_file).get('spring') or {}).get('application', {}).get('name')
+                app_label = (_load_yaml(deployment_file).get('metadata') or {}).get('labels', {}).get('app')
+                pairs.append([service, app_label])
+            stack.extend(entry.path for _, entry in reversed(subdirs))
+        return pairs
+
+
+def _cache_valid(cache):
+    for key in ('dirs', 'files'):
+        for path, mtime in cache[key].items():
+            try:
+                if os.stat(path).st_mtime_ns != mtime:
+                    return False
+            except OSError:
+                return False
+    return True
+
+
+def discover_services(root_dir, prune=DEFAULT_PRUNE, prune_paths=(), cache_path=None):
+    """Find the projects below root_dir that have both a src/main/**/resources/application.yml and a
+    k8s/deployment.yml, and return the (service name, app label) pairs in directory order.
+
+    Directories matching a `prune` name pattern, or one of `prune_paths`, are not entered. With
+    `cache_path`, the result is stored together with the mtime of every directory and file it was
+    built from, and reused as long as none of them changed (a new project changes the mtime of the
+    directory it was created in).
+    """
+    settings = {'root': os.path.realpath(root_dir), 'prune': sorted(prune),
+                'prune_paths': sorted(os.path.realpath(path) for path in prune_paths)}
+    if cache_path is not None:
+        try:
+            with open(cache_path, 'r') as f:
+                cache = json.load(f)
+            if (cache.get('version') == DISCOVERY_CACHE_VERSION and cache.get('settings') == settings
+                    and _cache_valid(cache)):
+                logger.info('Using the cached service discovery of %s', root_dir)
+                return [tuple(pair) for pair in cache['pairs']]
+        except (OSError, ValueError, KeyError):
+            pass
+
+    walker = _Walker(root_dir, prune, prune_paths)
+    pairs = walker.walk()
+    if cache_path is not None:
+        partial_path = f'{cache_path}.partial-{os.getpid()}'
+        with open(partial_path, 'w') as f:
+            json.dump({'version': DISCOVERY_CACHE_VERSION, 'settings': settings, 'pairs': pairs,
+                       'dirs': walker.dirs, 'files': walker.files}, f)
+        os.replace(partial_path, cache_path)
+    return [tuple(pair) for pair in pairs]
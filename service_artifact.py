@@ -0,0 +1,56 @@
+import gzip
+import json
+import os
+from collections import namedtuple
+
+ARTIFACT_VERSION = 1
+
+# What init() found in the Docker images: the service graph (app labels in node order and the calls
+# between them), both label maps, the discovery server and the evidence of each service
+ServiceArtifact = namedtuple('ServiceArtifact', ('created', 'services', 'calls', 'service_to_app_label',
+                                                 'app_label_to_service', 'service_discovery', 'evidence'))
+
+
+class ArtifactError(Exception):
+    """The artifact cannot be read, or was written by a different version."""
+
+
+def save_artifact(path, artifact):
+    """Write an artifact as compact, gzip compressed JSON, replacing the file atomically.
+
+    Calls are stored as pairs of indexes into the service list, so the file stays small for large graphs.
+    """
+    index = {service: i for i, service in enumerate(artifact.services)}
+    data = {
+        'version': ARTIFACT_VERSION,
+        'created': artifact.created,
+        'services': list(artifact.services),
+        'calls': [[index[source], index[target]] for source, target in artifact.calls],
+        'service_to_app_label': artifact.service_to_app_label,
+        'app_label_to_service': artifact.app_label_to_service,
+        'service_discovery': artifact.service_discovery,
+        'evidence': artifact.evidence,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    partial_path = f'{path}.partial-{os.getpid()}'
+    with gzip.open(partial_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+        json.dump(data, f, separators=(',', ':'), sort_keys=True)
+    os.replace(partial_path, path)
+
+
+def load_artifact(path):
+    """Read an artifact written by save_artifact(); raises ArtifactError if it is missing, broken or of another version."""
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except (OSError, EOFError, ValueError) as e:
+        raise ArtifactError(f'Cannot read the service graph artifact {path}: {e}') from e
+    if not isinstance(data, dict) or data.get('version') != ARTIFACT_VERSION:
+        version = data.get('version') if isinstance(data, dict) else None
+        raise ArtifactError(f'The service graph artifact {path} has version {version}, expected {ARTIFACT_VERSION}; '
+                            'run analyze again')
+    services = data['services']
+    return ServiceArtifact(data['created'], services, [(services[source], services[target])
+                                                       for source, target in data['calls']],
+                           data['service_to_app_label'], data['app_label_to_service'], data['service_discovery'],
+                           data['evidence'])
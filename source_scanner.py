@@ -0,0 +1,74 @@
+import mmap
+import os
+import re
+
+# One pattern for both annotations, matched against whole files so multi-line annotations are found.
+# @FeignClient accepts the positional form @FeignClient("x") and the value= / name= elements in any
+# position, e.g. @FeignClient(url = "...", name = "x"); the package prefix is optional.
+ANNOTATION_PATTERN = re.compile(
+    rb'@(?:[\w$]+\.)*FeignClient\s*\(\s*'
+    rb'(?:"(?P<positional>[^"]*)"|[^)]*?\b(?:value|name)\s*=\s*"(?P<named>[^"]*)")'
+    rb'|@(?:[\w$]+\.)*(?P<eureka>EnableEurekaServer)\b'
+)
+# Cheap byte search run before the regular expression; most classes contain neither annotation
+PREFILTER = (b'FeignClient', b'EnableEurekaServer')
+# Smaller files are read into memory: for them a read() is cheaper than the page faults of an mmap
+MMAP_MIN_SIZE = 1 << 20
+
+
+def scan_source(data):
+    """Return [(kind, value), ...] for the annotations in the bytes (or mmap) of a Java source file.
+
+    kind is 'feign' with the target service name, or 'eureka' with None.
+    """
+    if not any(data.find(pattern) != -1 for pattern in PREFILTER):
+        return []
+    found = []
+    for match in ANNOTATION_PATTERN.finditer(data):
+        if match.group('eureka'):
+            found.append(('eureka', None))
+        else:
+            target = match.group('positional')
+            if target is None:
+                target = match.group('named')
+            found.append(('feign', target.decode('utf-8', errors='replace')))
+    return found
+
+
+def scan_source_file(path):
+    """Return [(kind, value), ...] for the annotations in one Java source file, see scan_source()."""
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return []
+        if size < MMAP_MIN_SIZE:
+            return scan_source(f.read())
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return scan_source(data)
+
+
+def scan_source_tree(directory):
+    """Scan every .java file below `directory` for @FeignClient and @EnableEurekaServer.
+
+    Returns a dict with the Feign target service names (in file name order), whether an
+    @EnableEurekaServer annotation was found and the files that contain either.
+    """
+    paths = []
+    for root, _, files in os.walk(directory):
+        paths.extend(os.path.join(root, file_name) for file_name in files if file_name.endswith('.java'))
+    paths.sort()
+    result = {'feign_clients': [], 'eureka_server': False, 'files': []}
+    # Scanned in this thread: the prefilter and the pattern hold the GIL, so a thread pool only added
+    # its hand-off cost (20,000 files: 0.5 s in a loop, 0.7-1.1 s on 1-5 threads). Images are already
+    # analyzed in parallel by the --jobs worker processes.
+    for path in paths:
+        found = scan_source_file(path)
+        if not found:
+            continue
+        result['files'].append(path)
+        for kind, target in found:
+            if kind == 'eureka':
+                result['eureka_server'] = True
+            else:
+                result['feign_clients'].append(target)
+    return result
@@ -0,0 +1,137 @@
+import io
+import struct
+import zipfile
+
+import pytest
+
+from class_scanner import ClassFormatError, read_class_annotations, scan_jar
+
+ACC_PUBLIC_INTERFACE = 0x0601
+ACC_PUBLIC_CLASS = 0x0021
+
+
+class ConstantPool:
+    """Builds a class file constant pool; Long and Double entries take two slots like in the JVM."""
+
+    def __init__(self):
+        self.entries = []
+        self.count = 1
+
+    def _add(self, data, slots=1):
+        self.entries.append(data)
+        index = self.count
+        self.count += slots
+        return index
+
+    def utf8(self, text):
+        encoded = text.encode('utf-8')
+        return self._add(b'\x01' + struct.pack('>H', len(encoded)) + encoded)
+
+    def class_ref(self, name):
+        return self._add(b'\x07' + struct.pack('>H', self.utf8(name)))
+
+    def long(self, value):
+        return self._add(b'\x05' + struct.pack('>q', value), slots=2)
+
+    def double(self, value):
+        return self._add(b'\x06' + struct.pack('>d', value), slots=2)
+
+
+def class_file(name, annotations, access=ACC_PUBLIC_CLASS, pool=None):
+    """A class file whose RuntimeVisibleAnnotations are (type descriptor, [(element, tag, index), ...]).
+
+    Element values are constant pool indexes of `pool`, so a test can add constants before the class.
+    """
+    pool = pool or ConstantPool()
+    this_class = pool.class_ref(name)
+    super_class = pool.class_ref('java/lang/Object')
+    body = struct.pack('>H', len(annotations))
+    for annotation_type, elements in annotations:
+        body += struct.pack('>HH', pool.utf8(annotation_type), len(elements))
+        for element, tag, index in elements:
+            body += struct.pack('>H', pool.utf8(element)) + tag.encode() + struct.pack('>H', index)
+    attribute_name = pool.utf8('RuntimeVisibleAnnotations')
+    return (struct.pack('>IHHH', 0xCAFEBABE, 0, 52, pool.count) + b''.join(pool.entries)
+            + struct.pack('>HHHH', access, this_class, super_class, 0)
+            # No fields or methods, one class attribute
+            + struct.pack('>HHH', 0, 0, 1) + struct.pack('>HI', attribute_name, len(body)) + body)
+
+
+def feign_client(name, element='name', access=ACC_PUBLIC_INTERFACE, pool=None):
+    pool = pool or ConstantPool()
+    return class_file('com/example/StockClient', [
+        ('Lorg/springframework/cloud/openfeign/FeignClient;', [(element, 's', pool.utf8(name))]),
+    ], access, pool)
+
+
+def jar(**classes):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for entry, data in classes.items():
+            archive.writestr(entry, data)
+    buffer.seek(0)
+    return buffer
+
+
+@pytest.mark.parametrize('element', ['name', 'value'])
+def test_feign_client_interface(element):
+    class_name, annotations = read_class_annotations(feign_client('stock-service', element))
+
+    assert class_name == 'com.example.StockClient'
+    assert annotations == [('Lorg/springframework/cloud/openfeign/FeignClient;', {element: 'stock-service'})]
+    assert scan_jar(jar(**{'BOOT-INF/classes/com/example/StockClient.class': feign_client('stock-service', element)})) \
+        == {'feign_clients': ['stock-service'], 'eureka_server': False, 'classes': ['com.example.StockClient']}
+
+
+@pytest.mark.parametrize('annotation_type', [
+    # Same simple name prefix, another annotation
+    'Lcom/example/FeignClientProperties;',
+    # Mentions FeignClient but only as an element value, see the class below
+    'Lorg/springframework/stereotype/Component;',
+])
+def test_non_matching_annotation(annotation_type):
+    pool = ConstantPool()
+    data = class_file('com/example/Config', [
+        (annotation_type, [('value', 's', pool.utf8('Lorg/springframework/cloud/openfeign/FeignClient;'))]),
+    ], pool=pool)
+
+    assert scan_jar(jar(**{'com/example/Config.class': data})) == \
+        {'feign_clients': [], 'eureka_server': False, 'classes': []}
+
+
+def test_eureka_server_class():
+    data = class_file('com/example/DiscoveryApplication', [
+        ('Lorg/springframework/cloud/netflix/eureka/server/EnableEurekaServer;', []),
+    ])
+
+    assert scan_jar(jar(**{'com/example/DiscoveryApplication.class': data})) == \
+        {'feign_clients': [], 'eureka_server': True, 'classes': ['com.example.DiscoveryApplication']}
+
+
+def test_long_and_double_constants_take_two_slots():
+    pool = ConstantPool()
+    long_index = pool.long(1 << 40)
+    double_index = pool.double(0.5)
+    # Every entry after them is shifted by two slots; a parser counting one slot reads the wrong entries
+    data = class_file('com/example/RetryingClient', [
+        ('Lorg/springframework/cloud/openfeign/FeignClient;', [('name', 's', pool.utf8('orders'))]),
+        ('Lcom/example/Retry;', [('timeout', 'J', long_index), ('backoff', 'D', double_index)]),
+    ], ACC_PUBLIC_INTERFACE, pool)
+
+    assert read_class_annotations(data) == ('com.example.RetryingClient', [
+        ('Lorg/springframework/cloud/openfeign/FeignClient;', {'name': 'orders'}),
+        ('Lcom/example/Retry;', {'timeout': 1 << 40, 'backoff': 0.5}),
+    ])
+    assert scan_jar(jar(**{'com/example/RetryingClient.class': data}))['feign_clients'] == ['orders']
+
+
+def test_truncated_class_file():
+    with pytest.raises(ClassFormatError):
+        read_class_annotations(feign_client('stock-service')[:-3])
+
+
+def test_unparsable_class_is_skipped():
+    archive = jar(**{'com/example/A.class': b'\xca\xfe\xba\xbe/FeignClient;',
+                     'com/example/B.class': feign_client('stock-service')})
+
+    assert scan_jar(archive)['feign_clients'] == ['stock-service']
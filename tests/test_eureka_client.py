@@ -0,0 +1,45 @@
+import io
+
+from eureka_client import Instance, parse_applications, reconcile_hashcode
+
+APPLICATIONS = b'''<applications>
+  <versions__delta>1</versions__delta>
+  <apps__hashcode>DOWN_1_UP_3_</apps__hashcode>
+  <application>
+    <name>SVC-A</name>
+    <instance>
+      <instanceId>a-1</instanceId><app>SVC-A</app><ipAddr>10.0.0.1</ipAddr><status>UP</status>
+      <port enabled="true">8080</port>
+    </instance>
+    <instance>
+      <instanceId>a-2</instanceId><app>SVC-A</app><ipAddr>10.0.0.2</ipAddr><status>UP</status>
+      <port enabled="false">8080</port>
+    </instance>
+    <instance>
+      <instanceId>a-3</instanceId><app>SVC-A</app><ipAddr>10.0.0.3</ipAddr><status>DOWN</status>
+    </instance>
+  </application>
+  <application>
+    <name>SVC-B</name>
+    <instance>
+      <instanceId>b-1</instanceId><ipAddr>10.0.0.4</ipAddr><status>UP</status>
+      <port enabled="true">8081</port>
+    </instance>
+  </application>
+</applications>'''
+
+
+def test_parse_applications_keeps_every_instance():
+    instances, hashcode = parse_applications(io.BytesIO(APPLICATIONS))
+    assert [instance for instance, _ in instances] == [
+        Instance('svc-a', 'a-1', '10.0.0.1', '8080', 'UP'),
+        Instance('svc-a', 'a-2', '10.0.0.2', 'N/A', 'UP'),
+        Instance('svc-a', 'a-3', '10.0.0.3', 'N/A', 'DOWN'),
+        Instance('', 'b-1', '10.0.0.4', '8081', 'UP'),
+    ]
+    assert hashcode == 'DOWN_1_UP_3_'
+
+
+def test_reconcile_hashcode_matches_the_server_with_portless_and_appless_instances():
+    instances, hashcode = parse_applications(io.BytesIO(APPLICATIONS))
+    assert reconcile_hashcode(instance for instance, _ in instances) == hashcode
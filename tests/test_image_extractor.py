@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from image_extractor import LayerCache, extract_jars
+
+
+def _add_file(tar, name, data):
+    member = tarfile.TarInfo(name)
+    member.size = len(data)
+    tar.addfile(member, io.BytesIO(data))
+
+
+def _add_hardlink(tar, name, linkname):
+    member = tarfile.TarInfo(name)
+    member.type = tarfile.LNKTYPE
+    member.linkname = linkname
+    tar.addfile(member)
+
+
+def _layer(entries):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w') as tar:
+        for add, *arguments in entries:
+            add(tar, *arguments)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def image_path(tmp_path):
+    """A `docker save` tar whose first layer hardlinks a JAR and whose second layer removes another one."""
+    layers = [
+        _layer([(_add_file, 'app/app.jar', b'app'),
+                (_add_hardlink, 'app/lib/app-copy.jar', 'app/app.jar'),
+                (_add_file, 'etc/hosts', b'hosts'),
+                (_add_hardlink, 'app/hosts.jar', 'etc/hosts'),
+                (_add_file, 'opt/old.jar', b'old')]),
+        _layer([(_add_file, 'opt/.wh.old.jar', b'')]),
+    ]
+    path = tmp_path / 'image.tar'
+    with tarfile.open(path, 'w') as image_tar:
+        _add_file(image_tar, 'manifest.json',
+                  json.dumps([{'Config': 'config.json', 'Layers': ['0/layer.tar', '1/layer.tar']}]).encode())
+        _add_file(image_tar, 'config.json', json.dumps({'rootfs': {'diff_ids': ['sha256:0', 'sha256:1']}}).encode())
+        for index, layer in enumerate(layers):
+            _add_file(image_tar, f'{index}/layer.tar', layer)
+    return str(path)
+
+
+def _contents(paths, root):
+    contents = {}
+    for path in paths:
+        with open(path, 'rb') as f:
+            contents[os.path.relpath(path, root)] = f.read()
+    return contents
+
+
+def test_extract_jars_resolves_hardlinked_jars(image_path, tmp_path):
+    output_dir = str(tmp_path / 'jars')
+    assert _contents(extract_jars(image_path, output_dir), output_dir) == {
+        'app/app.jar': b'app',
+        'app/lib/app-copy.jar': b'app',
+    }
+
+
+def test_layer_cache_resolves_hardlinked_jars(image_path, tmp_path):
+    cache = LayerCache(str(tmp_path / 'cache'))
+    jars = cache.image_jars(image_path)
+    assert sorted(_contents(jars, str(tmp_path / 'cache' / 'sha256-0' / 'jars')).items()) == [
+        ('app/app.jar', b'app'),
+        ('app/lib/app-copy.jar', b'app'),
+    ]
+    # A second run reads the inventories back from the cache
+    assert LayerCache(str(tmp_path / 'cache')).image_jars(image_path) == jars
@@ -0,0 +1,105 @@
+import copy
+
+import pytest
+
+import aa_pro_max
+from policy_reconcile import PolicyDiff, diff_policies, format_diff, policy_labels, reconcile
+
+
+def _policy(name, port=8080, labels=None):
+    """A generated policy: pods of `name` may call port `port` of the pods labeled app=backend."""
+    return {
+        'apiVersion': 'networking.k8s.io/v1',
+        'kind': 'NetworkPolicy',
+        'metadata': {'name': name, 'namespace': 'shop', 'labels': labels or policy_labels(name)},
+        'spec': {
+            'podSelector': {'matchLabels': {'app': name}},
+            'policyTypes': ['Ingress', 'Egress'],
+            'ingress': [],
+            'egress': [{'to': [{'podSelector': {'matchLabels': {'app': 'backend'}}}], 'ports': [{'port': port}]}],
+        },
+    }
+
+
+def _stored(policy):
+    """The policy as the API server returns it: server side metadata and the default protocol added."""
+    stored = copy.deepcopy(policy)
+    stored['metadata'].update(uid='0b5e', resourceVersion='42', managedFields=[{'manager': 'aa-pro-max'}])
+    for rule in stored['spec']['egress']:
+        for port in rule['ports']:
+            port['protocol'] = 'TCP'
+    del stored['spec']['ingress']
+    return stored
+
+
+def _cluster(*policies):
+    return {policy['metadata']['name']: _stored(policy) for policy in policies}
+
+
+@pytest.mark.parametrize('current, desired, lines', [
+    pytest.param({}, [_policy('orders')],
+                 ['+ orders', '1 to create, 0 to update, 0 to delete, 0 unchanged'], id='create'),
+    pytest.param(_cluster(_policy('orders')), [_policy('orders')],
+                 ['0 to create, 0 to update, 0 to delete, 1 unchanged'], id='unchanged'),
+    pytest.param(_cluster(_policy('orders')), [_policy('orders', port=9090)],
+                 ['~ orders (spec.egress)', '0 to create, 1 to update, 0 to delete, 0 unchanged'], id='update-spec'),
+    pytest.param(_cluster(_policy('orders')), [_policy('orders', labels={'team': 'shop'})],
+                 ['~ orders (labels)', '0 to create, 1 to update, 0 to delete, 0 unchanged'], id='update-labels'),
+    pytest.param(_cluster(_policy('orders'), _policy('legacy')), [_policy('orders')],
+                 ['- legacy', '0 to create, 0 to update, 1 to delete, 1 unchanged'], id='stale-delete'),
+    pytest.param(_cluster(_policy('orders'), _policy('zz-manual', labels={'team': 'ops'}),
+                          _policy('default-deny', labels={})),
+                 [],
+                 ['- default-deny', '- orders', '- zz-manual', '0 to create, 0 to update, 3 to delete, 0 unchanged'],
+                 id='delete-every-undesired-policy'),
+    pytest.param(_cluster(_policy('orders'), _policy('stock')), [_policy('stock', port=9090), _policy('carts')],
+                 ['+ carts', '~ stock (spec.egress)', '- orders', '1 to create, 1 to update, 1 to delete, 0 unchanged'],
+                 id='mixed'),
+])
+def test_diff_policies(current, desired, lines):
+    assert format_diff(diff_policies(current, desired)) == lines
+
+
+def test_diff_policies_lists_the_objects_of_every_change():
+    current = _cluster(_policy('orders'), _policy('legacy'), _policy('stock'))
+    diff = diff_policies(current, [_policy('stock'), _policy('orders', port=9090), _policy('carts')])
+
+    assert diff == PolicyDiff(create=[_policy('carts')],
+                              update=[(current['orders'], _policy('orders', port=9090), ['spec.egress'])],
+                              delete=['legacy'], unchanged=['stock'])
+
+
+class FakeBackend:
+    def __init__(self, policies):
+        self.policies = policies
+        self.applied = []
+
+    def list_policies(self, namespace):
+        return dict(self.policies)
+
+    def apply_diff(self, diff, namespace):
+        self.applied.append(diff)
+        return [('create', policy['metadata']['name'], None) for policy in diff.create] + \
+               [('delete', name, None) for name in diff.delete]
+
+
+def test_reconcile_with_dry_run_applies_nothing():
+    backend = FakeBackend(_cluster(_policy('legacy')))
+    diff, results = reconcile([_policy('orders')], 'shop', backend, dry_run=True)
+
+    assert format_diff(diff)[:2] == ['+ orders', '- legacy']
+    assert results == [] and backend.applied == []
+
+
+def test_discovery_policy_is_generated_but_never_applied(monkeypatch):
+    discovery = _policy('discovery', labels=policy_labels('discovery', discovery=True))
+    generated = [('orders-network_policy.yaml', _policy('orders')), ('discovery-network_policy.yaml', discovery)]
+    backend = FakeBackend({})
+    monkeypatch.setattr(aa_pro_max, 'generate_network_policies', lambda: generated)
+    monkeypatch.setattr(aa_pro_max, 'get_policy_backend', lambda: backend)
+    monkeypatch.setattr(aa_pro_max, 'NAMESPACE', 'shop')
+
+    diff, results = aa_pro_max.generate_and_apply_network_policies()
+
+    assert [policy['metadata']['name'] for policy in diff.create] == ['orders']
+    assert results == [('create', 'orders', None)]
@@ -0,0 +1,46 @@
+import os
+
+import pytest
+import yaml
+
+import aa_pro_max
+
+
+@pytest.fixture
+def output_directory(tmp_path, monkeypatch):
+    os.makedirs(tmp_path / 'network_policies')
+    monkeypatch.setattr(aa_pro_max, 'OUTPUT_DIRECTORY', str(tmp_path))
+    monkeypatch.setattr(aa_pro_max, 'NAMESPACE', 'shop')
+    return tmp_path
+
+
+@pytest.mark.parametrize('app_label, name', [
+    ('orders-app', 'orders-app'),
+    ('Orders_App', 'ordersapp'),
+    ('My Service.v2', 'myservice.v2'),
+    ('-Payments-', 'payments'),
+])
+def test_service_policy_names_are_sanitized(output_directory, app_label, name):
+    filename, policy = aa_pro_max.generate_service_network_policy(app_label, [('Stock_App', [8080])], ['Gateway_App'])
+
+    assert filename == name + '-service-network_policy.yaml'
+    assert policy['metadata'] == {'name': name + '-policy', 'namespace': 'shop'}
+    with open(output_directory / 'network_policies' / filename) as f:
+        assert yaml.safe_load(f) == policy
+
+
+def test_service_policy_selects_pods_by_the_raw_label(output_directory):
+    _, policy = aa_pro_max.generate_service_network_policy('Orders_App', [('Stock_App', [8080])], ['Gateway_App'])
+
+    spec = policy['spec']
+    assert spec['podSelector'] == {'matchLabels': {'app': 'Orders_App'}}
+    assert spec['ingress'] == [{'from': [{'podSelector': {'matchLabels': {'app': 'Gateway_App'}}}]}]
+    assert spec['egress'][0] == {'to': [{'podSelector': {'matchLabels': {'app': 'Stock_App'}}}],
+                                 'ports': [{'port': 8080}]}
+
+
+def test_pod_policy_names_are_sanitized(output_directory):
+    filename, policy = aa_pro_max.generate_network_policy('10.0.0.1:N/A:Orders_App', ['10.0.0.2:8080'], [])
+
+    assert filename == '10.0.0.1-na-ordersapp-network_policy.yaml'
+    assert policy['metadata']['name'] == '10.0.0.1-na-ordersapp-policy'
@@ -0,0 +1,260 @@
+from array import array
+
+
+class Topology:
+    """Pods of the services of an application and which service calls which.
+
+    Services are interned to integer IDs and pods live in array-backed tables (one row per pod
+    IP), so memory grows with services + pods. Calls are only stored between services; the
+    pod level edges (every pod of the caller to every pod of the callee) are derived on demand.
+    """
+
+    def __init__(self):
+        # Service name <-> service ID
+        self.service_ids = {}
+        self.service_names = []
+        # Pod ID -> service ID, port (0 when unknown or disabled) and IP
+        self.pod_service = array('I')
+        self.pod_port = array('I')
+        self.pod_ip = []
+        # Pod IP -> pod ID
+        self.pod_ids = {}
+        # Service ID -> pod IDs, number of instances reported by the orchestrator, called/calling service IDs
+        self.service_pods = []
+        self.service_instances = []
+        self.service_successors = []
+        self.service_predecessors = []
+        # Extra per-pod attributes (e.g. namespace), pod ID -> dict; empty for most topologies
+        self.pod_attributes = {}
+
+    def __len__(self):
+        return len(self.pod_ip)
+
+    def service_id(self, name):
+        """Return the ID of a service, interning it on first use."""
+        service = self.service_ids.get(name)
+        if service is None:
+            service = len(self.service_names)
+            self.service_ids[name] = service
+            self.service_names.append(name)
+            self.service_pods.append(array('I'))
+            self.service_instances.append(0)
+            self.service_successors.append(set())
+            self.service_predecessors.append(set())
+        return service
+
+    def add_pod(self, service_name, ip, port, **attributes):
+        """Add a pod to a service and return its ID.
+
+        An IP that is already known is moved to the new service with the new port, as the
+        last registration of an address wins.
+        """
+        service = self.service_id(service_name)
+        port = int(port) if str(port).isdigit() else 0
+        pod = self.pod_ids.get(ip)
+        if pod is None:
+            pod = len(self.pod_ip)
+            self.pod_ids[ip] = pod
+            self.pod_ip.append(ip)
+            self.pod_service.append(service)
+            self.pod_port.append(port)
+        else:
+            old_pods = self.service_pods[self.pod_service[pod]]
+            del old_pods[old_pods.index(pod)]
+            self.pod_service[pod] = service
+            self.pod_port[pod] = port
+        self.service_pods[service].append(pod)
+        # Attributes that are not known (None) are left out
+        attributes = {key: value for key, value in attributes.items() if value is not None}
+        if attributes:
+            self.pod_attributes[pod] = attributes
+        else:
+            self.pod_attributes.pop(pod, None)
+        return pod
+
+    def set_instances(self, service_name, instances):
+        self.service_instances[self.service_id(service_name)] = instances
+
+    def add_call(self, caller, callee):
+        """Record that service `caller` calls service `callee`."""
+        caller_id = self.service_id(caller)
+        callee_id = self.service_id(callee)
+        self.service_successors[caller_id].add(callee_id)
+        self.service_predecessors[callee_id].add(caller_id)
+
+    def service_calls(self):
+        """Yield the (caller ID, callee ID) service edges whose services both have pods, in a stable order."""
+        for caller, callees in enumerate(self.service_successors):
+            if not self.service_pods[caller]:
+                continue
+            for callee in sorted(callees):
+                if self.service_pods[callee]:
+                    yield caller, callee
+
+    def pod_edges(self):
+        """Yield the (caller pod ID, callee pod ID) edges; every pod of a caller may call every pod of the callee."""
+        for caller, callee in self.service_calls():
+            callee_pods = self.service_pods[callee]
+            for caller_pod in self.service_pods[caller]:
+                for callee_pod in callee_pods:
+                    yield caller_pod, callee_pod
+
+    def _neighbour_pods(self, pod, neighbours):
+        pods = []
+        for service in sorted(neighbours[self.pod_service[pod]]):
+            if self.service_pods[service]:
+                pods.extend(self.service_pods[service])
+        return pods
+
+    def successor_pods(self, pod):
+        """Return the pods the given pod may call (the pods of every service its service calls)."""
+        return self._neighbour_pods(pod, self.service_successors)
+
+    def predecessor_pods(self, pod):
+        """Return the pods that may call the given pod."""
+        return self._neighbour_pods(pod, self.service_predecessors)
+
+    def connected_pods(self):
+        """Return the IDs of the pods that take part in at least one call, in pod order."""
+        services = set()
+        for caller, callee in self.service_calls():
+            services.add(caller)
+            services.add(callee)
+        return [pod for pod in range(len(self.pod_ip)) if self.pod_service[pod] in services]
+
+    def service_ports(self, service_name):
+        """Return the sorted, known ports of the pods of a service ([] for an unknown service)."""
+        service = self.service_ids.get(service_name)
+        if service is None:
+            return []
+        return sorted({self.pod_port[pod] for pod in self.service_pods[service]} - {0})
+
+    def pod_service_name(self, pod):
+        return self.service_names[self.pod_service[pod]]
+
+    def pod_address(self, pod):
+        """'<ip>:<port>' of a pod, with 'N/A' for an unknown port."""
+        port = self.pod_port[pod]
+        return f"{self.pod_ip[pod]}:{port if port else 'N/A'}"
+
+    def pod_key(self, pod):
+        """Node name of a pod in the IP graph, '<ip>:<port> - <service>'."""
+        return f"{self.pod_address(pod)} - {self.pod_service_name(pod)}"
+
+    def to_networkx(self, with_instances=False):
+        """Build the pod level networkx.DiGraph of the topology (e.g. to render it with pyvis)."""
+        import networkx as nx
+
+        ip_graph = nx.DiGraph()
+        keys = {}
+        for pod in self.connected_pods():
+            service = self.pod_service[pod]
+            attributes = dict(group=self.service_names[service], size=20, ip=self.pod_ip[pod],
+                              port=self.pod_port[pod] or 'N/A')
+            if with_instances:
+                attributes['instances'] = self.service_instances[service]
+            attributes.update(self.pod_attributes.get(pod, {}))
+            keys[pod] = self.pod_key(pod)
+            ip_graph.add_node(keys[pod], **attributes)
+        ip_graph.add_edges_from((keys[caller_pod], keys[callee_pod]) for caller_pod, callee_pod in self.pod_edges())
+        return ip_graph
+
+    def to_service_networkx(self):
+        """Build the service level networkx.DiGraph of the topology: one node per service, one edge per call.
+
+        Nodes carry the number of pods (`pods`), the replica count reported by the orchestrator
+        (`instances`) and the ports the service listens on; edges carry the ports of the callee,
+        so the graph size depends on the number of services only.
+        """
+        import networkx as nx
+
+        service_graph = nx.DiGraph()
+        services = sorted({service for call in self.service_calls() for service in call})
+        for service in services:
+            name = self.service_names[service]
+            pods = self.service_pods[service]
+            attributes = dict(group=name, size=20 + 5 * min(len(pods), 6), pods=len(pods),
+                              instances=self.service_instances[service] or len(pods),
+                              ports=self.service_ports(name), label=f'{name} ({len(pods)})')
+            namespaces = sorted({self.pod_attributes[pod]['namespace'] for pod in pods
+                                 if 'namespace' in self.pod_attributes.get(pod, {})})
+            if namespaces:
+                attributes['namespace'] = namespaces[0]
+            service_graph.add_node(name, **attributes)
+        for caller, callee in self.service_calls():
+            ports = self.service_ports(self.service_names[callee])
+            service_graph.add_edge(self.service_names[caller], self.service_names[callee], ports=ports,
+                                   title='ports: ' + (', '.join(map(str, ports)) or 'N/A'))
+        return service_graph
+
+
+class ServiceGraph:
+    """Directed graph of the calls between app labels, as found by the analysis of the Docker images.
+
+    Covers the part of the networkx.DiGraph API the analysis uses (nodes and edges in insertion order),
+    so importing and running the analysis does not load networkx; to_networkx() converts it for the
+    dashboard.
+    """
+
+    def __init__(self):
+        # Node -> successors / predecessors, as dicts used as insertion-ordered sets
+        self._successors = {}
+        self._predecessors = {}
+
+    def add_node(self, node):
+        if node not in self._successors:
+            self._successors[node] = {}
+            self._predecessors[node] = {}
+
+    def add_nodes_from(self, nodes):
+        for node in nodes:
+            self.add_node(node)
+
+    def add_edge(self, source, target):
+        self.add_node(source)
+        self.add_node(target)
+        self._successors[source][target] = None
+        self._predecessors[target][source] = None
+
+    def add_edges_from(self, edges):
+        for source, target in edges:
+            self.add_edge(source, target)
+
+    def clear(self):
+        self._successors.clear()
+        self._predecessors.clear()
+
+    def nodes(self):
+        return list(self._successors)
+
+    def edges(self):
+        return [(source, target) for source, targets in self._successors.items() for target in targets]
+
+    out_edges = edges
+
+    def successors(self, node):
+        return iter(self._successors[node])
+
+    def predecessors(self, node):
+        return iter(self._predecessors[node])
+
+    def number_of_nodes(self):
+        return len(self._successors)
+
+    def number_of_edges(self):
+        return sum(map(len, self._successors.values()))
+
+    def __contains__(self, node):
+        return node in self._successors
+
+    def __len__(self):
+        return len(self._successors)
+
+    def to_networkx(self):
+        """Build a networkx.DiGraph with the same nodes and edges, in the same order."""
+        import networkx as nx
+
+        nx_graph = nx.DiGraph()
+        nx_graph.add_nodes_from(self._successors)
+        nx_graph.add_edges_from(self.edges())
+        return nx_graph
@@ -0,0 +1,72 @@
+import asyncio
+import logging
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# What one collection found: the Eureka instances, app label -> [(pod IP, port, namespace)] and the
+# errors of the calls that failed or timed out (their previous result is used instead)
+Collection = namedtuple('Collection', ['instances', 'pods_by_label', 'errors'])
+
+
+class TopologyCollector:
+    """Fetches the Eureka registry and the pods of every app label concurrently.
+
+    The Eureka client runs in a worker thread while the kubectl list calls of the pod inventory
+    run as asyncio subprocesses, at most `concurrency` calls at a time, so a collection takes as
+    long as its slowest call instead of the sum of all of them. Every call is given up after
+    `timeout` seconds. A call that fails or times out does not fail the collection: its previous
+    result is used and the error is reported in Collection.errors.
+    """
+
+    def __init__(self, eureka_client, pod_inventory, concurrency=8, timeout=30):
+        self.eureka_client = eureka_client
+        self.pod_inventory = pod_inventory
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # The Eureka client is blocking; a call that timed out may still hold a thread for a while
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='topology-collector')
+        # Instances of the last successful Eureka fetch
+        self._instances = []
+
+    async def _eureka_instances(self, semaphore):
+        async with semaphore:
+            loop = asyncio.get_running_loop()
+            return await asyncio.wait_for(loop.run_in_executor(self._executor, self.eureka_client.instances),
+                                          self.timeout)
+
+    async def collect_async(self):
+        import requests
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        instances, pod_errors = await asyncio.gather(self._eureka_instances(semaphore),
+                                                     self.pod_inventory.list_async(semaphore, self.timeout),
+                                                     return_exceptions=True)
+        errors = []
+        if isinstance(instances, (asyncio.TimeoutError, requests.RequestException, ET.ParseError)):
+            # A timeout has no message of its own
+            errors.append(f'fetching the Eureka registry failed: {str(instances) or type(instances).__name__}')
+            metrics.increment('collection_errors', source='eureka')
+            instances = self._instances
+        elif isinstance(instances, BaseException):
+            raise instances
+        else:
+            self._instances = instances
+        if isinstance(pod_errors, BaseException):
+            raise pod_errors
+        errors.extend(pod_errors)
+        if pod_errors:
+            metrics.increment('collection_errors', len(pod_errors), source='kubectl')
+        return Collection(instances, self.pod_inventory.indexed_pods_by_label(), errors)
+
+    def collect(self):
+        """Run one collection on a new event loop (the caller must not be running one) and return the Collection."""
+        with metrics.timer('collect'):
+            collection = asyncio.run(self.collect_async())
+        for error in collection.errors:
+            logger.warning('%s, using its previous result', error)
+        return collection
@@ -0,0 +1,87 @@
+import logging
+import threading
+import time
+from collections import namedtuple
+
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# One immutable version of the graphs the dashboard shows. The graphs are frozen networkx graphs;
+# version only changes when one of them changed, and created is the time that version was built.
+# k8s_services is the service level (aggregated) view of the k8s graph.
+GRAPHS = ('eureka', 'k8s', 'services', 'k8s_services')
+TopologySnapshot = namedtuple('TopologySnapshot', ('version', 'created') + GRAPHS)
+
+
+def _graph_key(graph):
+    return sorted(graph.nodes(data=True), key=lambda node: str(node[0])), sorted(graph.edges(), key=str)
+
+
+class TopologyRefresher:
+    """Rebuilds the dashboard graphs in a background thread and serves them as snapshots.
+
+    `build` returns a dict with the graphs named in GRAPHS. It runs every `interval`
+    seconds, or earlier when trigger() is called (at most once every `min_interval` seconds, so a
+    burst of changes is coalesced into one rebuild). Requests only ever read the latest snapshot,
+    so their latency does not depend on the size of the cluster. A failed build keeps the previous
+    snapshot.
+    """
+
+    def __init__(self, build, interval=60, min_interval=1):
+        self.build = build
+        self.interval = interval
+        self.min_interval = min_interval
+        self._snapshot = None
+        # Time of the last successful build, even when it did not change the snapshot
+        self.refreshed = None
+        self._ready = threading.Event()
+        self._trigger = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='topology-refresher', daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._trigger.set()
+
+    def trigger(self):
+        """Rebuild the snapshot as soon as possible, e.g. because the cluster changed."""
+        self._trigger.set()
+
+    def snapshot(self, timeout=None):
+        """Return the latest snapshot, waiting for the first one to be built; None if it is not ready in time."""
+        self._ready.wait(timeout)
+        return self._snapshot
+
+    def refresh(self):
+        """Build the graphs now and publish them as a new snapshot if they changed."""
+        import networkx as nx
+
+        graphs = {name: nx.freeze(graph) for name, graph in self.build().items()}
+        previous = self._snapshot
+        if previous is None or any(_graph_key(graphs[name]) != _graph_key(getattr(previous, name))
+                                   for name in GRAPHS):
+            version = 1 if previous is None else previous.version + 1
+            self._snapshot = TopologySnapshot(version, time.time(), *(graphs[name] for name in GRAPHS))
+        self.refreshed = time.time()
+        self._ready.set()
+        return self._snapshot
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.time()
+            try:
+                self.refresh()
+            except Exception as e:
+                metrics.increment('refresh_failures')
+                logger.error('Failed to refresh the topology, keeping the previous snapshot: %s', e)
+            self._trigger.wait(self.interval)
+            self._trigger.clear()
+            # Coalesce triggers that arrive right after a rebuild
+            self._stop.wait(max(0, self.min_interval - (time.time() - started)))